@@ -0,0 +1,245 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import db_connection
+from metrics import metrics
+
+CHANGES_COLLECTION = "account_changes"
+COUNTERS_COLLECTION = "counters"
+VERSION_COUNTER_ID = "account_version"
+
+def account_entry(user_id, full_name):
+    """Account picker entry, shared by the full list and the delta feed."""
+    return {
+        "id": user_id,
+        "fullName": full_name,
+        "type": "EXISTING",
+        "picture": None,
+        "backendPictureUrl": f"http://localhost:{os.getenv('PORT', 8000)}/api/accounts/custom/{user_id}/image"
+    }
+
+class AccountFeed:
+    """Versioned log of account add/remove deltas for the account picker.
+
+    Every change takes the next value of a shared counter document, so the
+    version is monotonic across all worker processes. Clients hold the last
+    version they applied and ask for `changes_since(version)`; when that
+    version is older than the retained log they are told to reset and
+    re-fetch the full list. A change whose version was allocated but not yet
+    written by another worker would leave a gap, so reads stop at the first
+    fresh gap and pick the rest up on the next poll.
+
+    SSE streams do not poll Mongo themselves: one poller per process reads
+    the log every `poll_interval` (or as soon as a local write wakes it) and
+    fans each delta out to every subscribed stream. A stream only queries on
+    its own to catch up, when it connects or falls behind the shared poller.
+    """
+
+    def __init__(self, retention_days=7, gap_grace=5.0, poll_interval=2.0, heartbeat_interval=15.0):
+        self.retention_days = retention_days
+        self.gap_grace = gap_grace
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self._loop = None
+        self._changed = None
+        self._subscribers = {}
+        self._polled_version = 0
+        self._poller = None
+
+    @property
+    def changes_collection(self):
+        return db_connection.get_collection(CHANGES_COLLECTION)
+
+    @property
+    def counters_collection(self):
+        return db_connection.get_collection(COUNTERS_COLLECTION)
+
+    def ensure_indexes(self):
+        self.changes_collection.create_index([("version", ASCENDING)], unique=True)
+        self.changes_collection.create_index("created_at", expireAfterSeconds=self.retention_days * 86400)
+
+    def start(self):
+        """Bind to the running event loop and start the shared poller behind the SSE streams."""
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        if self._poller is None:
+            self._poller = self._loop.create_task(self._poll())
+
+    def stop(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+
+    def current_version(self):
+        counter = self.counters_collection.find_one({"_id": VERSION_COUNTER_ID})
+        return counter["value"] if counter else 0
+
+    def _next_version(self):
+        try:
+            counter = self.counters_collection.find_one_and_update(
+                {"_id": VERSION_COUNTER_ID},
+                {"$inc": {"value": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Two first-ever writers raced on the upsert; the loser just retries.
+            return self._next_version()
+        return counter["value"]
+
+    def _record(self, op, user_id, account=None):
+        version = self._next_version()
+        self.changes_collection.insert_one({
+            "version": version,
+            "op": op,
+            "user_id": user_id,
+            "account": account,
+            "created_at": datetime.utcnow(),
+        })
+        metrics.inc("account_feed_changes_total", op=op)
+        self._notify()
+        return version
+
+    def record_added(self, user_id, full_name):
+        return self._record("add", user_id, account_entry(user_id, full_name))
+
+    def record_removed(self, user_id):
+        return self._record("remove", user_id)
+
+    def _notify(self):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            pass
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def changes_since(self, since, limit=500):
+        """Return {"version", "changes"} after `since`, or {"version", "reset": True} if it is too old."""
+        current = self.current_version()
+        if since >= current:
+            return {"version": since, "changes": []}
+
+        docs = list(
+            self.changes_collection.find({"version": {"$gt": since}}, {"_id": 0})
+            .sort("version", ASCENDING)
+            .limit(limit)
+        )
+        if not docs or (docs[0]["version"] > since + 1 and self._is_settled(docs[0])):
+            # The change right after `since` has expired from the log.
+            return {"version": current, "reset": True}
+
+        changes = []
+        version = since
+        stale_before = datetime.utcnow() - timedelta(seconds=self.gap_grace)
+        for doc in docs:
+            if doc["version"] != version + 1 and doc["created_at"] > stale_before:
+                break
+            changes.append({"version": doc["version"], "op": doc["op"], "id": doc["user_id"], "account": doc["account"]})
+            version = doc["version"]
+        return {"version": version, "changes": changes}
+
+    def _is_settled(self, doc):
+        return doc["created_at"] <= datetime.utcnow() - timedelta(seconds=self.gap_grace)
+
+    async def _wait_for_change(self, changed, timeout):
+        if changed is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _poll(self):
+        version = None
+        while True:
+            changed = self._changed
+            if not self._subscribers:
+                # Nobody listening: skip the query and restart from the subscribers' position later.
+                version = None
+            else:
+                if version is None:
+                    version = min(self._subscribers.values())
+                try:
+                    delta = await asyncio.to_thread(self.changes_since, version)
+                except Exception as e:
+                    print(f"⚠️ Account feed poll failed: {e}")
+                    delta = None
+                if delta is not None and (delta.get("reset") or delta["changes"]):
+                    version = self._polled_version = delta["version"]
+                    for queue in self._subscribers:
+                        queue.put_nowait(delta)
+            await self._wait_for_change(changed, self.poll_interval)
+
+    async def stream(self, since, snapshot_builder, fetch):
+        """Yield SSE frames: a snapshot when needed, then deltas as they happen.
+
+        `fetch` runs a blocking call off the event loop (run_in_threadpool).
+        Deltas come from the shared poller; the stream reads the log itself
+        only while it is behind it. Each frame carries the version as its SSE
+        id, so a reconnecting EventSource resumes from Last-Event-ID on its own.
+        """
+        metrics.inc("account_feed_streams_total")
+        queue = asyncio.Queue()
+        # Subscribe before catching up, so nothing written in between is missed.
+        self._subscribers[queue] = since if since is not None else self._polled_version
+        try:
+            version = since
+            if version is None:
+                version = await fetch(self.current_version)
+                self._subscribers[queue] = version
+                yield self._frame("snapshot", version, {"version": version, "accounts": await fetch(snapshot_builder)})
+
+            last_sent = time.monotonic()
+            behind = True
+            while True:
+                if behind:
+                    delta = await fetch(self.changes_since, version)
+                else:
+                    timeout = max(0.0, self.heartbeat_interval - (time.monotonic() - last_sent))
+                    try:
+                        delta = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        yield ": keep-alive\n\n"
+                        last_sent = time.monotonic()
+                        continue
+
+                if delta.get("reset"):
+                    version = delta["version"]
+                    yield self._frame("snapshot", version, {"version": version, "accounts": await fetch(snapshot_builder)})
+                    last_sent = time.monotonic()
+                    behind = False
+                else:
+                    changes = [change for change in delta["changes"] if change["version"] > version]
+                    if changes and changes[0]["version"] != version + 1:
+                        # The shared poller is ahead of this stream; catch up from the log.
+                        behind = True
+                        continue
+                    progressed = bool(changes)
+                    if progressed:
+                        version = changes[-1]["version"]
+                        yield self._frame("changes", version, {"version": version, "changes": changes})
+                        last_sent = time.monotonic()
+                    behind = progressed and version < self._polled_version
+                self._subscribers[queue] = version
+        finally:
+            self._subscribers.pop(queue, None)
+
+    @staticmethod
+    def _frame(event, version, payload):
+        return f"id: {version}\nevent: {event}\ndata: {json.dumps(payload)}\n\n"
+
+account_feed = AccountFeed(
+    retention_days=int(os.getenv("ACCOUNT_FEED_RETENTION_DAYS", 7)),
+    poll_interval=float(os.getenv("ACCOUNT_FEED_POLL_SECONDS", 2.0)),
+)
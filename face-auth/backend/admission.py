@@ -0,0 +1,232 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from metrics import metrics
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of queued."""
+
+    def __init__(self, endpoint_class, reason, retry_after):
+        super().__init__(f"{endpoint_class} request shed ({reason})")
+        self.endpoint_class = endpoint_class
+        self.reason = reason
+        self.retry_after = retry_after
+
+class GradientLimiter:
+    """Adaptive concurrency limit for one endpoint class, measured against its own baseline.
+
+    The baseline is the lowest latency seen over the last `window` samples,
+    i.e. what this class costs when nothing is queued in front of it. After
+    every request the limit moves towards `limit * min_rtt / rtt + sqrt(limit)`:
+    it grows while latency stays near the baseline and shrinks as soon as
+    latency climbs above it, however slow the class naturally is. The window
+    rolls over so the baseline can follow a real change in cost. Requests
+    over the limit wait in a bounded FIFO queue. `priority` (lower wins) and
+    `reserved` say how this class shares the controller's capacity.
+    """
+
+    def __init__(self, name, max_queue, priority=0, reserved=0, initial_limit=8, min_limit=2, max_limit=64,
+                 window=200, tolerance=1.5, smoothing=0.2, backoff=0.9):
+        self.name = name
+        self.max_queue = max_queue
+        self.priority = priority
+        self.reserved = reserved
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.window = window
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self.in_flight = 0
+        self.waiters = deque()
+        self.rtt = None
+        self.min_rtt = None
+        self._window_min = math.inf
+        self._window_samples = 0
+
+    def has_capacity(self):
+        return self.in_flight < int(self.limit)
+
+    def _observe_rtt(self, latency):
+        self.rtt = latency if self.rtt is None else 0.9 * self.rtt + 0.1 * latency
+        self._window_min = min(self._window_min, latency)
+        self._window_samples += 1
+        if self.min_rtt is None or latency < self.min_rtt:
+            self.min_rtt = latency
+        if self._window_samples >= self.window:
+            self.min_rtt = self._window_min
+            self._window_min = math.inf
+            self._window_samples = 0
+
+    def adjust(self, latency, failed):
+        if failed:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            return
+        self._observe_rtt(latency)
+        gradient = max(0.5, min(1.0, self.tolerance * self.min_rtt / max(self.rtt, 1e-6)))
+        target = self.limit * gradient + math.sqrt(self.limit)
+        limit = (1 - self.smoothing) * self.limit + self.smoothing * target
+        self.limit = max(self.min_limit, min(self.max_limit, limit))
+
+    def snapshot(self):
+        return {
+            "in_flight": self.in_flight,
+            "limit": round(self.limit, 2),
+            "saturation": round(self.in_flight / max(self.limit, 1), 3),
+            "queued": len(self.waiters),
+            "latency_seconds": round(self.rtt, 4) if self.rtt is not None else None,
+            "min_latency_seconds": round(self.min_rtt, 4) if self.min_rtt is not None else None,
+        }
+
+class AdmissionController:
+    """Shared capacity for the expensive endpoints, with one adaptive limiter per class.
+
+    Each class (login, register) gets its own GradientLimiter, so a slow
+    class backs off on its own latency without throttling the others, but
+    all classes draw from one pool of `capacity` slots. Whenever a slot
+    frees up, queued requests of the highest-priority class are admitted
+    first, and the `reserved` slots of a class can't be taken by any class
+    of lower priority: logins keep getting through while registrations
+    queue and are shed. When a class's queue is full, or a waiter outlives
+    `max_wait`, the request is rejected straight away so the client can
+    retry after `Retry-After` instead of timing out.
+    """
+
+    def __init__(self, classes, capacity=64, max_wait=5.0, **limiter_options):
+        # classes: {name: {"max_queue": int, "priority": int, "reserved": int, ...GradientLimiter overrides}}
+        self.limiters = {
+            name: GradientLimiter(name, **{**limiter_options, **config})
+            for name, config in classes.items()
+        }
+        self._by_priority = sorted(self.limiters.values(), key=lambda limiter: limiter.priority)
+        self.capacity = capacity
+        self.in_flight = 0
+        self.max_wait = max_wait
+        metrics.describe("admission_queue_seconds", "Time spent waiting for an admission slot")
+        metrics.describe("admission_shed_total", "Requests rejected by admission control")
+        metrics.describe("admission_limit", "Current adaptive concurrency limit, per endpoint class")
+        metrics.describe("admission_shared_in_flight", "Requests holding a slot of the shared capacity")
+        for limiter in self.limiters.values():
+            self._publish(limiter)
+
+    def _publish(self, limiter):
+        metrics.set_gauge("admission_limit", round(limiter.limit, 2), endpoint_class=limiter.name)
+        metrics.set_gauge("admission_in_flight", limiter.in_flight, endpoint_class=limiter.name)
+        metrics.set_gauge("admission_queued", len(limiter.waiters), endpoint_class=limiter.name)
+        metrics.set_gauge("admission_shared_in_flight", self.in_flight)
+
+    def snapshot(self):
+        return {name: limiter.snapshot() for name, limiter in self.limiters.items()}
+
+    def _can_admit(self, limiter):
+        # Slots reserved for higher-priority classes are off limits to this one.
+        held_back = sum(other.reserved for other in self._by_priority if other.priority < limiter.priority)
+        return limiter.has_capacity() and self.in_flight < self.capacity - held_back
+
+    def _grant(self, limiter):
+        limiter.in_flight += 1
+        self.in_flight += 1
+
+    def _retry_after(self, limiter):
+        backlog = len(limiter.waiters) + 1
+        return max(1, math.ceil(backlog * (limiter.rtt or 1.0) / max(limiter.limit, 1)))
+
+    def _reject(self, limiter, reason):
+        metrics.inc("admission_shed_total", endpoint_class=limiter.name, reason=reason)
+        raise AdmissionRejected(limiter.name, reason, self._retry_after(limiter))
+
+    def _wake_next(self):
+        for limiter in self._by_priority:
+            while limiter.waiters and self._can_admit(limiter):
+                future = limiter.waiters.popleft()
+                if future.done():
+                    continue
+                self._grant(limiter)
+                future.set_result(True)
+            self._publish(limiter)
+
+    async def _acquire(self, limiter, max_wait):
+        # Anything queued that could run has already been woken, so an empty
+        # queue for this class means nobody with a better claim is waiting.
+        if self._can_admit(limiter) and not limiter.waiters:
+            self._grant(limiter)
+            self._publish(limiter)
+            return
+
+        if len(limiter.waiters) >= limiter.max_queue:
+            self._reject(limiter, "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        limiter.waiters.append(future)
+        self._publish(limiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=max_wait)
+        except asyncio.TimeoutError:
+            self._abandon(limiter, future)
+            self._reject(limiter, "queue_timeout")
+        except asyncio.CancelledError:
+            self._abandon(limiter, future)
+            raise
+
+    def _abandon(self, limiter, future):
+        if future.done() and not future.cancelled():
+            # Admitted just as the wait ended; hand the slot back.
+            self._release_slot(limiter)
+            return
+        future.cancel()
+        try:
+            limiter.waiters.remove(future)
+        except ValueError:
+            pass
+        self._publish(limiter)
+
+    def _release_slot(self, limiter):
+        limiter.in_flight -= 1
+        self.in_flight -= 1
+        self._wake_next()
+
+    @asynccontextmanager
+    async def admit(self, endpoint_class, deadline=None):
+        limiter = self.limiters[endpoint_class]
+        max_wait = self.max_wait
+        if deadline is not None:
+            max_wait = min(max_wait, deadline.remaining())
+        queued_at = time.monotonic()
+        await self._acquire(limiter, max_wait)
+        started = time.monotonic()
+        metrics.observe("admission_queue_seconds", started - queued_at, endpoint_class=endpoint_class)
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            limiter.adjust(time.monotonic() - started, failed)
+            metrics.inc("admission_completed_total", endpoint_class=endpoint_class)
+            self._release_slot(limiter)
+
+admission_controller = AdmissionController(
+    classes={
+        "login": {
+            "priority": 0,
+            "reserved": int(os.getenv("ADMISSION_LOGIN_RESERVED", 8)),
+            "max_queue": int(os.getenv("ADMISSION_LOGIN_QUEUE", 64)),
+            "initial_limit": int(os.getenv("ADMISSION_LOGIN_INITIAL_LIMIT", 8)),
+            "max_limit": int(os.getenv("ADMISSION_LOGIN_MAX_LIMIT", 64)),
+        },
+        "register": {
+            "priority": 1,
+            "max_queue": int(os.getenv("ADMISSION_REGISTER_QUEUE", 16)),
+            "initial_limit": int(os.getenv("ADMISSION_REGISTER_INITIAL_LIMIT", 4)),
+            "max_limit": int(os.getenv("ADMISSION_REGISTER_MAX_LIMIT", 32)),
+        },
+    },
+    capacity=int(os.getenv("ADMISSION_CAPACITY", 64)),
+    tolerance=float(os.getenv("ADMISSION_LATENCY_TOLERANCE", 1.5)),
+    max_wait=float(os.getenv("ADMISSION_MAX_WAIT", 5.0)),
+)
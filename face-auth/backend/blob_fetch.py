@@ -0,0 +1,277 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import requests
+
+class BlobStoreUnavailable(Exception):
+    """Raised when a blob cannot be fetched within its deadline or the store is failing fast."""
+
+class Deadline:
+    """Absolute time budget for one request, passed down to every blocking call it makes."""
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+class LatencyTracker:
+    """Rolling window of recent fetch latencies used to pick the hedge delay."""
+
+    def __init__(self, window=256, default=0.25, minimum=0.02):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.default = default
+        self.minimum = minimum
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q):
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < 20:
+            return self.default
+        index = min(len(samples) - 1, int(q * len(samples)))
+        return max(self.minimum, samples[index])
+
+class BlobMissing(BlobStoreUnavailable):
+    """The store answered, but the blob is missing or forbidden."""
+
+class DeadlineExhausted(Exception):
+    """The caller's budget ran out; says nothing about the health of the store."""
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures; one trial request is let through after `reset_timeout`.
+
+    Every `allow()` that returns True must be followed by exactly one of
+    `record_success()`, `record_failure()` or `release()`, or a half-open
+    breaker would wait for its trial forever.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print("✅ Blob store recovered, circuit closed")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def release(self):
+        """Give back an allowed call that ended without telling us anything about the store."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"⚠️ Blob store degraded, circuit open for {self.reset_timeout:.0f}s (cache-only mode)")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+class BlobCache:
+    """Byte-bounded LRU of encrypted blobs keyed by public id."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, url=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            cached_url, data = entry
+            # A different URL means the blob was re-uploaded (Cloudinary URLs are versioned).
+            if url and cached_url and url != cached_url:
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, url, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._size -= len(previous[1])
+            self._entries[key] = (url, data)
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def discard(self, key):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._size -= len(previous[1])
+
+class HedgedBlobFetcher:
+    """Fetches blobs with per-call timeouts, a hedged second request and a circuit breaker.
+
+    If the first request has not answered after the recent p95 latency, an
+    identical request is sent and whichever finishes first wins. While the
+    breaker is open, only blobs already in the cache are served.
+    """
+
+    def __init__(self, connect_timeout=2.0, read_timeout=5.0, hedge_quantile=0.95, max_workers=16, cache=None, breaker=None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.hedge_quantile = hedge_quantile
+        self.latency = LatencyTracker()
+        self.breaker = breaker or CircuitBreaker()
+        self.cache = cache or BlobCache()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="blob-fetch")
+        self.hedged_requests = 0
+
+    def _timeout(self, deadline):
+        read_timeout = self.read_timeout
+        if deadline is not None:
+            read_timeout = min(read_timeout, deadline.remaining())
+        return (min(self.connect_timeout, read_timeout), read_timeout)
+
+    def _get(self, url, deadline):
+        started = time.monotonic()
+        timeout = self._timeout(deadline)
+        try:
+            response = self.session.get(url, timeout=timeout)
+        except requests.Timeout as e:
+            if timeout[1] < self.read_timeout:
+                # Cut short by the caller's deadline, not by the store being slow.
+                raise DeadlineExhausted(str(e)) from e
+            raise
+        response.raise_for_status()
+        self.latency.observe(time.monotonic() - started)
+        return response.content
+
+    def fetch(self, key, url=None, deadline=None, resolve_url=None):
+        """Return the blob for `key`, from the cache or the store.
+
+        `resolve_url(deadline)` is called to look the URL up when none is
+        given; it counts as part of the fetch for the circuit breaker.
+        Running out of `deadline` raises BlobStoreUnavailable but is never
+        held against the store.
+        """
+        cached = self.cache.get(key, url)
+        if cached is not None:
+            return cached
+        if deadline is not None and deadline.expired():
+            raise BlobStoreUnavailable(f"deadline exceeded before fetching {key}")
+        if not self.breaker.allow():
+            raise BlobStoreUnavailable(f"blob store circuit open, {key} not cached")
+
+        outcome = None
+        try:
+            if url is None:
+                url = resolve_url(deadline)
+            data = self._fetch_hedged(key, url, deadline)
+            outcome = "success"
+        except BlobMissing:
+            outcome = "success"
+            raise
+        except DeadlineExhausted as e:
+            raise BlobStoreUnavailable(f"deadline exceeded fetching {key}") from e
+        except Exception as e:
+            if deadline is None or not deadline.expired():
+                outcome = "failure"
+            raise BlobStoreUnavailable(f"fetching {key} failed: {e}") from e
+        finally:
+            if outcome == "success":
+                self.breaker.record_success()
+            elif outcome == "failure":
+                self.breaker.record_failure()
+            else:
+                self.breaker.release()
+        self.cache.put(key, url, data)
+        return data
+
+    def _fetch_hedged(self, key, url, deadline):
+        hedge_delay = self.latency.percentile(self.hedge_quantile)
+        if deadline is not None:
+            end = deadline.expires_at
+        else:
+            end = time.monotonic() + self.connect_timeout + self.read_timeout
+        futures = [self._executor.submit(self._get, url, deadline)]
+        done, _ = wait(futures, timeout=min(hedge_delay, max(0.0, end - time.monotonic())))
+        if not done and end - time.monotonic() > 0:
+            self.hedged_requests += 1
+            futures.append(self._executor.submit(self._get, url, deadline))
+
+        pending = set(futures)
+        last_error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                try:
+                    data = future.result()
+                except requests.HTTPError as e:
+                    if e.response is not None and e.response.status_code < 500:
+                        # The store answered; the blob itself is missing or forbidden.
+                        raise BlobMissing(f"fetching {key} failed: {e}") from e
+                    last_error = e
+                    continue
+                except Exception as e:
+                    last_error = e
+                    continue
+                for other in pending:
+                    other.cancel()
+                return data
+
+        for future in pending:
+            future.cancel()
+        if isinstance(last_error, DeadlineExhausted) or (last_error is None and deadline is not None):
+            raise DeadlineExhausted(f"deadline exceeded fetching {key}")
+        raise last_error or requests.Timeout(f"no answer for {key} within {self.read_timeout:.1f}s")
+
+blob_fetcher = HedgedBlobFetcher(
+    connect_timeout=float(os.getenv("BLOB_CONNECT_TIMEOUT", 2.0)),
+    read_timeout=float(os.getenv("BLOB_READ_TIMEOUT", 5.0)),
+    cache=BlobCache(max_bytes=int(os.getenv("BLOB_CACHE_MB", 64)) * 1024 * 1024),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("BLOB_BREAKER_FAILURES", 5)),
+        reset_timeout=float(os.getenv("BLOB_BREAKER_RESET", 30.0)),
+    ),
+)
@@ -1,8 +1,10 @@
 import os
 import cloudinary
 import cloudinary.uploader
+import cloudinary.api
 from dotenv import load_dotenv
-from cryptography.fernet import Fernet
+from envelope import Keyring, FORMAT_NAME, LEGACY_FORMAT_NAME
+from blob_fetch import blob_fetcher
 import sys
 
 load_dotenv()
@@ -12,9 +14,17 @@ class CloudinaryManager:
         self.cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME")
         self.api_key = os.getenv("CLOUDINARY_API_KEY")
         self.api_secret = os.getenv("CLOUDINARY_API_SECRET")
-        self.encryption_key = self.generate_or_load_key()
-        self.cipher = Fernet(self.encryption_key)
+        self._keyring = None
+        # Called with (public_id, url, plaintext) when a read finds a blob sealed with an old key.
+        self.on_stale_blob = None
         
+    @property
+    def keyring(self):
+        """Loaded on first use, so importing this module needs no key material; raises EnvelopeError without it."""
+        if self._keyring is None:
+            self._keyring = Keyring.load()
+        return self._keyring
+    
     def configure(self):
         try:
             print("☁️  Configuring Cloudinary...")
@@ -29,78 +39,80 @@ class CloudinaryManager:
             print(f"❌ Cloudinary configuration failed: {e}")
             return False
     
-    def generate_or_load_key(self):
-        key_file = "encryption.key"
-        try:
-            if os.path.exists(key_file):
-                with open(key_file, 'rb') as f:
-                    return f.read()
-            else:
-                key = Fernet.generate_key()
-                with open(key_file, 'wb') as f:
-                    f.write(key)
-                print("🔐 New encryption key generated and saved")
-                return key
-        except Exception as e:
-            print(f"❌ Encryption key error: {e}")
-            return Fernet.generate_key()
-    
     def encrypt_image(self, image_data):
         try:
-            encrypted_data = self.cipher.encrypt(image_data)
-            return encrypted_data
+            return self.keyring.encrypt(image_data)
         except Exception as e:
             print(f"❌ Image encryption failed: {e}")
             return None
     
     def decrypt_image(self, encrypted_data):
         try:
-            decrypted_data = self.cipher.decrypt(encrypted_data)
-            return decrypted_data
+            return self.keyring.decrypt(encrypted_data)
         except Exception as e:
             print(f"❌ Image decryption failed: {e}")
             return None
     
+    def blob_format(self, encrypted_data):
+        key_id = self.keyring.key_id(encrypted_data)
+        if key_id == LEGACY_FORMAT_NAME:
+            return LEGACY_FORMAT_NAME, None
+        return FORMAT_NAME, key_id
+    
     def upload_encrypted_face(self, user_id, image_data):
+        print(f"🔒 Encrypting and uploading face for user {user_id}...")
+        
+        encrypted_data = self.encrypt_image(image_data)
+        if not encrypted_data:
+            return None
+        
+        return self.upload_encrypted_blob(user_id, encrypted_data)
+    
+    def upload_encrypted_blob(self, user_id, encrypted_data, public_id=None):
+        """Upload a sealed blob; pass the existing public_id to overwrite it in place (key rotation)."""
         try:
-            print(f"🔒 Encrypting and uploading face for user {user_id}...")
-            
-            encrypted_data = self.encrypt_image(image_data)
-            if not encrypted_data:
-                return None
-            
-            encrypted_filename = f"encrypted_faces/{user_id}_face.enc"
-            
-            upload_result = cloudinary.uploader.upload(
-                encrypted_data,
-                public_id=encrypted_filename,
-                resource_type="raw",
-                folder="face_auth",
-                overwrite=True
-            )
+            if public_id:
+                upload_result = cloudinary.uploader.upload(
+                    encrypted_data,
+                    public_id=public_id,
+                    resource_type="raw",
+                    overwrite=True,
+                    invalidate=True
+                )
+            else:
+                upload_result = cloudinary.uploader.upload(
+                    encrypted_data,
+                    public_id=f"encrypted_faces/{user_id}_face.enc",
+                    resource_type="raw",
+                    folder="face_auth",
+                    overwrite=True
+                )
             
+            blob_format, key_id = self.blob_format(encrypted_data)
             print(f"✅ Encrypted face uploaded directly to Cloudinary for user {user_id}")
             return {
                 "secure_url": upload_result["secure_url"],
                 "public_id": upload_result["public_id"],
-                "format": "encrypted"
+                "format": blob_format,
+                "key_id": key_id
             }
         except Exception as e:
             print(f"❌ Face upload failed: {e}")
             return None
     
-    def download_and_decrypt_face(self, public_id):
+    def download_and_decrypt_face(self, public_id, url=None, deadline=None):
         try:
             print(f"🔍 Downloading and decrypting face from Cloudinary: {public_id}")
             
-            download_result = cloudinary.api.resource(public_id, resource_type="raw")
-            encrypted_url = download_result["secure_url"]
-            
-            import requests
-            response = requests.get(encrypted_url)
-            encrypted_data = response.content
+            def resolve_url(deadline):
+                timeout = deadline.remaining() if deadline else blob_fetcher.read_timeout
+                return cloudinary.api.resource(public_id, resource_type="raw", timeout=timeout)["secure_url"]
+
+            encrypted_data = blob_fetcher.fetch(public_id, url or None, deadline, resolve_url=resolve_url)
             
             decrypted_data = self.decrypt_image(encrypted_data)
+            if decrypted_data is not None and self.on_stale_blob and self.keyring.needs_rotation(encrypted_data):
+                self.on_stale_blob(public_id, url, decrypted_data)
             return decrypted_data
         except Exception as e:
             print(f"❌ Face download/decryption failed: {e}")
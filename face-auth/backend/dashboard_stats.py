@@ -0,0 +1,419 @@
+import os
+import threading
+import time
+from datetime import datetime
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from database import db_connection
+
+STATS_COLLECTION = "user_stats"
+SOLVED_COLLECTION = "user_solved_questions"
+CLAIMS_COLLECTION = "user_stats_claims"
+EVENTS_COLLECTION = "guided_solving_events"
+STATE_ID = "dashboard-stats"
+TREND_WINDOW = 7
+TOTAL_PROBLEMS = int(os.getenv("TOTAL_PROBLEMS", 78))
+DAILY_GOAL = int(os.getenv("DAILY_PROBLEM_GOAL", 8))
+MAX_HINT_LEVEL = 4
+HIGH_STUCK_SCORE = 70
+
+SOLVE_EVENTS = {"SOLVED", "PROBLEM_SOLVED", "CORRECT_ANSWER"}
+ATTEMPT_EVENTS = {"TRYING", "ATTEMPT", "WRONG_ATTEMPT", "STEP_SUBMITTED"}
+HINT_EVENTS = {"HINT_REQUESTED", "HINT_SHOWN"}
+STUCK_EVENTS = {"STUCK_DETECTED"}
+DOUBT_EVENTS = {"DOUBT_SUBMITTED"}
+
+def _topic_key(event):
+    topic = event.get("topic") or "General"
+    return topic.replace(".", "_").replace("$", "_")
+
+def _event_day(event):
+    when = event.get("received_at") or datetime.utcnow()
+    return when.date().toordinal()
+
+def solved_questions(events):
+    """(user_id, question_id) pairs solved in a batch of events."""
+    return {
+        (event["user_id"], event["question_id"])
+        for event in events
+        if event["event_type"].upper() in SOLVE_EVENTS
+    }
+
+def _updates_for_user(user_id, events, newly_solved=0):
+    """Fold one user's events into a counter update and one streak update per active day.
+
+    `newly_solved` is how many of the questions solved in `events` this user
+    had never solved before (see DashboardStats._record_solved).
+    """
+    inc = {"eventsTotal": len(events)}
+    if newly_solved:
+        inc["problemsSolved"] = newly_solved
+    max_hint_level = 0
+    trend = []
+    solved_per_day = {}
+
+    def add(field, value=1):
+        inc[field] = inc.get(field, 0) + value
+
+    for event in events:
+        event_type = event["event_type"].upper()
+        topic = _topic_key(event)
+        day = _event_day(event)
+        solved_per_day.setdefault(day, 0)
+
+        if event_type in SOLVE_EVENTS:
+            add("solvedEvents")
+            add(f"topics.{topic}.solved")
+            add(f"topics.{topic}.attempts")
+            solved_per_day[day] += 1
+        elif event_type in ATTEMPT_EVENTS:
+            add("attempts")
+            add(f"topics.{topic}.attempts")
+        elif event_type in DOUBT_EVENTS:
+            add("doubts")
+
+        if event_type in HINT_EVENTS:
+            level = int(event.get("hint_level") or 1)
+            add("hintsUsed")
+            add("hintLevelSum", level)
+            max_hint_level = max(max_hint_level, level)
+            if level >= MAX_HINT_LEVEL:
+                add("hintsExhausted")
+
+        if event_type in STUCK_EVENTS or event.get("stuck_score") is not None:
+            score = float(event.get("stuck_score") or 0)
+            add("stuckEvents")
+            add("stuckScoreSum", score)
+            trend.append(round(score))
+            if score >= HIGH_STUCK_SCORE:
+                add("highStuckEvents")
+
+    update = {
+        "$inc": inc,
+        "$max": {"maxHintLevel": max_hint_level},
+        "$set": {"updated_at": datetime.utcnow()},
+        "$setOnInsert": {"user_id": user_id},
+    }
+    if trend:
+        update["$push"] = {"trend": {"$each": trend, "$slice": -TREND_WINDOW}}
+
+    operations = [UpdateOne({"user_id": user_id}, update, upsert=True)]
+
+    # Streak and daily-goal state need "compare with the stored day" logic, so they use
+    # an aggregation-pipeline update; every expression below sees the pre-update document.
+    for day in sorted(solved_per_day):
+        operations.append(UpdateOne({"user_id": user_id}, [{"$set": {
+            "streak": {"$switch": {
+                "branches": [
+                    {"case": {"$eq": ["$lastActiveDay", day]}, "then": {"$ifNull": ["$streak", 1]}},
+                    {"case": {"$eq": ["$lastActiveDay", day - 1]}, "then": {"$add": [{"$ifNull": ["$streak", 0]}, 1]}},
+                    {"case": {"$gt": ["$lastActiveDay", day]}, "then": "$streak"},
+                ],
+                "default": 1,
+            }},
+            "todaySolved": {"$switch": {
+                "branches": [
+                    {"case": {"$eq": ["$lastActiveDay", day]}, "then": {"$add": [{"$ifNull": ["$todaySolved", 0]}, solved_per_day[day]]}},
+                    {"case": {"$gt": ["$lastActiveDay", day]}, "then": "$todaySolved"},
+                ],
+                "default": solved_per_day[day],
+            }},
+            "lastActiveDay": {"$max": ["$lastActiveDay", day]},
+        }}]))
+    return operations
+
+def _suffix(generation):
+    return f"_{generation}" if generation else ""
+
+class DashboardStats:
+    """Per-user materialized dashboard document, maintained incrementally from solving events.
+
+    Each flushed event batch becomes a handful of updates per user (running
+    counters, a capped stuck-score trend and streak state) sent in one
+    bulk_write, so reading the dashboard is a single point lookup on user_id.
+    Distinct solved questions live in their own collection, one document per
+    (user, question), so the stats document stays a fixed size.
+
+    `rebuild()` replays the raw event log into the next generation of
+    collections while the servers keep running. During a rebuild every
+    listener also applies its batches to the new generation, and each event
+    is claimed by _id in that generation before it is counted, so an event
+    seen by both the replay and a live listener is counted once. The
+    generation pointer then flips and the old collections are dropped.
+    """
+
+    def __init__(self, state_ttl=1.0, rebuild_grace=5.0):
+        self.state_ttl = state_ttl
+        # Longer than one event flush, so every listener has seen a state change.
+        self.rebuild_grace = rebuild_grace
+        self._state = None
+        self._state_read_at = 0.0
+        self._state_lock = threading.Lock()
+
+    @property
+    def jobs_collection(self):
+        return db_connection.get_collection("jobs")
+
+    def state(self, fresh=False):
+        """{"generation": live generation, "target": generation being rebuilt or None}."""
+        with self._state_lock:
+            if fresh or self._state is None or time.monotonic() - self._state_read_at > self.state_ttl:
+                document = self.jobs_collection.find_one({"_id": STATE_ID}) or {}
+                self._state = {"generation": document.get("generation", 0), "target": document.get("target")}
+                self._state_read_at = time.monotonic()
+            return self._state
+
+    def collections(self, generation):
+        return (
+            db_connection.get_collection(STATS_COLLECTION + _suffix(generation)),
+            db_connection.get_collection(SOLVED_COLLECTION + _suffix(generation)),
+        )
+
+    @property
+    def stats_collection(self):
+        return self.collections(self.state()["generation"])[0]
+
+    def ensure_indexes(self, generation=None):
+        if generation is None:
+            generation = self.state(fresh=True)["generation"]
+        stats, _ = self.collections(generation)
+        stats.create_index("user_id", unique=True)
+        db_connection.get_collection(EVENTS_COLLECTION).create_index(
+            [("user_id", ASCENDING), ("received_at", ASCENDING)]
+        )
+
+    def _record_solved(self, solved, generation):
+        """Insert (user, question) pairs; returns {user_id: how many were new}."""
+        if not solved:
+            return {}
+        pairs = sorted(solved)
+        _, solved_collection = self.collections(generation)
+        operations = [
+            UpdateOne(
+                {"_id": {"user_id": user_id, "question_id": question_id}},
+                {"$setOnInsert": {"user_id": user_id, "question_id": question_id}},
+                upsert=True
+            )
+            for user_id, question_id in pairs
+        ]
+        try:
+            upserted = solved_collection.bulk_write(operations, ordered=False).upserted_ids
+        except BulkWriteError as e:
+            # A concurrent upsert of the same pair loses with a duplicate key: not new.
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+            upserted = {item["index"]: item["_id"] for item in e.details.get("upserted", [])}
+        new = {}
+        for index in upserted:
+            user_id = pairs[index][0]
+            new[user_id] = new.get(user_id, 0) + 1
+        return new
+
+    def _claim(self, events, generation):
+        """The events not yet counted in `generation`, claimed so nobody counts them again."""
+        claims = db_connection.get_collection(CLAIMS_COLLECTION + _suffix(generation))
+        try:
+            claims.insert_many([{"_id": event["_id"]} for event in events], ordered=False)
+            return events
+        except BulkWriteError as e:
+            taken = {error["index"] for error in e.details.get("writeErrors", []) if error.get("code") == 11000}
+            if len(taken) != len(e.details.get("writeErrors", [])):
+                raise
+            return [event for i, event in enumerate(events) if i not in taken]
+
+    def _apply(self, events, generation):
+        by_user = {}
+        for event in events:
+            by_user.setdefault(event["user_id"], []).append(event)
+        newly_solved = self._record_solved(solved_questions(events), generation)
+
+        operations = []
+        for user_id, user_events in by_user.items():
+            operations.extend(_updates_for_user(user_id, user_events, newly_solved.get(user_id, 0)))
+        if operations:
+            self.collections(generation)[0].bulk_write(operations, ordered=True)
+        return len(by_user)
+
+    def apply_events(self, events):
+        state = self.state(fresh=True)
+        generation, target = state["generation"], state["target"]
+        if target is None:
+            return self._apply(events, generation)
+        if target != generation:
+            # The old generation stays correct until the flip; the new one only counts claimed events.
+            self._apply(events, generation)
+        claimed = self._claim(events, target)
+        return self._apply(claimed, target) if claimed else 0
+
+    def get(self, user_id):
+        return self.stats_collection.find_one({"user_id": user_id}, {"_id": 0})
+
+    def _drop_generation(self, generation):
+        for name in (STATS_COLLECTION, SOLVED_COLLECTION, CLAIMS_COLLECTION):
+            db_connection.get_collection(name + _suffix(generation)).drop()
+
+    def rebuild(self, batch_size=1000):
+        """Recompute every user's stats from the raw event log into a new generation and switch to it."""
+        current = self.state(fresh=True)
+        if current["target"] is not None:
+            raise RuntimeError(f"a dashboard stats rebuild into generation {current['target']} is already running")
+        generation = current["generation"]
+        target = generation + 1
+        self._drop_generation(target)
+        self.ensure_indexes(target)
+        self.jobs_collection.update_one(
+            {"_id": STATE_ID},
+            {"$set": {"generation": generation, "target": target, "started_at": datetime.utcnow()}},
+            upsert=True
+        )
+        # From here on every listener applies its batches to the target as well.
+        time.sleep(self.rebuild_grace)
+
+        cursor = db_connection.get_collection(EVENTS_COLLECTION).find({}).sort(
+            [("user_id", ASCENDING), ("received_at", ASCENDING)]
+        ).batch_size(batch_size)
+
+        batch, replayed = [], 0
+        try:
+            for event in cursor:
+                batch.append(event)
+                if len(batch) >= batch_size:
+                    replayed += self._replay(batch, target)
+                    batch = []
+            if batch:
+                replayed += self._replay(batch, target)
+        except Exception:
+            # The live generation was never touched; forget the half-built one.
+            self.jobs_collection.update_one({"_id": STATE_ID}, {"$set": {"target": None}})
+            self._drop_generation(target)
+            raise
+
+        self.jobs_collection.update_one({"_id": STATE_ID}, {"$set": {"generation": target}})
+        # Listeners that read the old state are still finishing; they claim into the target too.
+        time.sleep(self.rebuild_grace)
+        self.jobs_collection.update_one(
+            {"_id": STATE_ID},
+            {"$set": {"target": None, "finished_at": datetime.utcnow()}}
+        )
+        self._drop_generation(generation)
+        db_connection.get_collection(CLAIMS_COLLECTION + _suffix(target)).drop()
+        self.state(fresh=True)
+        print(f"📊 Rebuilt dashboard stats from {replayed} events (generation {target})")
+        return replayed
+
+    def _replay(self, events, generation):
+        claimed = self._claim(events, generation)
+        if claimed:
+            self._apply(claimed, generation)
+        return len(claimed)
+
+def _color(score):
+    if score >= 75:
+        return "emerald"
+    if score >= 50:
+        return "amber"
+    return "rose"
+
+def build_dashboard(stats, today=None):
+    """Shape a materialized stats document into the dashboard payload the frontend renders."""
+    stats = stats or {}
+    today = (today or datetime.utcnow().date()).toordinal()
+
+    # Documents from before problemsSolved existed keep the old array until the next rebuild.
+    problems_solved = max(stats.get("problemsSolved", 0), len(stats.get("questionsSolved", [])))
+    total_problems = max(TOTAL_PROBLEMS, problems_solved)
+    overall = round(100 * problems_solved / total_problems) if total_problems else 0
+
+    last_day = stats.get("lastActiveDay")
+    streak = stats.get("streak", 0) if last_day is not None and last_day >= today - 1 else 0
+    today_solved = stats.get("todaySolved", 0) if last_day == today else 0
+    daily_goal = min(100, round(100 * today_solved / DAILY_GOAL)) if DAILY_GOAL else 0
+
+    topics = []
+    for name, counts in (stats.get("topics") or {}).items():
+        attempts = counts.get("attempts", 0)
+        score = round(100 * counts.get("solved", 0) / attempts) if attempts else 0
+        topics.append({"name": name, "score": score, "color": _color(score), "_attempts": attempts})
+    topics.sort(key=lambda t: (-t["_attempts"], t["name"]))
+    topics = [{k: v for k, v in t.items() if k != "_attempts"} for t in topics[:5]]
+
+    hints_used = stats.get("hintsUsed", 0)
+    attempts = stats.get("attempts", 0) + stats.get("solvedEvents", 0)
+    avg_hint = round(stats.get("hintLevelSum", 0) / hints_used, 1) if hints_used else 0
+    hint_ratio = hints_used / attempts if attempts else 0
+    dependency = "High" if hint_ratio > 0.5 else "Medium" if hint_ratio > 0.2 else "Low"
+
+    stuck_events = stats.get("stuckEvents", 0)
+    avg_stuck = round(stats.get("stuckScoreSum", 0) / stuck_events) if stuck_events else 0
+    high_stuck = stats.get("highStuckEvents", 0)
+    alerts = []
+    if high_stuck >= 3:
+        alerts.append("Frequent hesitation detected")
+    if stats.get("hintsExhausted", 0) >= 3:
+        alerts.append("Hints often exhausted before solving")
+
+    best_topic = max(topics, key=lambda t: t["score"], default=None)
+    weakest_topic = min(topics, key=lambda t: t["score"], default=None)
+    achievement = {
+        "title": f"{best_topic['name']} Ace" if best_topic and best_topic["score"] >= 75 else "Getting Started",
+        "icon": "Trophy",
+        "color": best_topic["color"] if best_topic else "amber",
+        "judge_note": f"Strongest results in {best_topic['name']}" if best_topic else "Solve a problem to earn your first badge",
+    }
+
+    return {
+        "overallProgress": overall,
+        "problemsSolved": problems_solved,
+        "totalProblems": total_problems,
+        "streak": streak,
+        "dailyGoalProgress": daily_goal,
+        "topicPerformance": topics,
+        "hintAnalysis": {
+            "avgHintLevel": avg_hint,
+            "maxHintLevel": stats.get("maxHintLevel", 0),
+            "hintsExhausted": stats.get("hintsExhausted", 0),
+            "dependency": dependency,
+        },
+        "stuckInsights": {
+            "avgStuckScore": avg_stuck,
+            "highStuckEvents": high_stuck,
+            "alerts": alerts,
+            "trend": stats.get("trend", []),
+        },
+        "achievement": achievement,
+        "detailedExplanations": {
+            "overall-learning-progress": {
+                "summary": f"You have solved {problems_solved} of {total_problems} problems.",
+                "analytics": f"Current streak is {streak} day(s) with {today_solved} problem(s) solved today.",
+                "advice": f"Solve {max(0, DAILY_GOAL - today_solved)} more problem(s) today to reach your daily goal.",
+            },
+            "topic-wise-performance": {
+                "summary": f"Strongest topic: {best_topic['name']}." if best_topic else "No topics attempted yet.",
+                "analytics": ", ".join(f"{t['name']} {t['score']}%" for t in topics) or "No topic data yet.",
+                "advice": f"Spend your next session on {weakest_topic['name']}." if weakest_topic else "Pick a topic to begin.",
+            },
+            "hint-&-struggle-analysis": {
+                "summary": f"Hint dependency is {dependency.lower()}.",
+                "analytics": f"You used {hints_used} hint(s) at an average level of {avg_hint}; {stats.get('hintsExhausted', 0)} time(s) all hints were exhausted.",
+                "advice": "Try the first few minutes of each problem without opening a hint.",
+            },
+            "stuck-&-hesitation-insights": {
+                "summary": f"Average stuck score is {avg_stuck}.",
+                "analytics": f"{high_stuck} high-hesitation event(s) out of {stuck_events} recorded.",
+                "advice": "Write quick pseudo-code before translating logic into syntax.",
+            },
+            "skill-achievement-badge": {
+                "summary": achievement["judge_note"],
+                "analytics": f"Badge '{achievement['title']}' reflects your best topic score.",
+                "advice": "Keep the streak going to unlock the next badge.",
+            },
+        },
+    }
+
+dashboard_stats = DashboardStats()
+
+if __name__ == "__main__":
+    # python dashboard_stats.py  -- rebuild materialized stats from raw events; safe while servers run
+    db_connection.connect()
+    dashboard_stats.rebuild()
+    db_connection.close()
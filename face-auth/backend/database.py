@@ -1,34 +1,48 @@
 import os
+import threading
 from pymongo import MongoClient
 from dotenv import load_dotenv
 from constants import DB_NAME
-import sys
 
 load_dotenv()
 
 class DatabaseConnection:
     def __init__(self):
         self.uri = os.getenv("MONGODB_URI")
+        self.timeout_ms = int(os.getenv("MONGODB_TIMEOUT_MS", 5000))
         self.client = None
         self.db = None
+        self._lock = threading.Lock()
         
     def connect(self):
         try:
             print("🔗 Connecting to MongoDB...")
-            self.client = MongoClient(f"{self.uri}/{DB_NAME}")
-            self.db = self.client[DB_NAME]
-            self.client.admin.command('ping')
+            client = MongoClient(f"{self.uri}/{DB_NAME}", serverSelectionTimeoutMS=self.timeout_ms)
+            client.admin.command('ping')
+            self.client = client
+            self.db = client[DB_NAME]
             print(f"✅ MongoDB connected !! DB HOST: {self.client.HOST}")
             return True
         except Exception as e:
             print("❌ MONGODB connection FAILED", e)
-            sys.exit(1)
+            return False
     
     def get_database(self):
+        """Connect on first use; raises ConnectionError instead of exiting the process."""
         if self.db is None:
-            self.connect()
+            with self._lock:
+                if self.db is None and not self.connect():
+                    raise ConnectionError("MongoDB is not reachable")
         return self.db
     
+    def ping(self):
+        try:
+            self.get_database()
+            self.client.admin.command('ping')
+            return True
+        except Exception:
+            return False
+    
     def get_collection(self, collection_name):
         db = self.get_database()
         return db[collection_name]
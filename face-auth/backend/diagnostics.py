@@ -0,0 +1,197 @@
+import asyncio
+import hmac
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+import anyio.to_thread
+from metrics import metrics
+
+MAX_PROFILE_SECONDS = 60.0
+GROUP_BY_OPTIONS = ("lineno", "filename", "traceback")
+
+class DiagnosticsBusy(Exception):
+    pass
+
+def collapse(frame, thread_name):
+    """One sample as a flamegraph.pl / speedscope collapsed line: root first, ';'-separated."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(reversed(names))
+
+class Diagnostics:
+    """Admin-only runtime introspection for a live server.
+
+    Nothing here runs unless an admin asks for it: the sampling profiler is
+    a thread that exists only for the length of one profile, tracemalloc is
+    off until started, and the event-loop lag monitor only runs when
+    diagnostics are enabled (ADMIN_TOKEN set). With no token the endpoints
+    answer 404 and the cost is zero.
+    """
+
+    def __init__(self, admin_token=None, lag_interval=0.5):
+        self.admin_token = admin_token
+        self.lag_interval = lag_interval
+        self._profile_lock = threading.Lock()
+        self._baseline = None
+        self._lag_task = None
+        self._lag = {"last": 0.0, "max": 0.0, "samples": 0}
+
+    @property
+    def enabled(self):
+        return bool(self.admin_token)
+
+    def authorized(self, token):
+        # Bytes, because compare_digest rejects str with non-ASCII characters.
+        return self.enabled and token is not None and hmac.compare_digest(token.encode("utf-8"), self.admin_token.encode("utf-8"))
+
+    # -- sampling profiler --------------------------------------------------
+
+    def profile(self, seconds, interval=0.005):
+        """Sample every thread's stack for `seconds`; returns collapsed stacks, hottest first."""
+        seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+        if not self._profile_lock.acquire(blocking=False):
+            raise DiagnosticsBusy("a profile is already running")
+        try:
+            me = threading.get_ident()
+            names = {}
+            stacks = Counter()
+            samples = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                if len(names) != threading.active_count():
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident != me:
+                        stacks[collapse(frame, names.get(ident, f"thread-{ident}"))] += 1
+                samples += 1
+                time.sleep(interval)
+            metrics.inc("diagnostics_profiles_total")
+            lines = [f"{stack} {count}" for stack, count in stacks.most_common()]
+            print(f"🩺 Profiled {samples} samples over {seconds:.1f}s ({len(stacks)} distinct stacks)")
+            return "\n".join(lines) + "\n"
+        finally:
+            self._profile_lock.release()
+
+    # -- memory -------------------------------------------------------------
+
+    def memory_start(self, frames=10):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._baseline = tracemalloc.take_snapshot()
+        return self.memory_status()
+
+    def memory_stop(self):
+        tracemalloc.stop()
+        self._baseline = None
+        return self.memory_status()
+
+    def memory_status(self):
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+    @staticmethod
+    def _check_group_by(group_by):
+        if group_by not in GROUP_BY_OPTIONS:
+            raise ValueError(f"group_by must be one of {', '.join(GROUP_BY_OPTIONS)}")
+
+    def memory_top(self, limit=20, group_by="lineno"):
+        self._check_group_by(group_by)
+        if not tracemalloc.is_tracing():
+            return None
+        stats = tracemalloc.take_snapshot().statistics(group_by)
+        return [
+            {"where": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+            for stat in stats[:limit]
+        ]
+
+    def memory_diff(self, limit=20, group_by="lineno", rebase=False):
+        """Growth since the baseline (taken at start or on the last rebase)."""
+        self._check_group_by(group_by)
+        if not tracemalloc.is_tracing() or self._baseline is None:
+            return None
+        snapshot = tracemalloc.take_snapshot()
+        stats = snapshot.compare_to(self._baseline, group_by)
+        if rebase:
+            self._baseline = snapshot
+        return [
+            {"where": str(stat.traceback), "size_diff_bytes": stat.size_diff, "size_bytes": stat.size, "count_diff": stat.count_diff}
+            for stat in stats[:limit]
+        ]
+
+    # -- event loop and pools ------------------------------------------------
+
+    async def _watch_lag(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, time.monotonic() - started - self.lag_interval)
+            self._lag["last"] = lag
+            self._lag["max"] = max(self._lag["max"], lag)
+            self._lag["samples"] += 1
+            metrics.set_gauge("event_loop_lag_seconds", lag)
+
+    def start(self):
+        """Start the lag monitor; only when diagnostics are enabled."""
+        if self.enabled and self._lag_task is None:
+            self._lag_task = asyncio.get_running_loop().create_task(self._watch_lag())
+
+    def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+
+    def runtime(self, pools=None, extra=None):
+        """Event-loop lag, thread-pool saturation and thread counts by name prefix."""
+        loop = asyncio.get_running_loop()
+        lag = dict(self._lag)
+        self._lag["max"] = 0.0
+
+        executor = getattr(loop, "_default_executor", None)
+        report = {
+            "event_loop": {"lag_seconds": lag["last"], "max_lag_seconds_since_last_read": lag["max"], "samples": lag["samples"]},
+            "asyncio_default_executor": _executor_stats(executor) if executor is not None else None,
+        }
+        # Starlette's run_in_threadpool borrows from this limiter.
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        report["threadpool"] = {
+            "busy": limiter.borrowed_tokens,
+            "limit": limiter.total_tokens,
+            "saturation": round(limiter.borrowed_tokens / limiter.total_tokens, 3),
+        }
+
+        for name, pool in (pools or {}).items():
+            report[name] = _executor_stats(pool) if pool is not None else None
+        report.update(extra or {})
+
+        threads = Counter(thread.name.split("_")[0].rstrip("-0123456789") or thread.name for thread in threading.enumerate())
+        report["threads"] = dict(threads)
+        report["memory"] = self.memory_status()
+        return report
+
+def _executor_stats(executor):
+    workers = getattr(executor, "_max_workers", None)
+    threads = len(getattr(executor, "_threads", ()))
+    idle = getattr(getattr(executor, "_idle_semaphore", None), "_value", 0)
+    queue = getattr(executor, "_work_queue", None)
+    busy = max(0, threads - idle)
+    return {
+        "max_workers": workers,
+        "busy": busy,
+        "queued": queue.qsize() if queue is not None else None,
+        "saturation": round(busy / workers, 3) if workers else None,
+    }
+
+diagnostics = Diagnostics(admin_token=os.getenv("ADMIN_TOKEN") or None)
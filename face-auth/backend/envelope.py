@@ -0,0 +1,204 @@
+import base64
+import itertools
+import json
+import os
+import secrets
+import struct
+import sys
+from pathlib import Path
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+BASE_DIR = Path(__file__).resolve().parent
+# Keys must never live in the source tree, where they get copied, committed and shipped.
+SOURCE_TREE = BASE_DIR.parent
+
+MAGIC = b"FAE1"
+FORMAT_NAME = "envelope-v1"
+LEGACY_FORMAT_NAME = "fernet"
+DEFAULT_CHUNK_SIZE = 64 * 1024
+TAG_SIZE = 16
+NONCE_PREFIX_SIZE = 7
+# magic | key id length | key id | chunk size | nonce prefix
+_HEADER_FIXED = struct.Struct(">4sB")
+_HEADER_TAIL = struct.Struct(f">I{NONCE_PREFIX_SIZE}s")
+
+class EnvelopeError(Exception):
+    pass
+
+def _nonce(prefix, counter, last):
+    # STREAM construction: a final-chunk flag in the nonce makes truncation detectable.
+    return prefix + struct.pack(">I", counter) + (b"\x01" if last else b"\x00")
+
+def is_envelope(blob):
+    return blob[:len(MAGIC)] == MAGIC
+
+def _header_size(blob):
+    """Length of the header at the start of `blob`, or None until its fixed part has arrived."""
+    if len(blob) < _HEADER_FIXED.size:
+        return None
+    return _HEADER_FIXED.size + blob[len(MAGIC)] + _HEADER_TAIL.size
+
+def _parse_header(blob):
+    if len(blob) < _HEADER_FIXED.size:
+        raise EnvelopeError("truncated header")
+    magic, kid_length = _HEADER_FIXED.unpack_from(blob)
+    if magic != MAGIC:
+        raise EnvelopeError("not an envelope")
+    end = _HEADER_FIXED.size + kid_length + _HEADER_TAIL.size
+    if len(blob) < end:
+        raise EnvelopeError("truncated header")
+    key_id = bytes(blob[_HEADER_FIXED.size:_HEADER_FIXED.size + kid_length]).decode("ascii")
+    chunk_size, prefix = _HEADER_TAIL.unpack_from(blob, _HEADER_FIXED.size + kid_length)
+    return key_id, chunk_size, prefix, end
+
+def keyring_path():
+    """The configured keyring file; refuses a missing setting or a path inside the source tree."""
+    configured = os.getenv("FACE_KEYRING_FILE")
+    if not configured:
+        raise EnvelopeError("FACE_KEYRING_FILE is not set (or pass the keyring itself in FACE_KEYRING)")
+    path = Path(configured).expanduser().resolve()
+    if path.is_relative_to(SOURCE_TREE):
+        raise EnvelopeError(f"FACE_KEYRING_FILE must point outside the source tree ({SOURCE_TREE}), got {path}")
+    return path
+
+class Keyring:
+    """AES-256 keys by id, one of them active for new blobs, plus the legacy Fernet key.
+
+    The keyring looks like {"active": "k2", "keys": {"k1": "<base64>", "k2": "<base64>"}}
+    and comes from the FACE_KEYRING environment variable or the file named by
+    FACE_KEYRING_FILE. Every host must be given the same keyring, so it is
+    never generated implicitly: create one with `python envelope.py new-key`
+    and distribute it. Rotating means adding a key and making it active; old
+    keys stay until every blob has been re-encrypted, see KeyRotator.
+    """
+
+    def __init__(self, keys, active, legacy_key=None):
+        if active not in keys:
+            raise EnvelopeError(f"active key '{active}' is not in the keyring")
+        self.keys = keys
+        self.active = active
+        self._aead = {key_id: AESGCM(key) for key_id, key in keys.items()}
+        self._legacy = Fernet(legacy_key) if legacy_key else None
+
+    @classmethod
+    def load(cls, path=None):
+        """Load the configured keyring; raises EnvelopeError when there is none."""
+        inline = os.getenv("FACE_KEYRING")
+        if path is None and inline:
+            data = json.loads(inline)
+        else:
+            path = Path(path) if path is not None else keyring_path()
+            if not path.exists():
+                raise EnvelopeError(f"keyring {path} does not exist; create it with `python envelope.py new-key` and copy it to every host")
+            data = json.loads(path.read_text(encoding="utf-8"))
+        keys = {key_id: base64.b64decode(value) for key_id, value in data["keys"].items()}
+        return cls(keys, data["active"], legacy_key=_load_legacy_key())
+
+    @staticmethod
+    def add_key(path=None, key_id=None, activate=True):
+        path = Path(path) if path is not None else keyring_path()
+        data = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {"keys": {}}
+        key_id = key_id or f"k{len(data['keys']) + 1}"
+        if key_id in data["keys"]:
+            raise EnvelopeError(f"key '{key_id}' already exists")
+        data["keys"][key_id] = base64.b64encode(AESGCM.generate_key(bit_length=256)).decode("ascii")
+        if activate or "active" not in data:
+            data["active"] = key_id
+        path.write_text(json.dumps(data, indent=2), encoding="utf-8")
+        os.chmod(path, 0o600)
+        return key_id
+
+    def encrypt(self, data, chunk_size=DEFAULT_CHUNK_SIZE):
+        return b"".join(self.encrypt_stream([data], chunk_size))
+
+    def encrypt_stream(self, pieces, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Yield the envelope for an iterable of plaintext pieces, one chunk in memory at a time."""
+        key_id = self.active.encode("ascii")
+        prefix = secrets.token_bytes(NONCE_PREFIX_SIZE)
+        header = _HEADER_FIXED.pack(MAGIC, len(key_id)) + key_id + _HEADER_TAIL.pack(chunk_size, prefix)
+        aead = self._aead[self.active]
+        yield header
+
+        counter = 0
+        pending = bytearray()
+        for piece in pieces:
+            pending += piece
+            # Hold back the last full chunk until we know whether more data follows.
+            while len(pending) > chunk_size:
+                yield aead.encrypt(_nonce(prefix, counter, False), bytes(pending[:chunk_size]), header)
+                del pending[:chunk_size]
+                counter += 1
+        yield aead.encrypt(_nonce(prefix, counter, True), bytes(pending), header)
+
+    def decrypt(self, blob):
+        if not is_envelope(blob):
+            return self._decrypt_legacy(blob)
+        return b"".join(self.decrypt_stream([blob]))
+
+    def decrypt_stream(self, pieces):
+        """Yield the plaintext of an envelope read as an iterable of pieces, one chunk in memory at a time."""
+        pieces = iter(pieces)
+        pending = bytearray()
+        for piece in pieces:
+            pending += piece
+            if _header_size(pending) is not None and len(pending) >= _header_size(pending):
+                break
+        key_id, chunk_size, prefix, offset = _parse_header(pending)
+        aead = self._aead.get(key_id)
+        if aead is None:
+            raise EnvelopeError(f"unknown key id '{key_id}'")
+        header = bytes(pending[:offset])
+        del pending[:offset]
+
+        def open_chunk(counter, sealed, last):
+            try:
+                return aead.decrypt(_nonce(prefix, counter, last), sealed, header)
+            except InvalidTag:
+                raise EnvelopeError("envelope failed authentication")
+
+        counter = 0
+        sealed_size = chunk_size + TAG_SIZE
+        for piece in itertools.chain([b""], pieces):
+            pending += piece
+            # Hold back the last sealed chunk until we know whether more data follows.
+            start = 0
+            while len(pending) - start > sealed_size:
+                yield open_chunk(counter, bytes(pending[start:start + sealed_size]), False)
+                start += sealed_size
+                counter += 1
+            del pending[:start]
+        yield open_chunk(counter, bytes(pending), True)
+
+    def _decrypt_legacy(self, blob):
+        if self._legacy is None:
+            raise EnvelopeError("legacy Fernet blob but no legacy key is configured")
+        try:
+            return self._legacy.decrypt(blob)
+        except InvalidToken:
+            raise EnvelopeError("legacy blob failed authentication")
+
+    def key_id(self, blob):
+        """Key id a blob was sealed with; legacy Fernet blobs report 'fernet'."""
+        if not is_envelope(blob):
+            return LEGACY_FORMAT_NAME
+        return _parse_header(blob)[0]
+
+    def needs_rotation(self, blob):
+        return self.key_id(blob) != self.active
+
+def _load_legacy_key():
+    """The Fernet key used before envelopes; only ever read, never generated anymore."""
+    configured = os.getenv("LEGACY_FERNET_KEY_FILE")
+    for candidate in ([Path(configured)] if configured else [Path("encryption.key"), BASE_DIR / "encryption.key"]):
+        if candidate.exists():
+            return candidate.read_bytes().strip()
+    return None
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "new-key":
+        new_id = Keyring.add_key(key_id=sys.argv[2] if len(sys.argv) > 2 else None)
+        print(f"🔐 Added and activated key '{new_id}' in {keyring_path()}; copy the keyring to every host before restarting")
+    else:
+        print("usage: python envelope.py new-key [key_id]")
@@ -0,0 +1,217 @@
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from database import db_connection
+from metrics import metrics
+
+REQUIRED_FIELDS = (
+    ("event_type", str),
+    ("user_id", str),
+    ("question_id", str),
+    ("step_number", int),
+)
+OPTIONAL_FIELDS = (
+    ("student_answer", str),
+    ("input_text", str),
+    ("wrong_attempts", int),
+    ("time_spent", (int, float)),
+    ("hint_level", int),
+    ("stuck_score", (int, float)),
+    ("topic", str),
+    ("client_ts", (int, float, str)),
+)
+MAX_TEXT_LENGTH = 4000
+
+class InvalidEvent(ValueError):
+    pass
+
+class BatchTooLarge(InvalidEvent):
+    pass
+
+class IngestBackpressure(Exception):
+    def __init__(self, retry_after):
+        super().__init__("event buffer full")
+        self.retry_after = retry_after
+
+def validate_event(raw):
+    """Cheap structural check that copies only known fields; no model instantiation per event."""
+    if not isinstance(raw, dict):
+        raise InvalidEvent("event must be an object")
+    event = {}
+    for name, kind in REQUIRED_FIELDS:
+        value = raw.get(name)
+        if not isinstance(value, kind) or isinstance(value, bool) or value == "":
+            raise InvalidEvent(f"'{name}' is required and must be {kind.__name__}")
+        event[name] = value
+    for name, kind in OPTIONAL_FIELDS:
+        value = raw.get(name)
+        if value is None:
+            continue
+        if not isinstance(value, kind) or isinstance(value, bool):
+            raise InvalidEvent(f"'{name}' has the wrong type")
+        if isinstance(value, str) and len(value) > MAX_TEXT_LENGTH:
+            value = value[:MAX_TEXT_LENGTH]
+        event[name] = value
+    return event
+
+class EventIngestBuffer:
+    """Bounded in-memory buffer of guided-solving events flushed to Mongo in batches.
+
+    Appends are all-or-nothing per request: if the whole batch does not fit,
+    the caller waits up to `append_timeout` for the flusher to make room and
+    otherwise gets IngestBackpressure, so nothing is dropped silently. The
+    flusher writes with one unordered insert_many per `max_batch` events or per
+    `flush_interval` seconds, whichever comes first. Events get their _id when
+    they are buffered, so a retry can never insert one twice: only the events
+    that failed go back to the front of the buffer, and duplicate-key errors on
+    a retry mean the event was already written.
+    """
+
+    def __init__(self, collection_name="guided_solving_events", capacity=50000, max_batch=1000, flush_interval=0.5, append_timeout=0.25):
+        self.collection_name = collection_name
+        self.capacity = capacity
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.append_timeout = append_timeout
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._avg_flush_seconds = flush_interval
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Register callback(events) to run after each batch is persisted."""
+        self._listeners.append(callback)
+
+    def start(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="event-ingest", daemon=True)
+            self._thread.start()
+        print("📥 Guided-solving event ingestion started")
+
+    def _retry_after(self):
+        return max(1, round(self._avg_flush_seconds * len(self._buffer) / self.max_batch))
+
+    def try_append(self, events, timeout=0.0):
+        """Append all events or none; returns False if there was no room within `timeout`."""
+        if len(events) > self.capacity:
+            raise BatchTooLarge(f"batch larger than buffer capacity ({self.capacity})")
+        received_at = datetime.utcnow()
+        with self._cond:
+            deadline = time.monotonic() + timeout
+            while len(self._buffer) + len(events) > self.capacity:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    metrics.inc("event_ingest_backpressure_total")
+                    return False
+                self._cond.wait(remaining)
+            for event in events:
+                event["_id"] = ObjectId()
+                event["received_at"] = received_at
+                self._buffer.append(event)
+            metrics.inc("event_ingest_events_total", len(events))
+            if len(self._buffer) >= self.max_batch:
+                self._cond.notify_all()
+        return True
+
+    def append(self, events):
+        if not self.try_append(events, self.append_timeout):
+            raise IngestBackpressure(self._retry_after())
+
+    def _take_batch(self):
+        count = min(self.max_batch, len(self._buffer))
+        batch = [self._buffer.popleft() for _ in range(count)]
+        self._cond.notify_all()
+        return batch
+
+    def _requeue(self, events):
+        with self._cond:
+            self._buffer.extendleft(reversed(events))
+
+    def _write(self, batch):
+        """Insert a batch; returns False if any of it has to be retried."""
+        started = time.monotonic()
+        persisted, failed = batch, []
+        try:
+            db_connection.get_collection(self.collection_name).insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            failed_indexes = {
+                error["index"] for error in e.details.get("writeErrors", [])
+                if error.get("code") != 11000
+            }
+            failed = [event for i, event in enumerate(batch) if i in failed_indexes]
+            persisted = [event for i, event in enumerate(batch) if i not in failed_indexes]
+        except Exception as e:
+            print(f"❌ Event flush failed ({len(batch)} events), will retry: {e}")
+            metrics.inc("event_ingest_flush_failures_total")
+            self._requeue(batch)
+            return False
+        if failed:
+            print(f"❌ Event flush failed for {len(failed)} of {len(batch)} events, will retry them")
+            metrics.inc("event_ingest_flush_failures_total")
+            self._requeue(failed)
+
+        elapsed = time.monotonic() - started
+        self._avg_flush_seconds = 0.8 * self._avg_flush_seconds + 0.2 * max(elapsed, 0.01)
+        metrics.observe("event_ingest_flush_seconds", elapsed)
+        metrics.observe("event_ingest_batch_size", len(batch), buckets=(1, 10, 50, 100, 250, 500, 1000, 5000))
+        if persisted:
+            for listener in self._listeners:
+                try:
+                    listener(persisted)
+                except Exception as e:
+                    print(f"⚠️ Event listener failed: {e}")
+        return not failed
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping and len(self._buffer) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                stopping = self._stopping
+                batch = self._take_batch()
+            if batch and not self._write(batch) and not stopping:
+                time.sleep(self.flush_interval)
+            if stopping:
+                return
+
+    def flush(self):
+        written = 0
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+            if not batch or not self._write(batch):
+                return written
+            written += len(batch)
+
+    def stop(self, timeout=10.0):
+        with self._cond:
+            thread = self._thread
+            self._stopping = True
+            self._cond.notify_all()
+        if thread:
+            thread.join(timeout)
+        with self._cond:
+            self._thread = None
+        flushed = self.flush()
+        if self._buffer:
+            print(f"⚠️ {len(self._buffer)} guided-solving events could not be flushed at shutdown")
+        print(f"📥 Guided-solving event ingestion stopped (flushed {flushed} events)")
+
+event_ingest = EventIngestBuffer(
+    capacity=int(os.getenv("EVENT_INGEST_CAPACITY", 50000)),
+    max_batch=int(os.getenv("EVENT_INGEST_BATCH", 1000)),
+    flush_interval=float(os.getenv("EVENT_INGEST_INTERVAL", 0.5)),
+)
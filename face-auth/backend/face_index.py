@@ -0,0 +1,263 @@
+import os
+import random
+import secrets
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
+from PIL import ImageChops, ImageOps
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
+from database import db_connection
+from probe_cache import probe_cache
+from account_feed import account_feed
+
+DHASH_BANDS = 4
+BAND_BITS = 64 // DHASH_BANDS
+DUPLICATE_POLICIES = ("reject", "flag", "merge")
+CLAIMS_COLLECTION = "face_enrolment_claims"
+
+class EnrolmentBusy(Exception):
+    """Another enrolment of a similar face held its claim for longer than we would wait."""
+
+def dhash(image):
+    """64-bit difference hash: brightness gradients of a 9x8 grayscale thumbnail."""
+    pixels = list(image.convert("L").resize((9, 8)).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+def face_similarity(img1, img2):
+    """Fraction of pixels that are identical in both images (0.0 when sizes or modes differ)."""
+    if img1.size != img2.size or img1.mode != img2.mode:
+        return 0.0
+    
+    total = img1.size[0] * img1.size[1]
+    if total == 0:
+        return 0.0
+    
+    if img1.mode in ("L", "RGB", "RGBA"):
+        diff = ImageChops.difference(img1, img2)
+        bands = diff.split()
+        changed = bands[0]
+        for band in bands[1:]:
+            changed = ImageChops.lighter(changed, band)
+        unchanged = changed.histogram()[0]
+        return unchanged / total
+    
+    diff_count = sum(1 for p1, p2 in zip(img1.getdata(), img2.getdata()) if p1 != p2)
+    return 1 - (diff_count / total)
+
+def face_block(image):
+    return f"{image.mode}:{image.size[0]}x{image.size[1]}"
+
+# Template derivations by version. A new version gets a new band prefix, so
+# bands from different versions never collide and can be matched side by side.
+TEMPLATE_VERSIONS = {
+    1: ("", dhash),
+    # Exposure-normalized before hashing, so the same face under different lighting shares bands.
+    2: ("v2.", lambda image: dhash(ImageOps.autocontrast(image.convert("L")))),
+}
+TEMPLATE_VERSION = int(os.getenv("FACE_TEMPLATE_VERSION", max(TEMPLATE_VERSIONS)))
+
+def _bands(value, prefix):
+    mask = (1 << BAND_BITS) - 1
+    return [f"{prefix}{band}:{(value >> (band * BAND_BITS)) & mask:04x}" for band in range(DHASH_BANDS)]
+
+def fingerprint(image, version=TEMPLATE_VERSION):
+    """Index fields stored on face_data for blocking and LSH lookups.
+
+    `face_similarity` is 0 unless size and mode match, so `face_block` is an
+    exact filter. The dHash is split into bands; near-identical images share
+    at least one band, which makes the bands an approximate filter.
+    """
+    prefix, derive = TEMPLATE_VERSIONS[version]
+    value = derive(image)
+    return {
+        "face_block": face_block(image),
+        "face_dhash": f"{value:016x}",
+        "face_bands": _bands(value, prefix),
+        "template_version": version,
+    }
+
+def probe_fingerprint(image):
+    """Fingerprint of a probe with bands under every known version, to match records mid-migration."""
+    probe_print = fingerprint(image)
+    for version, (prefix, derive) in TEMPLATE_VERSIONS.items():
+        if version != TEMPLATE_VERSION:
+            probe_print["face_bands"] = probe_print["face_bands"] + _bands(derive(image), prefix)
+    return probe_print
+
+class FaceIndex:
+    """Candidate lookup over face_data using the stored fingerprints.
+
+    Login narrows its scan to the probe's block (plus records not yet
+    fingerprinted, whose face_block is null), with LSH-band matches ordered first. Enrolment asks for
+    near-duplicates by band within the block, and callers confirm every
+    candidate with the exact similarity before acting on it. Records marked
+    `duplicate_of` are left out of the login scan only when they were merged
+    into the original; a flagged duplicate is still its own account.
+
+    Enrolment claims every band of the new face in a small collection with a
+    unique _id per (block, band) while it checks and inserts, so two uploads
+    of the same face at once cannot both pass the duplicate check.
+    """
+
+    @property
+    def faces_collection(self):
+        return db_connection.get_collection("face_data")
+
+    @property
+    def claims_collection(self):
+        return db_connection.get_collection(CLAIMS_COLLECTION)
+
+    def ensure_indexes(self):
+        self.faces_collection.create_index([("face_block", ASCENDING), ("face_bands", ASCENDING)])
+        self.faces_collection.create_index("template_version")
+        self.claims_collection.create_index("owner")
+        # Backstop for a worker that died holding a claim; live claims are also taken over once expired.
+        self.claims_collection.create_index("expires_at", expireAfterSeconds=0)
+
+    @contextmanager
+    def enrolment_claim(self, face_print, ttl=30.0, wait=10.0):
+        """Hold the bands of `face_print` across the duplicate check and insert of one enrolment."""
+        if not face_print:
+            yield
+            return
+        ids = sorted(f"{face_print['face_block']}|{band}" for band in face_print["face_bands"])
+        owner = secrets.token_hex(8)
+        give_up = time.monotonic() + wait
+        while True:
+            now = datetime.utcnow()
+            self.claims_collection.delete_many({"_id": {"$in": ids}, "expires_at": {"$lt": now}})
+            try:
+                self.claims_collection.insert_many(
+                    [{"_id": claim_id, "owner": owner, "expires_at": now + timedelta(seconds=ttl)} for claim_id in ids],
+                    ordered=True
+                )
+                break
+            except BulkWriteError:
+                # Part of the face is being enrolled elsewhere; let go of what we got and wait our turn.
+                self.claims_collection.delete_many({"owner": owner})
+                if time.monotonic() >= give_up:
+                    raise EnrolmentBusy("A similar face is being enrolled right now, please retry")
+                time.sleep(random.uniform(0.05, 0.2))
+        try:
+            yield
+        finally:
+            self.claims_collection.delete_many({"owner": owner})
+
+    def login_candidates(self, probe_print, include_duplicates=True):
+        query = {"face_block": {"$in": [probe_print["face_block"], None]}}
+        if not include_duplicates:
+            query["duplicate_of"] = None
+        return self.rank_candidates(list(self.faces_collection.find(query)), probe_print)
+
+    def rank_candidates(self, records, probe_print):
+        bands = set(probe_print["face_bands"])
+        # Likely matches first; the rest of the block is still checked, so recall is unchanged.
+        return sorted(records, key=lambda record: not bands.intersection(record.get("face_bands") or ()))
+
+    def duplicate_candidates(self, probe_print, exclude_user_id=None):
+        query = {
+            "face_block": probe_print["face_block"],
+            "face_bands": {"$in": probe_print["face_bands"]},
+            "duplicate_of": None,
+        }
+        if exclude_user_id:
+            query["user_id"] = {"$ne": exclude_user_id}
+        return list(self.faces_collection.find(query))
+
+    def mark_duplicate(self, user_id, original_user_id, score, merge=False):
+        self.faces_collection.update_one(
+            {"user_id": user_id},
+            {"$set": {"duplicate_of": original_user_id, "duplicate_score": round(score, 4)}}
+        )
+        # Cached decisions may have matched this record, so they are stale.
+        probe_cache.bump()
+        if merge:
+            # face_partitions imports this module for face_similarity.
+            from face_partitions import face_partitions
+            # A merged account is folded into the original: it leaves the search
+            # partitions and the kiosks' account picker.
+            face_partitions.remove_face(user_id)
+            account_feed.record_removed(user_id)
+
+    def dedup_all(self, service, threshold, merge=False, image_cache_size=256):
+        """Fingerprint every record, then flag later enrolments that duplicate an earlier one.
+
+        Records are grouped by block and compared only when they share an LSH
+        band, so images are loaded once for fingerprinting and again only for
+        candidate pairs (through a small LRU), never all held at once. With
+        `merge` the flagged accounts are also removed from the account feed.
+        """
+        @lru_cache(maxsize=image_cache_size)
+        def load(user_id):
+            record = by_user[user_id]
+            data = service.load_face_image(record)
+            return service.decode_image(data) if data else None
+
+        records = list(self.faces_collection.find({"duplicate_of": None}).sort("created_at", ASCENDING))
+        by_user = {record["user_id"]: record for record in records}
+        fingerprinted = 0
+        for record in records:
+            if record.get("face_bands") and record.get("template_version") == TEMPLATE_VERSION:
+                continue
+            try:
+                image = load(record["user_id"])
+            except Exception as e:
+                print(f"⚠️ Skipping {record['user_id']} in dedup: {e}")
+                continue
+            if image is None:
+                continue
+            record.update(fingerprint(image))
+            self.faces_collection.update_one(
+                {"user_id": record["user_id"]},
+                {"$set": {key: record[key] for key in ("face_block", "face_dhash", "face_bands", "template_version")}}
+            )
+            fingerprinted += 1
+
+        seen = {}
+        checked = duplicates = 0
+        for record in records:
+            if not record.get("face_bands"):
+                continue
+            checked += 1
+            user_id = record["user_id"]
+            candidates = set()
+            for band in record["face_bands"]:
+                candidates.update(seen.get((record["face_block"], band), ()))
+            best = None
+            for candidate in sorted(candidates):
+                try:
+                    image, other = load(user_id), load(candidate)
+                except Exception as e:
+                    print(f"⚠️ Could not compare {user_id} with {candidate}: {e}")
+                    continue
+                if image is None or other is None:
+                    continue
+                score = service.face_similarity(image, other)
+                if score > threshold and (best is None or score > best[1]):
+                    best = (candidate, score)
+            if best:
+                self.mark_duplicate(user_id, best[0], best[1], merge=merge)
+                service.forget_template(user_id)
+                duplicates += 1
+                continue
+            for band in record["face_bands"]:
+                seen.setdefault((record["face_block"], band), []).append(user_id)
+
+        print(f"🧬 Dedup finished: {checked} faces checked, {fingerprinted} fingerprinted, {duplicates} duplicates flagged")
+        return {"checked": checked, "fingerprinted": fingerprinted, "duplicates": duplicates}
+
+face_index = FaceIndex()
+
+if __name__ == "__main__":
+    from face_service import face_auth_service, DUPLICATE_FACE_THRESHOLD, DUPLICATE_FACE_POLICY
+
+    db_connection.connect()
+    face_index.ensure_indexes()
+    face_index.dedup_all(face_auth_service, DUPLICATE_FACE_THRESHOLD, merge=DUPLICATE_FACE_POLICY == "merge")
+    db_connection.close()
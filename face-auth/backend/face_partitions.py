@@ -0,0 +1,427 @@
+import bisect
+import hashlib
+import heapq
+import itertools
+import multiprocessing
+import os
+import secrets
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+from PIL import Image
+from face_index import face_similarity
+from metrics import metrics
+
+VIRTUAL_NODES = 64
+CONNECT_TIMEOUT = 10.0
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+def pack_image(image):
+    """Raw pixels travel between processes/hosts, so no side re-encodes or re-decodes."""
+    return (image.mode, image.size, image.tobytes())
+
+def unpack_image(packed):
+    mode, size, raw = packed
+    return Image.frombytes(mode, size, raw)
+
+class HashRing:
+    """Consistent hashing of user ids onto partitions, with virtual nodes.
+
+    Adding a partition moves only the keys that now hash to it (about 1/n of
+    them), which is what `FacePartitions.add_partition` rebalances.
+    """
+
+    def __init__(self, names=(), vnodes=VIRTUAL_NODES):
+        self.vnodes = vnodes
+        self._points = []
+        self._owners = []
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        for replica in range(self.vnodes):
+            point = _hash(f"{name}#{replica}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, name)
+
+    def owner(self, key):
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+class PartitionStore:
+    """One partition's slice of decoded faces, shared by the server's connection threads."""
+
+    def __init__(self):
+        self.faces = {}
+        self.blocks = {}
+        self._lock = threading.Lock()
+
+    def put(self, entries):
+        with self._lock:
+            for user_id, block, packed in entries:
+                self.faces[user_id] = (block, unpack_image(packed))
+                self.blocks.setdefault(block, set()).add(user_id)
+        return len(entries)
+
+    def pop(self, user_ids):
+        taken = []
+        with self._lock:
+            for user_id in user_ids:
+                entry = self.faces.pop(user_id, None)
+                if entry is None:
+                    continue
+                self.blocks.get(entry[0], set()).discard(user_id)
+                taken.append((user_id, entry[0], entry[1]))
+        return taken
+
+    def search(self, probe, block, k, deadline, abandoned, check_every=32):
+        """Top-k (score, user_id) in `block`; None once `abandoned()` says the caller has gone."""
+        with self._lock:
+            candidates = list(self.blocks.get(block, ()))
+        best = []
+        complete = True
+        scanned = 0
+        for index, user_id in enumerate(candidates):
+            if time.monotonic() >= deadline:
+                complete = False
+                break
+            if index % check_every == 0 and abandoned():
+                return None
+            entry = self.faces.get(user_id)
+            if entry is None:
+                continue
+            scanned += 1
+            score = face_similarity(probe, entry[1])
+            if len(best) < k:
+                heapq.heappush(best, (score, user_id))
+            elif score > best[0][0]:
+                heapq.heapreplace(best, (score, user_id))
+        return sorted(best, reverse=True), complete, scanned
+
+def _handle(conn, store, shutdown):
+    with conn:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            command = message[0]
+            try:
+                if command == "put":
+                    conn.send(("ok", store.put(message[1])))
+                elif command in ("take", "drop"):
+                    taken = store.pop(message[1])
+                    if command == "take":
+                        conn.send(("ok", [(user_id, block, pack_image(image)) for user_id, block, image in taken]))
+                    else:
+                        conn.send(("ok", len(message[1])))
+                elif command == "search":
+                    _, request_id, block, packed, k, seconds = message
+                    # The client hangs up on a search it stopped waiting for; a readable
+                    # connection mid-search means exactly that, so the scan stops early.
+                    found = store.search(unpack_image(packed), block, k, time.monotonic() + seconds, abandoned=conn.poll)
+                    if found is None:
+                        metrics.inc("face_partition_searches_abandoned_total")
+                        return
+                    conn.send(("result", request_id, *found))
+                elif command == "stats":
+                    conn.send(("ok", {"faces": len(store.faces)}))
+                elif command == "close":
+                    conn.send(("ok", None))
+                    shutdown()
+                    return
+            except (EOFError, OSError):
+                return
+
+def serve(address, authkey, family=None):
+    """Partition server: holds one slice of enrolled faces and answers searches.
+
+    Every connection gets its own thread, so a coordinator can keep several
+    searches in flight against one partition, and one slow client does not
+    hold up the others. Protocol (tuples over a multiprocessing connection,
+    local or TCP, one request at a time per connection):
+      ("put", [(user_id, block, packed_image)])  -> ("ok", count)
+      ("take", [user_id])                        -> ("ok", [(user_id, block, packed_image)])
+      ("drop", [user_id])                        -> ("ok", count)
+      ("search", req_id, block, packed, k, secs) -> ("result", req_id, [(score, user_id)], complete, scanned)
+      ("stats",)                                 -> ("ok", {"faces": n})
+    Closing the connection while a search runs cancels it.
+    """
+    store = PartitionStore()
+    stopping = threading.Event()
+    with Listener(address, family=family, authkey=authkey) as listener:
+        def shutdown():
+            stopping.set()
+            # accept() only returns for a connection, so make one to wake it.
+            try:
+                Client(listener.address, family=family, authkey=authkey).close()
+            except OSError:
+                pass
+
+        while not stopping.is_set():
+            try:
+                conn = listener.accept()
+            except (OSError, multiprocessing.AuthenticationError) as e:
+                print(f"⚠️ Face partition refused a connection: {e}")
+                continue
+            if stopping.is_set():
+                conn.close()
+                break
+            threading.Thread(target=_handle, args=(conn, store, shutdown), name="face-partition-conn", daemon=True).start()
+
+class PartitionClient:
+    """Coordinator-side connections to one partition server.
+
+    Connections are pooled: each call checks one out, so concurrent
+    searches against the same partition run side by side instead of queuing
+    behind a single pipe. A search that misses its deadline closes its
+    connection, which also tells the server to stop scanning for it.
+    """
+
+    def __init__(self, name, address, authkey, family=None, process=None, max_idle=8):
+        self.name = name
+        self.address = address
+        self.authkey = authkey
+        self.family = family
+        self.process = process
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        give_up = time.monotonic() + CONNECT_TIMEOUT
+        while True:
+            try:
+                return Client(self.address, family=self.family, authkey=self.authkey)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() >= give_up:
+                    raise
+                time.sleep(0.05)
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _checkin(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def call(self, *message):
+        conn = self._checkout()
+        try:
+            conn.send(message)
+            reply = conn.recv()
+        except Exception:
+            conn.close()
+            raise
+        self._checkin(conn)
+        return reply
+
+    def search(self, request_id, block, packed, k, seconds):
+        """Returns the partition's reply, or None if it missed the deadline."""
+        conn = self._checkout()
+        try:
+            conn.send(("search", request_id, block, packed, k, seconds))
+            if not conn.poll(seconds + 0.05):
+                conn.close()
+                return None
+            reply = conn.recv()
+        except Exception:
+            conn.close()
+            raise
+        self._checkin(conn)
+        return reply
+
+    def close(self):
+        # Only shut down servers this coordinator spawned; remote ones outlive it.
+        if self.process is not None:
+            try:
+                self.call("close")
+            except Exception:
+                pass
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+        if self.process is not None:
+            self.process.join(timeout=5)
+
+class FacePartitions:
+    """Scatter-gather 1:N search over faces partitioned by consistent hash of user_id.
+
+    Each partition is a separate process (or a remote `python face_partitions.py
+    serve host:port` server) holding decoded images for its slice, so one
+    identify uses every core: the probe is fanned out to all partitions
+    concurrently, each scans only the probe's block within `deadline`, and
+    the coordinator merges their top-K. A partition that misses the deadline
+    is reported as incomplete rather than stalling the request. Up to
+    `concurrency` searches run against each partition at once.
+    """
+
+    def __init__(self, authkey=None, concurrency=8):
+        self.authkey = authkey or secrets.token_bytes(16)
+        self.concurrency = concurrency
+        self.ring = HashRing()
+        self.partitions = {}
+        self.owners = {}
+        self.loaded = False
+        self._lock = threading.RLock()
+        self._ids = itertools.count()
+        self._pool = None
+        self._socket_dir = None
+
+    @property
+    def enabled(self):
+        return bool(self.partitions)
+
+    @property
+    def pool(self):
+        return self._pool
+
+    def processes(self):
+        return [client.process for client in self.partitions.values() if client.process is not None]
+
+    def _spawn_local(self, name):
+        if self._socket_dir is None:
+            self._socket_dir = tempfile.mkdtemp(prefix="face-partitions-")
+        address = os.path.join(self._socket_dir, f"{name}.sock")
+        process = multiprocessing.get_context("spawn").Process(
+            target=serve, args=(address, self.authkey, "AF_UNIX"), name=f"face-partition-{name}", daemon=True
+        )
+        process.start()
+        return PartitionClient(name, address, self.authkey, family="AF_UNIX", process=process, max_idle=self.concurrency)
+
+    def add_partition(self, name=None, address=None):
+        """Add a local (spawned) or remote partition and move the users the ring now assigns to it."""
+        with self._lock:
+            name = name or f"p{len(self.partitions)}"
+            client = PartitionClient(name, address, self.authkey, max_idle=self.concurrency) if address else self._spawn_local(name)
+            self.partitions[name] = client
+            self.ring.add(name)
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+            self._pool = ThreadPoolExecutor(max_workers=len(self.partitions) * self.concurrency, thread_name_prefix="face-partition")
+
+            moves = {}
+            for user_id, owner in self.owners.items():
+                if self.ring.owner(user_id) == name:
+                    moves.setdefault(owner, []).append(user_id)
+            moved = 0
+            for owner, user_ids in moves.items():
+                _, entries = self.partitions[owner].call("take", user_ids)
+                if entries:
+                    client.call("put", entries)
+                for user_id, _, _ in entries:
+                    self.owners[user_id] = name
+                moved += len(entries)
+            metrics.set_gauge("face_partitions", len(self.partitions))
+            print(f"🧩 Added face partition {name}; rebalanced {moved} faces onto it")
+            return moved
+
+    def add_face(self, user_id, block, image):
+        with self._lock:
+            owner = self.ring.owner(user_id)
+            if owner is None:
+                return False
+            previous = self.owners.get(user_id)
+            if previous and previous != owner:
+                self.partitions[previous].call("drop", [user_id])
+            self.partitions[owner].call("put", [(user_id, block, pack_image(image))])
+            self.owners[user_id] = owner
+            return True
+
+    def remove_face(self, user_id):
+        with self._lock:
+            owner = self.owners.pop(user_id, None)
+            if owner:
+                self.partitions[owner].call("drop", [user_id])
+
+    def load(self, records, batch_size=64):
+        """Bulk-load (user_id, block, image) tuples, batched per partition."""
+        batches = {}
+        count = 0
+        with self._lock:
+            for user_id, block, image in records:
+                owner = self.ring.owner(user_id)
+                batch = batches.setdefault(owner, [])
+                batch.append((user_id, block, pack_image(image)))
+                self.owners[user_id] = owner
+                count += 1
+                if len(batch) >= batch_size:
+                    self.partitions[owner].call("put", batch)
+                    batches[owner] = []
+            for owner, batch in batches.items():
+                if batch:
+                    self.partitions[owner].call("put", batch)
+            self.loaded = True
+        print(f"🧩 Loaded {count} faces into {len(self.partitions)} partitions")
+        return count
+
+    def search(self, probe_image, block, k=5, deadline=None):
+        """Return (top-K [(score, user_id)], complete) merged across partitions."""
+        seconds = max(0.0, deadline.remaining()) if deadline is not None else 5.0
+        request_id = next(self._ids)
+        packed = pack_image(probe_image)
+        started = time.monotonic()
+        futures = [
+            self._pool.submit(client.search, request_id, block, packed, k, seconds)
+            for client in list(self.partitions.values())
+        ]
+        merged = []
+        complete = True
+        for future in futures:
+            reply = future.result()
+            if reply is None or not reply[3]:
+                complete = False
+                metrics.inc("face_partition_timeouts_total")
+            if reply is not None:
+                merged.extend(reply[2])
+        metrics.observe("face_partition_search_seconds", time.monotonic() - started)
+        return heapq.nlargest(k, merged), complete
+
+    def start(self, count, addresses=()):
+        for address in addresses:
+            host, port = address.rsplit(":", 1)
+            self.add_partition(name=address, address=(host, int(port)))
+        for _ in range(count):
+            self.add_partition()
+
+    def stop(self):
+        with self._lock:
+            for client in self.partitions.values():
+                client.close()
+            self.partitions = {}
+            self.ring = HashRing()
+            self.owners = {}
+            self.loaded = False
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+
+face_partitions = FacePartitions(
+    authkey=os.getenv("FACE_PARTITION_AUTHKEY", "").encode("utf-8") or None,
+    concurrency=int(os.getenv("FACE_PARTITION_CONCURRENCY", 8)),
+)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "serve":
+        host, port = sys.argv[2].rsplit(":", 1)
+        key = os.getenv("FACE_PARTITION_AUTHKEY")
+        if not key:
+            sys.exit("FACE_PARTITION_AUTHKEY must be set for a remote partition server")
+        print(f"🧩 Serving a face partition on {host}:{port}")
+        serve((host, int(port)), key.encode("utf-8"))
+    else:
+        print("usage: python face_partitions.py serve host:port")
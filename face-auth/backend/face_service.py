@@ -2,134 +2,510 @@ import os
 import sys
 from database import db_connection
 from cloudinary_config import cloudinary_manager
+from write_behind import login_write_behind
+from outbox import upload_outbox
+from account_feed import account_feed
+from face_index import face_index, fingerprint, probe_fingerprint, face_block, face_similarity, DUPLICATE_POLICIES
+from face_partitions import face_partitions
+from probe_quality import probe_quality_gate, ProbeRejected
+from probe_cache import probe_cache
+from transcode import transcode_enrolment
 from models import User, FaceData
 from datetime import datetime
 import bcrypt
+import io
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+FACE_MATCH_THRESHOLD = 0.85
+DUPLICATE_FACE_THRESHOLD = float(os.getenv("DUPLICATE_FACE_THRESHOLD", FACE_MATCH_THRESHOLD))
+DUPLICATE_FACE_POLICY = os.getenv("DUPLICATE_FACE_POLICY", "reject")
+if DUPLICATE_FACE_POLICY not in DUPLICATE_POLICIES:
+    print(f"⚠️ Unknown DUPLICATE_FACE_POLICY '{DUPLICATE_FACE_POLICY}', falling back to 'reject'")
+    DUPLICATE_FACE_POLICY = "reject"
+
+# Only a merged duplicate stops being an account of its own; a flagged one still logs in.
+INCLUDE_DUPLICATES = DUPLICATE_FACE_POLICY != "merge"
+
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", 256))
+TEMPLATE_CACHE_TTL = float(os.getenv("TEMPLATE_CACHE_TTL", 300.0))
+
+class LoginScanCache:
+    """Login candidates kept across the frames of one streaming login.
+
+    The shortlist for a face block is read from Mongo once, and each stored
+    face is decrypted and decoded once (up to `max_images`), so later frames
+    only re-rank the shortlist and run comparisons. It lives only as long
+    as one login attempt; a face replaced during that window is compared as
+    it was, and complete_login still requires the account to exist.
+    """
+
+    def __init__(self, max_images=256):
+        self.max_images = max_images
+        self._shortlists = {}
+        self._images = {}
+
+    def candidates(self, probe_print, include_duplicates):
+        records = self._shortlists.get(probe_print["face_block"])
+        if records is None:
+            records = face_index.login_candidates(probe_print, include_duplicates=include_duplicates)
+            self._shortlists[probe_print["face_block"]] = records
+            return records
+        return face_index.rank_candidates(records, probe_print)
+
+    def image(self, user_id):
+        return self._images.get(user_id)
+
+    def keep_image(self, user_id, image):
+        if len(self._images) < self.max_images:
+            self._images[user_id] = image
 
 class FaceAuthService:
     def __init__(self):
-        self.users_collection = db_connection.get_collection("users")
-        self.faces_collection = db_connection.get_collection("face_data")
+        self._templates = OrderedDict()
+        self._templates_lock = threading.Lock()
+    
+    @property
+    def users_collection(self):
+        return db_connection.get_collection("users")
+    
+    @property
+    def faces_collection(self):
+        return db_connection.get_collection("face_data")
         
     def register_user_with_face(self, email: str, password: str, face_image_data: bytes):
         try:
             print(f"👤 Registering user: {email}")
             
-            user_id = f"user_{datetime.utcnow().timestamp()}"
+            probe_image = None
+            try:
+                probe_image = self.decode_image(face_image_data)
+                face_print = fingerprint(probe_image)
+            except Exception as e:
+                print(f"⚠️ Could not fingerprint face for {email}, skipping duplicate check: {e}")
+                face_print = {}
             
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+            with face_index.enrolment_claim(face_print):
+                return self._enrol(email, password, face_image_data, probe_image, face_print)
+                
+        except Exception as e:
+            print(f"❌ User registration failed: {e}")
+            return {
+                "success": False,
+                "message": f"Registration failed: {str(e)}"
+            }
+    
+    def _enrol(self, email, password, face_image_data, probe_image, face_print):
+        """Duplicate check and insert; runs while the face's enrolment claim is held."""
+        duplicate = self.find_duplicate_face(probe_image) if face_print else None
+        if duplicate and DUPLICATE_FACE_POLICY == "reject":
+            print(f"🚫 Registration for {email} rejected: face already enrolled as {duplicate[0]} ({duplicate[1]:.2f})")
+            return {
+                "success": False,
+                "message": "This face is already enrolled under another account"
+            }
+        if duplicate and DUPLICATE_FACE_POLICY == "merge":
+            print(f"🔗 Registration for {email} merged into existing account {duplicate[0]}")
+            return {
+                "success": True,
+                "user_id": duplicate[0],
+                "merged": True,
+                "message": "Face already enrolled, using the existing account"
+            }
+        
+        user_id = f"user_{datetime.utcnow().timestamp()}"
+        
+        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        
+        user = User(
+            user_id=user_id,
+            email=email,
+            password_hash=password_hash
+        )
+        
+        try:
+            stored_image_data, image_info = transcode_enrolment(face_image_data)
+        except Exception as e:
+            print(f"⚠️ Could not transcode face for {email}, storing the upload as is: {e}")
+            stored_image_data, image_info = face_image_data, {}
+        
+        encrypted_data = cloudinary_manager.encrypt_image(stored_image_data)
+        if not encrypted_data:
+            return {
+                "success": False,
+                "message": "Failed to encrypt face data"
+            }
+        
+        # Stage the blob first so a crash at any later point is recoverable by reconcile().
+        upload_outbox.stage(user_id, encrypted_data)
+        
+        try:
+            self.users_collection.insert_one(user.dict())
             
-            user = User(
+            face_data = FaceData(
                 user_id=user_id,
-                email=email,
-                password_hash=password_hash
+                upload_status="pending",
+                **face_print,
+                **image_info
             )
+            if duplicate:
+                face_data.duplicate_of, face_data.duplicate_score = duplicate[0], round(duplicate[1], 4)
+                print(f"🚩 Registration for {email} flagged as a duplicate of {duplicate[0]}")
+            self.faces_collection.insert_one(face_data.dict())
+        except Exception:
+            self.users_collection.delete_one({"user_id": user_id})
+            upload_outbox.discard(user_id)
+            raise
+        
+        upload_outbox.submit(user_id)
+        self.forget_template(user_id)
+        
+        try:
+            probe_cache.bump()
+        except Exception as e:
+            print(f"⚠️ Probe cache not invalidated after enrolling {user_id}: {e}")
+        
+        # A duplicate only gets this far when it is flagged, and flagged accounts still log in.
+        if face_partitions.loaded and face_print:
+            try:
+                face_partitions.add_face(user_id, face_print["face_block"], probe_image)
+            except Exception as e:
+                print(f"⚠️ Face partition not updated for {user_id}, login will fall back to a scan: {e}")
+        
+        try:
+            account_feed.record_added(user_id, email)
+        except Exception as e:
+            print(f"⚠️ Account feed not updated for {user_id}, clients will catch up on their next full sync: {e}")
+        
+        print(f"✅ User {email} registered successfully - face upload queued for Cloudinary")
+        return {
+            "success": True,
+            "user_id": user_id,
+            "message": "User registered successfully with encrypted face data"
+        }
+    
+    def authenticate_user_with_face(self, face_image_data: bytes, deadline=None, face_boxes=None, scan_cache=None):
+        try:
+            print("🔍 Authenticating user with face...")
             
-            self.users_collection.insert_one(user.dict())
+            # Retries of the same frame replay the earlier decision instead of rescanning.
+            digest = probe_cache.digest(face_image_data)
+            version = probe_cache.version()
+            replay, cached_user = probe_cache.lookup_exact(digest, version)
+            if replay:
+                if cached_user is None:
+                    return {
+                        "success": False,
+                        "message": "Face not recognized"
+                    }
+                result = self.complete_login(cached_user)
+                if result:
+                    return result
             
-            upload_result = cloudinary_manager.upload_encrypted_face(user_id, face_image_data)
+            probe_image = self.decode_probe(face_image_data)
+            probe_quality_gate.check(probe_image, face_boxes)
+            probe_print = probe_fingerprint(probe_image)
             
-            if upload_result:
-                face_data = FaceData(
-                    user_id=user_id,
-                    cloudinary_url=upload_result["secure_url"],
-                    cloudinary_public_id=upload_result["public_id"],
-                    encryption_format=upload_result["format"]
-                )
-                
-                self.faces_collection.insert_one(face_data.dict())
-                
-                print(f"✅ User {email} registered successfully - face stored in Cloudinary")
+            result = self.find_login_match(probe_image, probe_print, deadline, scan_cache)
+            if result is None:
+                probe_cache.remember_no_match(digest, version)
                 return {
-                    "success": True,
-                    "user_id": user_id,
-                    "message": "User registered successfully with encrypted face data in Cloudinary"
+                    "success": False,
+                    "message": "Face not recognized"
                 }
-            else:
-                self.users_collection.delete_one({"user_id": user_id})
+            if result["success"]:
+                probe_cache.remember_match(digest, version, result["user_id"])
+            return result
+            
+        except ProbeRejected as e:
+            print(f"🚫 Probe rejected before matching: {e.reason}")
+            return {
+                "success": False,
+                "reason": e.reason,
+                "message": str(e)
+            }
+        except Exception as e:
+            print(f"❌ Face authentication failed: {e}")
+            return {
+                "success": False,
+                "message": f"Authentication failed: {str(e)}"
+            }
+    
+    def find_login_match(self, probe_image, probe_print, deadline=None, scan_cache=None):
+        """Full 1:N search; None means every candidate was checked and none matched.
+
+        A LoginScanCache passed as `scan_cache` supplies the shortlist and the
+        decoded faces seen by earlier frames of the same login.
+        """
+        if scan_cache is not None:
+            users_with_faces = scan_cache.candidates(probe_print, INCLUDE_DUPLICATES)
+        else:
+            users_with_faces = face_index.login_candidates(probe_print, include_duplicates=INCLUDE_DUPLICATES)
+        
+        if face_partitions.loaded:
+            matches, complete = face_partitions.search(probe_image, probe_print["face_block"], k=3, deadline=deadline)
+            for score, user_id in matches:
+                if score > FACE_MATCH_THRESHOLD:
+                    eligible = {"user_id": user_id} if INCLUDE_DUPLICATES else {"user_id": user_id, "duplicate_of": None}
+                    if self.faces_collection.count_documents(eligible, limit=1) == 0:
+                        # Removed or merged, possibly by another worker, since the partitions were loaded.
+                        face_partitions.remove_face(user_id)
+                        continue
+                    result = self.complete_login(user_id)
+                    if result:
+                        return result
+            if not complete:
                 return {
                     "success": False,
-                    "message": "Failed to upload encrypted face data to Cloudinary"
+                    "message": "Authentication timed out"
                 }
+            # Faces enrolled through other workers since the load are not partitioned yet.
+            users_with_faces = [r for r in users_with_faces if r["user_id"] not in face_partitions.owners]
+            if not users_with_faces:
+                return None
+        
+        if not users_with_faces:
+            return {
+                "success": False,
+                "message": "No registered faces found"
+            }
+        
+        inconclusive = False
+        for face_record in users_with_faces:
+            if deadline is not None and deadline.expired():
+                print("⏱️ Authentication deadline exceeded before all faces were checked")
+                return {
+                    "success": False,
+                    "message": "Authentication timed out"
+                }
+            try:
+                stored_image = scan_cache.image(face_record["user_id"]) if scan_cache is not None else None
+                if stored_image is None:
+                    stored_face = self.load_face_image(face_record, deadline)
+                    if not stored_face:
+                        inconclusive = True
+                        continue
+                    stored_image = self.decode_image(stored_face)
+                    if scan_cache is not None:
+                        scan_cache.keep_image(face_record["user_id"], stored_image)
                 
-        except Exception as e:
-            print(f"❌ User registration failed: {e}")
+                if self.face_similarity(probe_image, stored_image) > FACE_MATCH_THRESHOLD:
+                    result = self.complete_login(face_record["user_id"])
+                    if result:
+                        return result
+            except Exception as e:
+                print(f"⚠️ Error checking face for user {face_record.get('user_id', 'unknown')}: {e}")
+                inconclusive = True
+                continue
+        
+        if inconclusive:
+            # A candidate we could not check makes this "no match" unsafe to cache.
             return {
                 "success": False,
-                "message": f"Registration failed: {str(e)}"
+                "message": "Face not recognized"
             }
+        return None
     
-    def authenticate_user_with_face(self, face_image_data: bytes):
+    def find_duplicate_face(self, probe_image):
+        """Return (user_id, score) of the closest enrolled face above the duplicate threshold, if any."""
+        best = None
+        candidates = face_index.duplicate_candidates(probe_fingerprint(probe_image))
+        for face_record in candidates:
+            try:
+                stored_face = self.load_face_image(face_record)
+                if not stored_face:
+                    continue
+                score = self.face_similarity(probe_image, self.decode_image(stored_face))
+            except Exception as e:
+                print(f"⚠️ Duplicate check skipped {face_record.get('user_id', 'unknown')}: {e}")
+                continue
+            if score > DUPLICATE_FACE_THRESHOLD and (best is None or score > best[1]):
+                best = (face_record["user_id"], score)
+        return best
+    
+    def load_face_image(self, face_record, deadline=None):
+        """Return the decrypted face image, from the local outbox while its upload is pending."""
+        if face_record.get("upload_status") == "pending":
+            encrypted_data = upload_outbox.load_blob(face_record["user_id"])
+            if encrypted_data is not None:
+                return cloudinary_manager.decrypt_image(encrypted_data)
+            # The upload may have completed since the record was read.
+            face_record = self.faces_collection.find_one({"user_id": face_record["user_id"]})
+            if not face_record or face_record.get("upload_status") == "pending":
+                return None
+        
+        return cloudinary_manager.download_and_decrypt_face(
+            face_record["cloudinary_public_id"],
+            url=face_record.get("cloudinary_url"),
+            deadline=deadline
+        )
+    
+    def verify_user_with_face(self, user_id: str, face_image_data: bytes, deadline=None, face_boxes=None):
+        """1:1 check of a probe against one claimed account's stored face."""
         try:
-            print("🔍 Authenticating user with face...")
+            probe_image = self.decode_probe(face_image_data)
+            probe_quality_gate.check(probe_image, face_boxes)
             
-            users_with_faces = list(self.faces_collection.find({}))
-            
-            if not users_with_faces:
+            template = self.load_template(user_id, deadline)
+            if template is None:
                 return {
                     "success": False,
-                    "message": "No registered faces found"
+                    "user_id": user_id,
+                    "decision": "unknown_account",
+                    "message": "No enrolled face for this account"
                 }
             
-            for face_record in users_with_faces:
-                try:
-                    stored_encrypted_face = cloudinary_manager.download_and_decrypt_face(
-                        face_record["cloudinary_public_id"]
-                    )
-                    
-                    if stored_encrypted_face and self.compare_faces(face_image_data, stored_encrypted_face):
-                        user = self.users_collection.find_one({"user_id": face_record["user_id"]})
-                        
-                        if user:
-                            self.users_collection.update_one(
-                                {"user_id": user["user_id"]},
-                                {"$set": {"last_login": datetime.utcnow()}}
-                            )
-                            
-                            print(f"✅ Face authentication successful for user {user['email']}")
-                            return {
-                                "success": True,
-                                "user_id": user["user_id"],
-                                "email": user["email"],
-                                "message": "Face authentication successful"
-                            }
-                except Exception as e:
-                    print(f"⚠️ Error checking face for user {face_record.get('user_id', 'unknown')}: {e}")
-                    continue
+            score = self.face_similarity(probe_image, template)
+            if score <= FACE_MATCH_THRESHOLD:
+                print(f"❌ Face verification failed for {user_id} (score {score:.3f})")
+                return {
+                    "success": False,
+                    "user_id": user_id,
+                    "score": round(score, 4),
+                    "threshold": FACE_MATCH_THRESHOLD,
+                    "decision": "reject",
+                    "message": "Face does not match this account"
+                }
             
+            result = self.complete_login(user_id)
+            if not result:
+                self.forget_template(user_id)
+                return {
+                    "success": False,
+                    "user_id": user_id,
+                    "decision": "unknown_account",
+                    "message": "User not found"
+                }
+            return {
+                **result,
+                "score": round(score, 4),
+                "threshold": FACE_MATCH_THRESHOLD,
+                "decision": "accept"
+            }
+        except ProbeRejected as e:
+            print(f"🚫 Probe for {user_id} rejected before matching: {e.reason}")
             return {
                 "success": False,
-                "message": "Face not recognized"
+                "user_id": user_id,
+                "decision": "retry",
+                "reason": e.reason,
+                "message": str(e)
             }
-            
         except Exception as e:
-            print(f"❌ Face authentication failed: {e}")
+            print(f"❌ Face verification failed: {e}")
             return {
                 "success": False,
-                "message": f"Authentication failed: {str(e)}"
+                "user_id": user_id,
+                "decision": "error",
+                "message": f"Verification failed: {str(e)}"
             }
     
+    def load_template(self, user_id: str, deadline=None):
+        """Decoded stored face for one user, cached for TEMPLATE_CACHE_TTL seconds.
+
+        Enrolment, dedup and template migration call `forget_template` for
+        the records they touch.
+        """
+        now = time.monotonic()
+        with self._templates_lock:
+            entry = self._templates.get(user_id)
+            if entry is not None and now - entry[0] < TEMPLATE_CACHE_TTL:
+                self._templates.move_to_end(user_id)
+                return entry[1]
+        
+        face_record = self.faces_collection.find_one({"user_id": user_id})
+        if not face_record:
+            return None
+        stored_face = self.load_face_image(face_record, deadline)
+        if not stored_face:
+            return None
+        template = self.decode_image(stored_face)
+        
+        with self._templates_lock:
+            self._templates[user_id] = (now, template)
+            self._templates.move_to_end(user_id)
+            while len(self._templates) > TEMPLATE_CACHE_SIZE:
+                self._templates.popitem(last=False)
+        return template
+    
+    def warm_templates(self, limit: int, workers: int = 8):
+        """Pre-load templates for the most recently active users; returns how many loaded."""
+        users = self.users_collection.find({}, {"_id": 0, "user_id": 1}).sort("last_login", -1).limit(limit)
+        user_ids = [user["user_id"] for user in users]
+        
+        def load(user_id):
+            try:
+                return self.load_template(user_id) is not None
+            except Exception as e:
+                print(f"⚠️ Warm-up skipped {user_id}: {e}")
+                return False
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="warm-up") as pool:
+            loaded = sum(pool.map(load, user_ids))
+        print(f"🔥 Warmed {loaded}/{len(user_ids)} face templates")
+        return loaded
+    
+    def load_partitions(self, workers: int = 8):
+        """Decode every login-eligible enrolled face once and bulk-load it into the search partitions."""
+        records = list(self.faces_collection.find({} if INCLUDE_DUPLICATES else {"duplicate_of": None}))
+        
+        def load(record):
+            try:
+                stored_face = self.load_face_image(record)
+                if stored_face:
+                    image = self.decode_image(stored_face)
+                    return record["user_id"], face_block(image), image
+            except Exception as e:
+                print(f"⚠️ Partition load skipped {record.get('user_id', 'unknown')}: {e}")
+            return None
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="partition-load") as pool:
+            return face_partitions.load(entry for entry in pool.map(load, records) if entry)
+    
+    def forget_template(self, user_id: str):
+        with self._templates_lock:
+            self._templates.pop(user_id, None)
+    
+    def complete_login(self, user_id: str):
+        user = self.users_collection.find_one({"user_id": user_id})
+        if not user:
+            return None
+        
+        login_write_behind.record_login(user["user_id"], user["email"])
+        
+        print(f"✅ Face authentication successful for user {user['email']}")
+        return {
+            "success": True,
+            "user_id": user["user_id"],
+            "email": user["email"],
+            "message": "Face authentication successful"
+        }
+    
+    def decode_image(self, image_data: bytes):
+        image = Image.open(io.BytesIO(image_data))
+        image.load()
+        return image
+    
+    def decode_probe(self, image_data: bytes):
+        """Decode a login frame; anything that is not a readable image is a rejected probe."""
+        try:
+            return self.decode_image(image_data)
+        except Exception as e:
+            print(f"⚠️ Probe could not be decoded: {e}")
+            raise ProbeRejected("unreadable")
+    
+    def face_similarity(self, img1, img2):
+        return face_similarity(img1, img2)
+    
     def compare_faces(self, face1_data: bytes, face2_data: bytes):
         try:
-            from PIL import Image
-            import io
-            
-            img1 = Image.open(io.BytesIO(face1_data))
-            img2 = Image.open(io.BytesIO(face2_data))
-            
-            if img1.size != img2.size:
-                return False
-            
-            pixels1 = list(img1.getdata())
-            pixels2 = list(img2.getdata())
-            
-            if len(pixels1) != len(pixels2):
-                return False
-            
-            diff_count = sum(1 for p1, p2 in zip(pixels1, pixels2) if p1 != p2)
-            similarity = 1 - (diff_count / len(pixels1))
+            img1 = self.decode_image(face1_data)
+            img2 = self.decode_image(face2_data)
             
-            return similarity > 0.85
+            return self.face_similarity(img1, img2) > FACE_MATCH_THRESHOLD
             
         except Exception as e:
             print(f"❌ Face comparison error: {e}")
@@ -0,0 +1,211 @@
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict
+from pymongo import ASCENDING, UpdateOne
+from database import db_connection
+
+STATE_COLLECTION = "flashcard_state"
+DAY_SECONDS = 86400
+MIN_EASE = 130  # ease factors are stored as integer percent (250 == 2.5)
+DEFAULT_EASE = 250
+
+CARD_CATALOGUE = {
+    "binary-search-halving": {
+        "topic": "Binary Search",
+        "concept": "Binary search works by repeatedly dividing the search interval in half. Always ensure your array is sorted before applying binary search.",
+        "difficulty": "Medium"
+    },
+    "dp-subproblems": {
+        "topic": "Dynamic Programming",
+        "concept": "Break down complex problems into simpler subproblems. Store results of subproblems to avoid redundant calculations (memoization).",
+        "difficulty": "Hard"
+    },
+    "arrays-two-pointer": {
+        "topic": "Array Manipulation",
+        "concept": "Two-pointer technique is efficient for problems involving pairs or subarrays. Move pointers based on problem constraints.",
+        "difficulty": "Easy"
+    },
+    "complexity-log-n": {
+        "topic": "Time Complexity",
+        "concept": "O(log n) is better than O(n). Always analyze worst-case scenarios when choosing algorithms.",
+        "difficulty": "Easy"
+    },
+}
+
+def sm2(ease, interval, reps, quality, now):
+    """One SM-2 step. Returns (ease, interval_days, reps, due_ts)."""
+    if quality < 3:
+        reps = 0
+        interval = 1
+    else:
+        reps += 1
+        if reps == 1:
+            interval = 1
+        elif reps == 2:
+            interval = 6
+        else:
+            interval = max(1, round(interval * ease / 100))
+    ease = max(MIN_EASE, ease + round(100 * (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))))
+    return ease, interval, reps, int(now + interval * DAY_SECONDS)
+
+class CardDeck:
+    """One user's reviewed card states plus a due-date min-heap.
+
+    States are stored as compact [ease, interval, reps, due] lists, and only
+    for cards the user has reviewed. Unreviewed cards are due immediately, so
+    they come first, in the shared catalogue order; `_unreviewed_from` skips
+    the prefix of that order already reviewed, which only ever grows. The heap
+    uses lazy deletion: a review pushes a fresh (due, card_id) entry, and
+    entries whose due no longer matches the card's state are skipped on pop.
+    The heap is rebuilt once stale entries outnumber live ones, so both
+    reviews and "next N due" stay O(log n) per card touched.
+    """
+
+    def __init__(self, states, card_order, loaded_at):
+        self.states = states
+        self.card_order = card_order
+        self.loaded_at = loaded_at
+        self.lock = threading.Lock()
+        self._unreviewed_from = 0
+        self._heap = [(state[3], card_id) for card_id, state in states.items()]
+        heapq.heapify(self._heap)
+
+    def _compact(self):
+        if len(self._heap) > 2 * len(self.states) + 64:
+            self._heap = [(state[3], card_id) for card_id, state in self.states.items()]
+            heapq.heapify(self._heap)
+
+    def _unreviewed(self, limit):
+        while self._unreviewed_from < len(self.card_order) and self.card_order[self._unreviewed_from] in self.states:
+            self._unreviewed_from += 1
+        taken = []
+        for card_id in self.card_order[self._unreviewed_from:]:
+            if len(taken) >= limit:
+                break
+            if card_id not in self.states:
+                taken.append((0, card_id))
+        return taken
+
+    def next_due(self, limit):
+        taken = self._unreviewed(limit)
+        popped = []
+        while self._heap and len(taken) < limit:
+            due, card_id = heapq.heappop(self._heap)
+            state = self.states.get(card_id)
+            if state is None or state[3] != due:
+                continue
+            popped.append((due, card_id))
+            taken.append((due, card_id))
+        for entry in popped:
+            heapq.heappush(self._heap, entry)
+        return taken
+
+    def set_state(self, card_id, state):
+        self.states[card_id] = state
+        heapq.heappush(self._heap, (state[3], card_id))
+        self._compact()
+
+class FlashcardScheduler:
+    """SM-2 spaced-repetition scheduling with per-user decks cached in memory.
+
+    Only cards a user has reviewed are persisted (one small document per card,
+    indexed on user_id + due); unreviewed catalogue cards are due immediately.
+    Decks are loaded once per process, kept in an LRU, and reloaded after
+    `deck_ttl` seconds to pick up reviews handled by other workers.
+    """
+
+    def __init__(self, catalogue=CARD_CATALOGUE, max_decks=1000, deck_ttl=300.0):
+        self.catalogue = catalogue
+        self.max_decks = max_decks
+        self.deck_ttl = deck_ttl
+        self.card_order = list(catalogue)
+        self._decks = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def state_collection(self):
+        return db_connection.get_collection(STATE_COLLECTION)
+
+    def ensure_indexes(self):
+        self.state_collection.create_index([("u", ASCENDING), ("c", ASCENDING)], unique=True)
+        self.state_collection.create_index([("u", ASCENDING), ("d", ASCENDING)])
+
+    def _load_deck(self, user_id):
+        states = {}
+        for doc in self.state_collection.find({"u": user_id}, {"_id": 0, "c": 1, "e": 1, "i": 1, "r": 1, "d": 1}):
+            states[doc["c"]] = [doc["e"], doc["i"], doc["r"], doc["d"]]
+        return CardDeck(states, self.card_order, time.monotonic())
+
+    def deck(self, user_id):
+        with self._lock:
+            deck = self._decks.get(user_id)
+            if deck is not None and time.monotonic() - deck.loaded_at < self.deck_ttl:
+                self._decks.move_to_end(user_id)
+                return deck
+        deck = self._load_deck(user_id)
+        with self._lock:
+            self._decks[user_id] = deck
+            self._decks.move_to_end(user_id)
+            while len(self._decks) > self.max_decks:
+                self._decks.popitem(last=False)
+        return deck
+
+    def next_cards(self, user_id, limit=4, now=None):
+        now = now or time.time()
+        deck = self.deck(user_id)
+        with deck.lock:
+            upcoming = deck.next_due(limit)
+        cards = []
+        for due, card_id in upcoming:
+            content = self.catalogue.get(card_id)
+            if content is None:
+                continue
+            cards.append({
+                "card_id": card_id,
+                **content,
+                "due": due <= now,
+                "due_at": due,
+            })
+        return cards
+
+    def review_many(self, user_id, reviews, now=None):
+        """Apply [{"card_id", "quality"}] reviews and persist them in a single bulk_write.
+
+        The deck in memory only changes once the write has succeeded, so a
+        failed write leaves memory and Mongo in agreement.
+        """
+        now = now or time.time()
+        deck = self.deck(user_id)
+        results = []
+        with deck.lock:
+            new_states = {}
+            for review in reviews:
+                card_id = review["card_id"]
+                if card_id not in self.catalogue:
+                    results.append({"card_id": card_id, "error": "unknown card"})
+                    continue
+                # A card reviewed twice in one batch builds on its first review.
+                previous = new_states.get(card_id, deck.states.get(card_id, [DEFAULT_EASE, 0, 0, 0]))
+                ease, interval, reps, due = sm2(previous[0], previous[1], previous[2], review["quality"], now)
+                new_states[card_id] = [ease, interval, reps, due]
+                results.append({"card_id": card_id, "interval_days": interval, "due_at": due})
+            operations = [
+                UpdateOne(
+                    {"u": user_id, "c": card_id},
+                    {"$set": {"e": state[0], "i": state[1], "r": state[2], "d": state[3]}},
+                    upsert=True
+                )
+                for card_id, state in new_states.items()
+            ]
+            if operations:
+                self.state_collection.bulk_write(operations, ordered=False)
+            for card_id, state in new_states.items():
+                deck.set_state(card_id, state)
+        return results
+
+flashcard_scheduler = FlashcardScheduler(
+    max_decks=int(os.getenv("FLASHCARD_MAX_DECKS", 1000)),
+    deck_ttl=float(os.getenv("FLASHCARD_DECK_TTL", 300.0)),
+)
@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from email.utils import formatdate
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import anyio
+from starlette.responses import Response
+
+# ---------------------------------------------------------------------------
+# Local image store
+# ---------------------------------------------------------------------------
+
+SUFFIXES = {"image/png": ".png", "image/jpeg": ".jpg", "image/jpg": ".jpg"}
+CONTENT_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg"}
+CHUNK_SIZE = 64 * 1024
+
+
+def shard_dir(root: Path, account_id: str) -> Path:
+    """Two-level fan-out (256 x 256 dirs) keyed by a hash of the id, so no directory grows unbounded."""
+    digest = hashlib.sha256(account_id.encode("utf-8")).hexdigest()
+    return root / digest[:2] / digest[2:4]
+
+
+class ImageStore:
+    """Account images on disk, with an in-memory index backed by an append-only log.
+
+    The index maps account_id -> {path, size, content_type, sha256, mtime},
+    so serving an image is a dict lookup plus a single open(): no exists(),
+    glob() or stat() per request. New images go to a hashed shard directory;
+    images from the old one-directory-per-account layout stay where they are
+    and are indexed in place.
+
+    Every change appends one JSON line to `images.log` instead of rewriting
+    the whole index, and `open()` compacts it. Several processes (app.py and
+    server.py) share one storage directory, so the log is never taken on
+    trust: `open()` and `gc()` first verify it against the disk, and a lookup
+    that misses checks the account's shard for a file another process wrote.
+    """
+
+    def __init__(self, storage_dir: Path, legacy_dir: Optional[Path] = None) -> None:
+        self.storage_dir = storage_dir
+        self.root = storage_dir / "images"
+        self.log_file = storage_dir / "images.log"
+        # Full JSON snapshot written by earlier versions; read once to seed the log.
+        self.legacy_index_file = storage_dir / "images.json"
+        self.legacy_dir = legacy_dir
+        self.index: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def open(self) -> None:
+        """Create directories, load the index and reconcile it with the disk; call once at startup."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self.index = self._load()
+        changes = self.verify()
+        self._compact()
+        print(f"🗂️ Image index: {len(self.index)} images, {changes} entries corrected from disk")
+
+    async def start(self) -> None:
+        """open() and gc() off the event loop."""
+        await anyio.to_thread.run_sync(self.open)
+        await anyio.to_thread.run_sync(self.gc)
+
+    def _load(self) -> Dict[str, dict]:
+        if not self.log_file.exists():
+            try:
+                return json.loads(self.legacy_index_file.read_text(encoding="utf-8"))
+            except (FileNotFoundError, json.JSONDecodeError):
+                return {}
+        index: Dict[str, dict] = {}
+        with open(self.log_file, encoding="utf-8") as log:
+            for line in log:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A write cut short by a crash; verify() recovers whatever it described.
+                    continue
+                if record["entry"] is None:
+                    index.pop(record["id"], None)
+                else:
+                    index[record["id"]] = record["entry"]
+        return index
+
+    def _append(self, account_id: str, entry: Optional[dict]) -> None:
+        line = json.dumps({"id": account_id, "entry": entry}) + "\n"
+        with open(self.log_file, "a", encoding="utf-8") as log:
+            log.write(line)
+
+    def _compact(self) -> None:
+        with self._lock:
+            tmp = self.log_file.with_suffix(".log.tmp")
+            with open(tmp, "w", encoding="utf-8") as log:
+                for account_id, entry in self.index.items():
+                    log.write(json.dumps({"id": account_id, "entry": entry}) + "\n")
+            os.replace(tmp, self.log_file)
+
+    def _scan(self) -> Dict[str, Path]:
+        """account_id -> image path for every image on disk; the sharded copy wins over a legacy one."""
+        found: Dict[str, Path] = {}
+        if self.legacy_dir is not None and self.legacy_dir.is_dir():
+            for account_dir in self.legacy_dir.iterdir():
+                files = sorted(account_dir.glob("1.*")) if account_dir.is_dir() else []
+                if files:
+                    found[account_dir.name] = files[0]
+        for path in self.root.glob("*/*/*"):
+            if path.is_file() and path.suffix in CONTENT_TYPES:
+                found[path.stem] = path
+        return found
+
+    def verify(self) -> int:
+        """Bring the index in line with the disk, hashing only files that are new or changed.
+
+        Returns how many entries were added, refreshed or dropped.
+        """
+        on_disk = self._scan()
+        with self._lock:
+            indexed = dict(self.index)
+        updates: Dict[str, Optional[dict]] = {}
+        for account_id, entry in indexed.items():
+            path = on_disk.get(account_id)
+            if path is None:
+                updates[account_id] = None
+            elif str(path.relative_to(self.storage_dir)) != entry["path"] or not self._matches(path.stat(), entry):
+                updates[account_id] = self._entry(path, path.read_bytes())
+        for account_id, path in on_disk.items():
+            if account_id not in indexed:
+                updates[account_id] = self._entry(path, path.read_bytes())
+        with self._lock:
+            for account_id, entry in updates.items():
+                if entry is None:
+                    self.index.pop(account_id, None)
+                else:
+                    self.index[account_id] = entry
+                self._append(account_id, entry)
+        return len(updates)
+
+    @staticmethod
+    def _matches(stat_result: os.stat_result, entry: dict) -> bool:
+        return stat_result.st_size == entry["size"] and stat_result.st_mtime == entry["mtime"]
+
+    def _entry(self, path: Path, data: bytes) -> dict:
+        stat_result = path.stat()
+        return {
+            "path": str(path.relative_to(self.storage_dir)),
+            "size": stat_result.st_size,
+            "content_type": CONTENT_TYPES.get(path.suffix.lower(), "application/octet-stream"),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "mtime": stat_result.st_mtime,
+        }
+
+    def _set(self, account_id: str, entry: Optional[dict]) -> None:
+        with self._lock:
+            if entry is None:
+                if self.index.pop(account_id, None) is None:
+                    return
+            else:
+                self.index[account_id] = entry
+            self._append(account_id, entry)
+
+    # -- reads / writes ----------------------------------------------------
+
+    def get(self, account_id: str) -> Optional[dict]:
+        return self.index.get(account_id)
+
+    def put(self, account_id: str, data: bytes, content_type: str) -> dict:
+        directory = shard_dir(self.root, account_id)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{account_id}{SUFFIXES.get(content_type, '.jpg')}"
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        entry = self._entry(path, data)
+        self._set(account_id, entry)
+        return entry
+
+    async def put_async(self, account_id: str, data: bytes, content_type: str) -> dict:
+        return await anyio.to_thread.run_sync(self.put, account_id, data, content_type)
+
+    def _discover(self, account_id: str) -> Optional[dict]:
+        """Index an image another process stored after our index was loaded."""
+        directory = shard_dir(self.root, account_id)
+        for suffix in dict.fromkeys(SUFFIXES.values()):
+            path = directory / f"{account_id}{suffix}"
+            try:
+                entry = self._entry(path, path.read_bytes())
+            except FileNotFoundError:
+                continue
+            self._set(account_id, entry)
+            return entry
+        return None
+
+    def open_image(self, account_id: str) -> Optional[Tuple[object, dict]]:
+        """(open file, index entry), or None if there is no image for the account."""
+        entry = self.index.get(account_id) or self._discover(account_id)
+        if entry is None:
+            return None
+        try:
+            file = open(self.storage_dir / entry["path"], "rb")
+        except FileNotFoundError:
+            # Gone, or replaced under another name by another process.
+            self._set(account_id, None)
+            entry = self._discover(account_id)
+            if entry is None:
+                return None
+            file = open(self.storage_dir / entry["path"], "rb")
+        if not self._matches(os.fstat(file.fileno()), entry):
+            # Rewritten since it was indexed; headers must describe the bytes we send.
+            entry = self._entry(Path(file.name), file.read())
+            file.seek(0)
+            self._set(account_id, entry)
+        return file, entry
+
+    async def open_image_async(self, account_id: str) -> Optional[Tuple[object, dict]]:
+        return await anyio.to_thread.run_sync(self.open_image, account_id)
+
+    # -- garbage collection ------------------------------------------------
+
+    def gc(self, grace_seconds: float = 3600.0) -> dict:
+        """Remove files under `images/` that no index entry points to, and the empty shards left behind.
+
+        The index is verified against the disk first, so images written by
+        another process are indexed, not collected; what is left is
+        interrupted writes. Unindexed files younger than `grace_seconds` are
+        kept in case a write is still in flight. The legacy per-account
+        directory is never touched.
+        """
+        self.verify()
+        removed = {"files": 0, "dirs": 0}
+        with self._lock:
+            indexed = {(self.storage_dir / entry["path"]).resolve() for entry in self.index.values()}
+        cutoff = time.time() - grace_seconds
+        for path in self.root.rglob("*"):
+            if path.is_file() and path.resolve() not in indexed and path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed["files"] += 1
+        # Deepest first, so a shard whose only child was just emptied goes too.
+        for directory in sorted((p for p in self.root.rglob("*") if p.is_dir()), key=lambda p: len(p.parts), reverse=True):
+            if not any(directory.iterdir()):
+                directory.rmdir()
+                removed["dirs"] += 1
+        return removed
+
+
+# ---------------------------------------------------------------------------
+# Response
+# ---------------------------------------------------------------------------
+
+
+class StoredImageResponse(Response):
+    """Streams an already-open image using the metadata from the index.
+
+    Headers come from the index entry, so nothing is stat()ed. When the ASGI
+    server offers the zero-copy extension the file descriptor is handed over
+    for sendfile(); otherwise the file is read in chunks off the event loop.
+    """
+
+    def __init__(self, file, entry: dict) -> None:
+        super().__init__(
+            status_code=200,
+            media_type=entry["content_type"],
+            headers={
+                "content-length": str(entry["size"]),
+                "last-modified": formatdate(entry["mtime"], usegmt=True),
+                "etag": f'"{entry["sha256"]}"',
+                "cache-control": "private, max-age=86400",
+            },
+        )
+        self.file = file
+        self.size = entry["size"]
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope.get("method") == "HEAD":
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            elif "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": self.file, "count": self.size})
+            else:
+                more_body = True
+                while more_body:
+                    chunk = await anyio.to_thread.run_sync(self.file.read, CHUNK_SIZE)
+                    more_body = len(chunk) == CHUNK_SIZE
+                    await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+        finally:
+            self.file.close()
+
+
+def not_modified(entry: dict, if_none_match: Optional[str]) -> bool:
+    return if_none_match is not None and f'"{entry["sha256"]}"' in if_none_match
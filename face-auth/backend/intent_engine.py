@@ -0,0 +1,170 @@
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+INTENTS_FILE = Path(os.getenv("INTENTS_FILE", BASE_DIR / "data" / "intents.json"))
+
+class _SafeFormat(dict):
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+WORD_RE = re.compile(r"\w+")
+
+def _parse_keyword(keyword):
+    """'factoris*' matches any word starting with 'factoris'; phrases match word by word."""
+    prefix = keyword.endswith("*")
+    words = keyword.rstrip("*").strip().lower().split()
+    return words, prefix
+
+class CompiledIntents:
+    """One rule-table snapshot compiled into a word-level trie.
+
+    Keywords are indexed by their first word, exactly or as a prefix, and
+    multi-word phrases are checked word by word from there. Matching tokenizes
+    the answer once and does a dictionary lookup per word (plus one per
+    distinct prefix length), so its cost does not grow with the number of
+    intents. Only whole words match: "factor" no longer fires inside
+    "factory". When a keyword appears under two intents, the first one wins.
+    """
+
+    def __init__(self, table):
+        self.fallback = table.get("fallback", "{answer}")
+        self.intents = []
+        self._exact = {}
+        self._prefix = {}
+        for position, intent in enumerate(table.get("intents", [])):
+            keywords = [k for k in intent.get("keywords", []) if k.strip("* ")]
+            if not keywords:
+                continue
+            index = len(self.intents)
+            self.intents.append({
+                "name": intent["name"],
+                "weight": float(intent.get("weight", 1.0)),
+                "explanation": intent.get("explanation", self.fallback),
+                "order": position,
+            })
+            for keyword in keywords:
+                words, prefix = _parse_keyword(keyword)
+                rest = tuple(words[1:])
+                if prefix and not rest:
+                    bucket = self._prefix.setdefault(words[0], [])
+                else:
+                    bucket = self._exact.setdefault(words[0], [])
+                bucket.append((index, rest, prefix))
+        for bucket in list(self._exact.values()) + list(self._prefix.values()):
+            # Longest phrases first so they beat their own first word.
+            bucket.sort(key=lambda entry: len(entry[1]), reverse=True)
+        self._prefix_lengths = sorted({len(p) for p in self._prefix}, reverse=True)
+
+    def _phrase_matches(self, tokens, start, rest, prefix):
+        end = start + 1 + len(rest)
+        if end > len(tokens):
+            return False
+        for offset, word in enumerate(rest):
+            token = tokens[start + 1 + offset]
+            if prefix and offset == len(rest) - 1:
+                if not token.startswith(word):
+                    return False
+            elif token != word:
+                return False
+        return True
+
+    def _candidates(self, token):
+        entries = self._exact.get(token)
+        if entries:
+            yield from entries
+        for length in self._prefix_lengths:
+            if length <= len(token):
+                entries = self._prefix.get(token[:length])
+                if entries:
+                    yield from entries
+
+    def match(self, text, top_k=3):
+        tokens = WORD_RE.findall(text.lower())
+        hits = {}
+        position = 0
+        while position < len(tokens):
+            consumed = 1
+            for index, rest, prefix in self._candidates(tokens[position]):
+                if rest and not self._phrase_matches(tokens, position, rest, prefix):
+                    continue
+                consumed = 1 + len(rest)
+                keyword = " ".join(tokens[position:position + consumed])
+                entry = hits.setdefault(index, {"keywords": [], "count": 0})
+                entry["count"] += 1
+                if keyword not in entry["keywords"]:
+                    entry["keywords"].append(keyword)
+                break
+            position += consumed
+
+        ranked = []
+        for index, entry in hits.items():
+            intent = self.intents[index]
+            # Distinct keywords count fully, repeats only add a little.
+            score = intent["weight"] * (len(entry["keywords"]) + 0.1 * (entry["count"] - len(entry["keywords"])))
+            ranked.append((score, -intent["order"], index, entry))
+        ranked.sort(key=lambda item: item[:3], reverse=True)
+        return [
+            {
+                "name": self.intents[index]["name"],
+                "score": round(score, 3),
+                "keywords": entry["keywords"],
+                "_index": index,
+            }
+            for score, _, index, entry in ranked[:top_k]
+        ]
+
+    def explain(self, text, top_k=3):
+        ranked = self.match(text, top_k)
+        if ranked:
+            best = ranked[0]
+            template = self.intents[best["_index"]]["explanation"]
+            values = _SafeFormat(answer=text, keyword=best["keywords"][0], intent=best["name"])
+        else:
+            template = self.fallback
+            values = _SafeFormat(answer=text, keyword="", intent="")
+        for entry in ranked:
+            del entry["_index"]
+        return template.format_map(values), ranked
+
+class IntentEngine:
+    """Hot-reloadable intent matcher; a bad rules file keeps the previous compiled table."""
+
+    def __init__(self, rules_file=INTENTS_FILE, reload_check_interval=5.0):
+        self.rules_file = Path(rules_file)
+        self.reload_check_interval = reload_check_interval
+        self._compiled = None
+        self._mtime = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        table = json.loads(self.rules_file.read_text(encoding="utf-8"))
+        compiled = CompiledIntents(table)
+        with self._lock:
+            self._compiled = compiled
+            self._mtime = self.rules_file.stat().st_mtime
+        print(f"🧠 Loaded {len(compiled.intents)} live-doubt intents")
+        return compiled
+
+    def _current(self):
+        if self._compiled is None:
+            return self.load()
+        now = time.monotonic()
+        if now - self._last_check >= self.reload_check_interval:
+            self._last_check = now
+            try:
+                if self.rules_file.stat().st_mtime != self._mtime:
+                    return self.load()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ Intent rules reload failed, keeping previous rules: {e}")
+        return self._compiled
+
+    def explain(self, text, top_k=3):
+        return self._current().explain(text, top_k)
+
+intent_engine = IntentEngine()
@@ -0,0 +1,190 @@
+import os
+import queue
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import db_connection
+from cloudinary_config import cloudinary_manager
+from blob_fetch import blob_fetcher
+from metrics import metrics
+
+LEASE_SECONDS = 60
+
+class KeyRotator:
+    """Re-encrypts face blobs sealed with a retired key, at a bounded rate.
+
+    Reads that decrypt a stale blob hand the plaintext over through
+    `cloudinary_manager.on_stale_blob`, so lazy rotation costs one upload and
+    no extra download. A background sweep queues every uploaded face_data
+    record whose key id is not the active one. Both share one worker thread
+    that uploads at most `rate` blobs per second, and lazy requests are
+    dropped (to be retried on a later read) when the queue is full.
+
+    The sweep runs once per active key across all workers: it holds a lease
+    on a document in the `jobs` collection, renewed as it goes, and marks it
+    done when every stale record has been queued.
+    """
+
+    def __init__(self, rate=2.0, max_pending=256):
+        self.rate = rate
+        self.max_pending = max_pending
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._queued = set()
+        self._lock = threading.Lock()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def faces_collection(self):
+        return db_connection.get_collection("face_data")
+
+    @property
+    def jobs_collection(self):
+        return db_connection.get_collection("jobs")
+
+    def _acquire(self, job_id):
+        """Take or renew the sweep lease; returns the job document or None if it is done or held elsewhere."""
+        now = datetime.utcnow()
+        try:
+            return self.jobs_collection.find_one_and_update(
+                {
+                    "_id": job_id,
+                    "status": {"$ne": "done"},
+                    "$or": [{"lease_owner": self.owner}, {"lease_until": {"$lt": now}}, {"lease_until": None}],
+                },
+                {
+                    "$set": {"lease_owner": self.owner, "lease_until": now + timedelta(seconds=LEASE_SECONDS), "updated_at": now},
+                    "$setOnInsert": {"status": "running", "started_at": now},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return None
+
+    def _enqueue(self, public_id, url, plaintext, block):
+        with self._lock:
+            if public_id in self._queued:
+                return False
+            self._queued.add(public_id)
+        try:
+            self._queue.put((public_id, url, plaintext), block=block, timeout=1.0 if block else None)
+            return True
+        except queue.Full:
+            with self._lock:
+                self._queued.discard(public_id)
+            return False
+
+    def request(self, public_id, url, plaintext):
+        """Lazy path: called from reads; never blocks the caller."""
+        if self._enqueue(public_id, url, plaintext, block=False):
+            metrics.inc("key_rotation_requests_total", source="read")
+
+    def sweep(self):
+        active = cloudinary_manager.keyring.active
+        job_id = f"key-rotation-sweep-{active}"
+        if self._acquire(job_id) is None:
+            print(f"🔑 Key rotation sweep for '{active}' is done or running on another worker")
+            return 0
+        renewed = time.monotonic()
+        stale = self.faces_collection.find(
+            {"upload_status": "uploaded", "encryption_key_id": {"$ne": active}},
+            {"_id": 0, "cloudinary_public_id": 1, "cloudinary_url": 1}
+        )
+        queued = 0
+        for record in stale:
+            if time.monotonic() - renewed > LEASE_SECONDS / 3:
+                if self._acquire(job_id) is None:
+                    print(f"🔑 Lost the key rotation sweep lease for '{active}', another worker continues it")
+                    break
+                renewed = time.monotonic()
+            while not self._stop.is_set():
+                if self._enqueue(record["cloudinary_public_id"], record.get("cloudinary_url"), None, block=True):
+                    queued += 1
+                    break
+                with self._lock:
+                    if record["cloudinary_public_id"] in self._queued:
+                        break
+            if self._stop.is_set():
+                break
+        else:
+            self.jobs_collection.update_one(
+                {"_id": job_id, "lease_owner": self.owner},
+                {"$set": {"status": "done", "finished_at": datetime.utcnow(), "lease_until": None}}
+            )
+        metrics.inc("key_rotation_requests_total", value=queued, source="sweep")
+        print(f"🔑 Key rotation sweep queued {queued} blobs for re-encryption under '{active}'")
+        return queued
+
+    def _rotate(self, public_id, url, plaintext):
+        if plaintext is None:
+            plaintext = cloudinary_manager.download_and_decrypt_face(public_id, url=url)
+            if plaintext is None:
+                raise RuntimeError("download or decryption failed")
+
+        encrypted_data = cloudinary_manager.encrypt_image(plaintext)
+        upload_result = cloudinary_manager.upload_encrypted_blob(None, encrypted_data, public_id=public_id)
+        if not upload_result:
+            raise RuntimeError("upload failed")
+
+        self.faces_collection.update_one(
+            {"cloudinary_public_id": public_id},
+            {"$set": {
+                "cloudinary_url": upload_result["secure_url"],
+                "encryption_format": upload_result["format"],
+                "encryption_key_id": upload_result["key_id"],
+            }}
+        )
+        blob_fetcher.cache.put(public_id, upload_result["secure_url"], encrypted_data)
+
+    def _run(self):
+        interval = 1.0 / self.rate if self.rate > 0 else 0.0
+        while not self._stop.is_set():
+            try:
+                public_id, url, plaintext = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            started = time.monotonic()
+            try:
+                self._rotate(public_id, url, plaintext)
+                metrics.inc("key_rotation_blobs_total", result="rotated")
+            except Exception as e:
+                metrics.inc("key_rotation_blobs_total", result="failed")
+                print(f"⚠️ Key rotation failed for {public_id}, will retry on a later read or sweep: {e}")
+            finally:
+                with self._lock:
+                    self._queued.discard(public_id)
+            self._stop.wait(max(0.0, interval - (time.monotonic() - started)))
+
+    def start(self, sweep=True):
+        self._stop.clear()
+        cloudinary_manager.on_stale_blob = self.request
+        worker = threading.Thread(target=self._run, name="key-rotation", daemon=True)
+        worker.start()
+        self._threads = [worker]
+        if sweep:
+            sweeper = threading.Thread(target=self._sweep_safely, name="key-rotation-sweep", daemon=True)
+            sweeper.start()
+            self._threads.append(sweeper)
+
+    def _sweep_safely(self):
+        try:
+            self.sweep()
+        except Exception as e:
+            print(f"⚠️ Key rotation sweep failed: {e}")
+
+    def stop(self):
+        self._stop.set()
+        cloudinary_manager.on_stale_blob = None
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+key_rotator = KeyRotator(
+    rate=float(os.getenv("KEY_ROTATION_RATE", 2.0)),
+    max_pending=int(os.getenv("KEY_ROTATION_MAX_PENDING", 256)),
+)
@@ -1,16 +1,46 @@
 import os
-import sys
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+import json
+import asyncio
+from typing import Optional
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 from database import db_connection
 from cloudinary_config import cloudinary_manager
-from face_service import face_auth_service
-from models import AuthResponse, LiveDoubtRequest, LiveDoubtResponse
+from face_service import face_auth_service, DUPLICATE_FACE_POLICY
+from write_behind import login_write_behind
+from outbox import upload_outbox
+from blob_fetch import Deadline
+from admission import admission_controller, AdmissionRejected
+from metrics import metrics
+from streaming_auth import StreamingAuthSession
+from event_ingest import event_ingest, validate_event, InvalidEvent, BatchTooLarge, IngestBackpressure
+from dashboard_stats import dashboard_stats, build_dashboard
+from response_cache import response_cache
+from flashcards import flashcard_scheduler
+from video_search import video_search_engine
+from intent_engine import intent_engine
+from tutor_llm import tutor_service
+from account_feed import account_feed, account_entry
+from session_tokens import session_tokens, InvalidSessionToken
+from face_index import face_index
+from face_partitions import face_partitions
+from key_rotation import key_rotator
+from template_jobs import template_migrator
+from readiness import readiness
+from diagnostics import diagnostics, DiagnosticsBusy
+from probe_quality import parse_face_boxes
+from transcode import media_type
+from models import AuthResponse, LiveDoubtRequest, LiveDoubtResponse, FlashcardReviewBatch
 import uvicorn
 
 load_dotenv()
 
+AUTH_DEADLINE_SECONDS = float(os.getenv("AUTH_DEADLINE_SECONDS", 10.0))
+STREAM_AUTH_SECONDS = float(os.getenv("STREAM_AUTH_SECONDS", 30.0))
+
 app = FastAPI(title="Face Authentication API", version="1.0.0")
 
 app.add_middleware(
@@ -19,56 +49,235 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Accounts-Version"],
 )
 
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request, exc: AdmissionRejected):
+    print(f"🚦 Shedding {exc.endpoint_class} request ({exc.reason}), retry after {exc.retry_after}s")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please retry shortly"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+ACCOUNTS_CACHE_SCOPE = "accounts"
+# Off until the login page's face match happens server-side: today it matches in the
+# browser and only gets a token when /api/auth/verify accepts its frame as well.
+SESSION_TOKENS_REQUIRED = os.getenv("SESSION_TOKENS_REQUIRED", "false").lower() == "true"
+
+def authorize_user(request: Request, user_id: str):
+    """Check the bearer session token against the user a route acts on, without touching the DB."""
+    header = request.headers.get("authorization", "")
+    if not header.startswith("Bearer "):
+        if SESSION_TOKENS_REQUIRED:
+            raise HTTPException(status_code=401, detail="Session token required")
+        return None
+    
+    try:
+        claims = session_tokens.verify(header[len("Bearer "):])
+    except InvalidSessionToken as e:
+        raise HTTPException(status_code=401, detail=f"Invalid session token: {e.reason}")
+    
+    if claims["sub"] != user_id:
+        raise HTTPException(status_code=403, detail="Session token does not belong to this user")
+    return claims
+
+def invalidate_user_caches(events):
+    for user_id in {event["user_id"] for event in events}:
+        response_cache.invalidate(user_id)
+
+WARMUP_FACES = int(os.getenv("WARMUP_FACES", 50))
+FACE_PARTITIONS = int(os.getenv("FACE_PARTITIONS", 0))
+FACE_PARTITION_ADDRESSES = [a.strip() for a in os.getenv("FACE_PARTITION_ADDRESSES", "").split(",") if a.strip()]
+DB_RETRY_MAX_SECONDS = 30.0
+
+def init_database():
+    """Connect and run the one-off index/repair work that needs the database."""
+    if not db_connection.connect():
+        return False
+    dashboard_stats.ensure_indexes()
+    flashcard_scheduler.ensure_indexes()
+    account_feed.ensure_indexes()
+    face_index.ensure_indexes()
+    session_tokens.ensure_indexes()
+    upload_outbox.reconcile()
+    return True
+
+def init_face_partitions():
+    face_partitions.start(FACE_PARTITIONS, FACE_PARTITION_ADDRESSES)
+    face_auth_service.load_partitions()
+
+async def initialize_services():
+    """Bring dependencies up concurrently, then warm caches; /readyz stays 503 until this finishes."""
+    database_ok, *_ = await asyncio.gather(
+        readiness.run("database", init_database),
+        readiness.run("blob_store", cloudinary_manager.configure),
+        readiness.run("video_index", video_search_engine.load),
+        readiness.run("intent_table", intent_engine.load),
+    )
+    
+    delay = 1.0
+    while not database_ok:
+        print(f"🔁 Retrying database initialization in {delay:.0f}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, DB_RETRY_MAX_SECONDS)
+        database_ok = await readiness.run("database", init_database)
+    
+    await readiness.run("session_revocations", session_tokens.start)
+    key_rotator.start(sweep=os.getenv("KEY_ROTATION_SWEEP", "true").lower() == "true")
+    if os.getenv("TEMPLATE_JOB_ENABLED", "true").lower() == "true":
+        template_migrator.start()
+    
+    if WARMUP_FACES > 0:
+        await readiness.run("warm_up", face_auth_service.warm_templates, WARMUP_FACES)
+    
+    if FACE_PARTITIONS > 0 or FACE_PARTITION_ADDRESSES:
+        await readiness.run("face_partitions", init_face_partitions)
+    
+    print("\n✅ All services initialized successfully!")
+    print("🔐 Face authentication system is ready")
+
 @app.on_event("startup")
 async def startup_event():
     print("\n" + "="*50)
     print("🚀 Starting Face Authentication Server...")
     print("="*50)
     
-    print("\n📡 Initializing connections...")
+    # Fail the boot rather than mint tokens no other worker can verify, or seal faces no other host can open.
+    session_tokens.require_secret()
+    print(f"🔐 Face keyring loaded, active key '{cloudinary_manager.keyring.active}'")
     
-    db_connected = db_connection.connect()
-    if not db_connected:
-        print("❌ Failed to connect to database. Exiting...")
-        sys.exit(1)
+    readiness.register("database", probe=db_connection.ping)
+    readiness.register("blob_store")
+    readiness.register("video_index")
+    readiness.register("intent_table")
+    readiness.register("session_revocations")
+    if WARMUP_FACES > 0:
+        readiness.register("warm_up")
+    if FACE_PARTITIONS > 0 or FACE_PARTITION_ADDRESSES:
+        # Optional: until loaded, login scans face_data as before.
+        readiness.register("face_partitions", required=False)
     
-    cloudinary_configured = cloudinary_manager.configure()
-    if not cloudinary_configured:
-        print("❌ Failed to configure Cloudinary. Exiting...")
-        sys.exit(1)
+    # Cheap, loop-bound or thread-only pieces start right away; anything touching
+    # the network happens in initialize_services without blocking boot.
+    login_write_behind.start()
+    upload_outbox.start()
+    account_feed.start()
+    tutor_service.start()
+    diagnostics.start()
+    event_ingest.add_listener(dashboard_stats.apply_events)
+    event_ingest.add_listener(invalidate_user_caches)
+    event_ingest.start()
+    app.state.initialization = asyncio.create_task(initialize_services())
     
-    print("\n✅ All services initialized successfully!")
-    print("🔐 Face authentication system is ready")
-    print("📸 Face images will be encrypted and stored in Cloudinary")
+    print("📸 Face images will be encrypted and uploaded to Cloudinary in the background")
     print("💾 User data will be stored in MongoDB")
     print("="*50)
-    print(f"🌐 Server will be available at: http://localhost:{os.getenv('PORT', 8000)}")
+    print(f"🌐 Server will be available at: http://localhost:{os.getenv('PORT', 8000)} (see /readyz)")
     print("="*50 + "\n")
 
 @app.get("/")
 async def root():
+    ready = readiness.snapshot()["status"] == "ready"
     return {
         "message": "Face Authentication API",
         "version": "1.0.0",
-        "status": "running",
+        "status": "running" if ready else "starting",
         "features": {
-            "mongodb": "✅ Connected",
-            "cloudinary": "✅ Connected", 
+            "mongodb": "✅ Connected" if readiness.is_ready("database") else "⏳ Not connected",
+            "cloudinary": "✅ Connected" if readiness.is_ready("blob_store") else "⏳ Not configured",
             "encryption": "✅ Enabled"
         }
     }
 
 @app.get("/health")
 async def health_check():
+    ready, snapshot = await readiness.probe()
     return {
-        "status": "healthy",
-        "database": "connected",
-        "cloudinary": "connected",
-        "encryption": "active"
+        "status": "healthy" if ready else "degraded",
+        "database": "connected" if snapshot["components"]["database"].get("live", readiness.is_ready("database")) else "disconnected",
+        "cloudinary": "connected" if readiness.is_ready("blob_store") else "not configured",
+        "encryption": "active",
+        "components": snapshot["components"]
     }
 
+@app.get("/livez")
+async def liveness():
+    """The process and its event loop are responsive; says nothing about dependencies."""
+    return {"status": "alive", "uptime_seconds": readiness.snapshot()["uptime_seconds"]}
+
+@app.get("/readyz")
+async def readiness_check():
+    ready, snapshot = await readiness.probe()
+    return JSONResponse(status_code=200 if ready else 503, content=snapshot)
+
+def require_admin(request: Request):
+    # 404 rather than 401/403, so the surface is invisible when disabled or to other callers.
+    if not diagnostics.authorized(request.headers.get("x-admin-token")):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.get("/api/admin/diagnostics/profile")
+async def profile_server(request: Request, seconds: float = 10.0):
+    """Sample all thread stacks for `seconds`; the body is collapsed stacks for flamegraph.pl or speedscope."""
+    require_admin(request)
+    try:
+        collapsed = await asyncio.to_thread(diagnostics.profile, seconds)
+    except DiagnosticsBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(collapsed, headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'})
+
+@app.post("/api/admin/diagnostics/memory/start")
+async def start_memory_tracing(request: Request, frames: int = 10):
+    require_admin(request)
+    return await asyncio.to_thread(diagnostics.memory_start, frames)
+
+@app.post("/api/admin/diagnostics/memory/stop")
+async def stop_memory_tracing(request: Request):
+    require_admin(request)
+    return diagnostics.memory_stop()
+
+@app.get("/api/admin/diagnostics/memory/top")
+async def top_allocations(request: Request, limit: int = 20, group_by: str = "lineno"):
+    require_admin(request)
+    try:
+        top = await asyncio.to_thread(diagnostics.memory_top, limit, group_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if top is None:
+        raise HTTPException(status_code=409, detail="Memory tracing is not running")
+    return {"status": diagnostics.memory_status(), "top": top}
+
+@app.get("/api/admin/diagnostics/memory/diff")
+async def allocation_growth(request: Request, limit: int = 20, group_by: str = "lineno", rebase: bool = False):
+    require_admin(request)
+    try:
+        diff = await asyncio.to_thread(diagnostics.memory_diff, limit, group_by, rebase)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if diff is None:
+        raise HTTPException(status_code=409, detail="Memory tracing is not running")
+    return {"status": diagnostics.memory_status(), "diff": diff}
+
+@app.get("/api/admin/diagnostics/runtime")
+async def runtime_diagnostics(request: Request):
+    require_admin(request)
+    partition_processes = face_partitions.processes()
+    return diagnostics.runtime(
+        pools={"face_partition_pool": face_partitions.pool},
+        extra={
+            "admission": admission_controller.snapshot(),
+            "face_partition_processes": {
+                "total": len(partition_processes),
+                "alive": sum(1 for process in partition_processes if process.is_alive()),
+            },
+        },
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/register", response_model=AuthResponse)
 async def register_user(
     email: str = Form(...),
@@ -80,9 +289,13 @@ async def register_user(
         
         face_image_data = await face_image.read()
         
-        result = face_auth_service.register_user_with_face(email, password, face_image_data)
+        async with admission_controller.admit("register"):
+            result = await run_in_threadpool(
+                face_auth_service.register_user_with_face, email, password, face_image_data
+            )
         
         if result["success"]:
+            response_cache.invalidate(ACCOUNTS_CACHE_SCOPE)
             print(f"✅ User {email} registered successfully")
             return AuthResponse(
                 success=True,
@@ -93,60 +306,168 @@ async def register_user(
             print(f"❌ Registration failed for {email}: {result['message']}")
             raise HTTPException(status_code=400, detail=result["message"])
             
+    except (HTTPException, AdmissionRejected):
+        raise
     except Exception as e:
         print(f"❌ Registration error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/authenticate", response_model=AuthResponse)
-async def authenticate_user(face_image: UploadFile = File(...)):
+async def authenticate_user(face_image: UploadFile = File(...), face_boxes: Optional[str] = Form(None)):
     try:
         print("🔍 Face authentication request received")
         
+        deadline = Deadline(AUTH_DEADLINE_SECONDS)
         face_image_data = await face_image.read()
         
-        result = face_auth_service.authenticate_user_with_face(face_image_data)
+        async with admission_controller.admit("login", deadline):
+            result = await run_in_threadpool(
+                face_auth_service.authenticate_user_with_face,
+                face_image_data,
+                deadline=deadline,
+                face_boxes=parse_face_boxes(face_boxes)
+            )
         
         if result["success"]:
+            token, claims = session_tokens.issue(result["user_id"], result["email"])
             print(f"✅ Authentication successful for user {result['email']}")
             return AuthResponse(
                 success=True,
                 user_id=result["user_id"],
+                token=token,
+                expires_at=claims["exp"],
                 message=result["message"]
             )
         else:
             print(f"❌ Authentication failed: {result['message']}")
             return AuthResponse(
                 success=False,
+                reason=result.get("reason"),
                 message=result["message"]
             )
             
+    except AdmissionRejected:
+        raise
     except Exception as e:
         print(f"❌ Authentication error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/accounts")
-async def get_accounts():
+@app.post("/api/auth/verify")
+async def verify_user(
+    accountId: str = Form(...),
+    face_image: UploadFile = File(...),
+    face_boxes: Optional[str] = Form(None)
+):
+    """1:1 verification against the account picked in the UI, instead of scanning every enrolled face."""
+    try:
+        print(f"🔍 Face verification request for account {accountId}")
+        
+        deadline = Deadline(AUTH_DEADLINE_SECONDS)
+        face_image_data = await face_image.read()
+        
+        async with admission_controller.admit("login", deadline):
+            result = await run_in_threadpool(
+                face_auth_service.verify_user_with_face,
+                accountId,
+                face_image_data,
+                deadline=deadline,
+                face_boxes=parse_face_boxes(face_boxes)
+            )
+        
+        if result["decision"] == "accept":
+            token, claims = session_tokens.issue(result["user_id"], result["email"])
+            print(f"✅ Face verified for user {result['email']} (score {result['score']})")
+            return {**result, "token": token, "expires_at": claims["exp"]}
+        return result
+        
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        print(f"❌ Verification error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.websocket("/ws/authenticate")
+async def authenticate_stream(websocket: WebSocket):
+    """Authenticate from a stream of image frames sent as binary messages."""
+    await websocket.accept()
+    session = StreamingAuthSession(Deadline(STREAM_AUTH_SECONDS))
+    print("🎞️ Streaming face authentication session opened")
+    
     try:
-        users = list(db_connection.get_collection("users").find({}, {"_id": 0}))
+        while not session.finished:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            
+            if message.get("bytes") is None:
+                await websocket.send_json({"type": "error", "message": "Expected an image frame"})
+                continue
+            
+            try:
+                async with admission_controller.admit("login", session.deadline):
+                    result = await run_in_threadpool(session.process_frame, message["bytes"])
+            except AdmissionRejected as e:
+                await websocket.send_json({"type": "busy", "retry_after": e.retry_after})
+                continue
+            
+            if result["type"] == "result" and result["success"]:
+                token, claims = session_tokens.issue(result["user_id"], result["email"])
+                result = {**result, "token": token, "expires_at": claims["exp"]}
+            await websocket.send_json(result)
         
-        accounts = []
-        for user in users:
-            face_data = db_connection.get_collection("face_data").find_one({"user_id": user["user_id"]}, {"_id": 0})
-            if face_data:
-                accounts.append({
-                    "id": user["user_id"],
-                    "fullName": user["email"],
-                    "type": "EXISTING",
-                    "picture": None,
-                    "backendPictureUrl": f"http://localhost:{os.getenv('PORT', 8000)}/api/accounts/custom/{user['user_id']}/image"
-                })
+        if session.finished:
+            await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"❌ Streaming authentication error: {e}")
+        await websocket.close(code=1011)
+    
+    print(f"🎞️ Streaming face authentication session closed after {session.frames} frames")
+
+def build_accounts():
+    # Under "merge" a duplicate enrolment is folded into the original and left out of the picker.
+    face_filter = {"duplicate_of": None} if DUPLICATE_FACE_POLICY == "merge" else {}
+    users_with_faces = set(db_connection.get_collection("face_data").distinct("user_id", face_filter))
+    users = db_connection.get_collection("users").find({}, {"_id": 0, "user_id": 1, "email": 1})
+    
+    accounts = []
+    for user in users:
+        if user["user_id"] in users_with_faces:
+            accounts.append(account_entry(user["user_id"], user["email"]))
+    
+    print(f"📋 Retrieved {len(accounts)} accounts")
+    return accounts
+
+@app.get("/api/accounts")
+async def get_accounts(request: Request, since: Optional[int] = None):
+    try:
+        if since is not None:
+            return await run_in_threadpool(account_feed.changes_since, since)
         
-        print(f"📋 Retrieved {len(accounts)} accounts")
-        return accounts
+        # Read the version before building so the list is never older than the version it reports.
+        version = await run_in_threadpool(account_feed.current_version)
+        response = await response_cache.serve(request, f"accounts@{version}", ACCOUNTS_CACHE_SCOPE, build_accounts)
+        response.headers["X-Accounts-Version"] = str(version)
+        return response
     except Exception as e:
         print(f"❌ Error fetching accounts: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/accounts/stream")
+async def stream_accounts(request: Request, since: Optional[int] = None):
+    if since is None:
+        last_event_id = request.headers.get("last-event-id")
+        if last_event_id and last_event_id.isdigit():
+            since = int(last_event_id)
+    print(f"📡 Account feed stream opened (since={since})")
+    
+    return StreamingResponse(
+        account_feed.stream(since, build_accounts, run_in_threadpool),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/accounts/custom")
 async def create_custom_account(
     full_name: str = Form(...),
@@ -157,9 +478,13 @@ async def create_custom_account(
         
         face_image_data = await image.read()
         
-        result = face_auth_service.register_user_with_face(full_name, "default_password", face_image_data)
+        async with admission_controller.admit("register"):
+            result = await run_in_threadpool(
+                face_auth_service.register_user_with_face, full_name, "default_password", face_image_data
+            )
         
         if result["success"]:
+            response_cache.invalidate(ACCOUNTS_CACHE_SCOPE)
             return {
                 "id": result["user_id"],
                 "fullName": full_name,
@@ -168,6 +493,8 @@ async def create_custom_account(
         else:
             raise HTTPException(status_code=400, detail=result["message"])
             
+    except (HTTPException, AdmissionRejected):
+        raise
     except Exception as e:
         print(f"❌ Error creating custom account: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -179,20 +506,26 @@ async def get_user_image(user_id: str):
         if not face_data:
             raise HTTPException(status_code=404, detail="Face data not found")
         
-        decrypted_image = cloudinary_manager.download_and_decrypt_face(face_data["cloudinary_public_id"])
+        decrypted_image = face_auth_service.load_face_image(face_data)
         
         if not decrypted_image:
             raise HTTPException(status_code=500, detail="Failed to retrieve face image")
         
         from fastapi.responses import Response
-        return Response(content=decrypted_image, media_type="image/jpeg")
+        return Response(
+            content=decrypted_image,
+            media_type=media_type(decrypted_image, face_data.get("image_format"))
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error retrieving user image: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/auth/face-login")
 async def face_login(request: dict):
+    """Record a login the browser matched itself. The client asserts the match, so no session token is issued."""
     try:
         account_id = request.get("accountId")
         success = request.get("success")
@@ -201,7 +534,10 @@ async def face_login(request: dict):
             raise HTTPException(status_code=400, detail="Account ID is required")
         
         if success:
-            user = db_connection.get_collection("users").find_one({"user_id": account_id}, {"_id": 0})
+            user = db_connection.get_collection("users").find_one(
+                {"user_id": account_id},
+                {"_id": 0, "user_id": 1, "email": 1, "created_at": 1}
+            )
             if user:
                 print(f"✅ Face login successful for user {user['email']}")
                 return {
@@ -217,10 +553,27 @@ async def face_login(request: dict):
                 "message": "Face authentication failed"
             }
             
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error in face login: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/auth/logout")
+async def logout(request: Request):
+    header = request.headers.get("authorization", "")
+    if not header.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Session token required")
+    
+    try:
+        claims = session_tokens.verify(header[len("Bearer "):])
+    except InvalidSessionToken:
+        return {"success": True, "message": "Session already ended"}
+    
+    await run_in_threadpool(session_tokens.revoke, claims)
+    print(f"👋 Session ended for {claims['email']}")
+    return {"success": True, "message": "Logged out"}
+
 @app.get("/user/{user_id}/face-data")
 async def get_user_face_data(user_id: str):
     try:
@@ -229,193 +582,194 @@ async def get_user_face_data(user_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/guided-solving")
+async def ingest_guided_solving_events(request: Request):
+    """Accept one event, a list of events, or {"events": [...]} and buffer them for batched writes."""
+    try:
+        payload = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be valid JSON")
+    
+    if isinstance(payload, dict) and isinstance(payload.get("events"), list):
+        payload = payload["events"]
+    raw_events = payload if isinstance(payload, list) else [payload]
+    if not raw_events:
+        raise HTTPException(status_code=400, detail="No events supplied")
+    if len(raw_events) > event_ingest.capacity:
+        raise HTTPException(status_code=413, detail=f"At most {event_ingest.capacity} events per request")
+    
+    try:
+        events = [validate_event(raw) for raw in raw_events]
+    except InvalidEvent as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    try:
+        if not event_ingest.try_append(events):
+            await run_in_threadpool(event_ingest.append, events)
+    except BatchTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except IngestBackpressure as e:
+        print(f"🚦 Event buffer full, asking client to retry in {e.retry_after}s")
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Event buffer full, please retry shortly"},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    
+    return {
+        "accepted": len(events),
+        "message": f"Recorded {len(events)} event(s)"
+    }
+
+async def record_doubt_event(request: LiveDoubtRequest):
+    try:
+        events = [validate_event(request.dict())]
+        if not event_ingest.try_append(events):
+            # Wait for room off the event loop, as /api/guided-solving does.
+            await run_in_threadpool(event_ingest.append, events)
+    except InvalidEvent as e:
+        print(f"⚠️ Doubt event not recorded: {e}")
+    except IngestBackpressure:
+        # The doubt itself is still answered; only its dashboard count is lost.
+        metrics.inc("event_ingest_dropped_total", event="DOUBT_SUBMITTED")
+        print(f"⚠️ Event buffer full, doubt from {request.user_id} not counted in dashboard stats")
+
 @app.post("/api/live-doubt", response_model=LiveDoubtResponse)
 async def live_doubt_resolution(request: LiveDoubtRequest):
     try:
         print(f"❓ Doubt submitted by {request.user_id}: {request.student_answer}")
+        await record_doubt_event(request)
         
-        # In a real app, you'd call an LLM here. 
-        # For now, we simulate a helpful tutor response.
-        answer = request.student_answer.lower()
-        if "factor" in answer:
-            explanation = "To factorize the expression, look for common terms first. For example, in 2x + 4, the common factor is 2."
-        elif "solvent" in answer or "solve" in answer:
-            explanation = "Let's break this down into smaller steps. What is the first thing you tried?"
-        else:
-            explanation = f"I've analyzed your question: '{request.student_answer}'. Let's solve this step-by-step together. What part of the problem seems most confusing?"
+        explanation, cached = await tutor_service.answer(request)
+        _, intents = intent_engine.explain(request.student_answer)
 
         return LiveDoubtResponse(
             mode="AI_ASSISTANCE_MODE",
             explanation={
                 "text": explanation
-            }
+            },
+            intents=intents,
+            cached=cached
         )
     except Exception as e:
         print(f"❌ error in live doubt resolution: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/live-doubt/stream")
+async def live_doubt_stream(request: LiveDoubtRequest):
+    print(f"❓ Streaming doubt submitted by {request.user_id}: {request.student_answer}")
+    await record_doubt_event(request)
+
+    async def events():
+        try:
+            async for kind, value in tutor_service.stream(request):
+                if kind == "chunk":
+                    yield f"event: chunk\ndata: {json.dumps({'text': value})}\n\n"
+                else:
+                    yield f"event: done\ndata: {json.dumps({'mode': 'AI_ASSISTANCE_MODE', 'cached': value})}\n\n"
+        except Exception as e:
+            print(f"❌ error streaming live doubt: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/user/{user_id}/dashboard")
-async def get_dashboard_data(user_id: str):
+async def get_dashboard_data(user_id: str, request: Request):
     try:
-        # Simulate fetching data from database for the user progress
-        return {
-            "overallProgress": 62,
-            "problemsSolved": 48,
-            "totalProblems": 78,
-            "streak": 6,
-            "dailyGoalProgress": 75,
-            "topicPerformance": [
-                {"name": "Binary Search", "score": 80, "color": "emerald"},
-                {"name": "Arrays", "score": 60, "color": "amber"},
-                {"name": "Dynamic Prog", "score": 40, "color": "rose"}
-            ],
-            "hintAnalysis": {
-                "avgHintLevel": 2.6,
-                "maxHintLevel": 4,
-                "hintsExhausted": 4,
-                "dependency": "High"
-            },
-            "stuckInsights": {
-                "avgStuckScore": 63,
-                "highStuckEvents": 5,
-                "alerts": ["Frequent hesitation detected"],
-                "trend": [45, 52, 48, 70, 63, 58, 63]
-            },
-            "achievement": {
-                "title": "Data Structure Ace",
-                "icon": "Trophy",
-                "color": "amber",
-                "judge_note": "Exceptional logic in Binary Search"
-            },
-            "detailedExplanations": {
-                "overall-learning-progress": {
-                    "summary": "Your learning velocity is 22% higher than last week.",
-                    "analytics": "You've maintained a 6-day streak with an average of 8 problems per day. Most solutions were sub-optimal on first attempt but improved after review.",
-                    "advice": "Focus on space complexity for the next 3 problems to hit your 'Efficiency' milestone."
-                },
-                "topic-wise-performance": {
-                    "summary": "Strong grasp on Search algorithms, need work on Recursive DP.",
-                    "analytics": "Binary Search accuracy is at 92%. In Dynamic Programming, you correctly identified 4/5 state transitions but struggled with space-optimized bottom-up approaches.",
-                    "advice": "Review 'Tabulation vs Memoization' specifically for knapsack-type problems."
-                },
-                "hint-&-struggle-analysis": {
-                    "summary": "Hint dependency is decreasing in Easy-Medium problems.",
-                    "analytics": "You used Level 1 hints (Conceptual) for 80% of your solved problems. Level 4 hints (Code Snippets) were only used once this week.",
-                    "advice": "Try to solve 2 'Medium' problems tomorrow without opening any hints for the first 15 minutes."
-                },
-                "stuck-&-hesitation-insights": {
-                    "summary": "Hesitation detected mostly during 'Implementation' phase.",
-                    "analytics": "On average, you spend 12 minutes in a 'Stuck' state before either finding a solution or requesting a hint. Most stalls occur during syntax translation.",
-                    "advice": "Practice quick pseudo-coding to bridge the gap between logic and syntax."
-                },
-                "skill-achievement-badge": {
-                    "summary": "Achievement based on consistent 90%+ pass rate in Search topics.",
-                    "analytics": "Your 'Data Structure Ace' badge was triggered by your flawless execution of 5 'Binary Search' problems without needing implementation hints.",
-                    "advice": "Keep this momentum to unlock the 'Algorithm Architect' badge next week."
-                }
-            }
-        }
+        authorize_user(request, user_id)
+        return await response_cache.serve(
+            request, "dashboard", user_id,
+            lambda: build_dashboard(dashboard_stats.get(user_id))
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error fetching dashboard data: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/user/{user_id}/flashcards")
-async def get_flashcards(user_id: str):
+async def get_flashcards(user_id: str, request: Request, limit: int = 4):
     try:
-        # In production, fetch personalized flashcards based on user's weak areas
-        # For now, return sample flashcards
-        flashcards = [
-            {
-                "topic": "Binary Search",
-                "concept": "Binary search works by repeatedly dividing the search interval in half. Always ensure your array is sorted before applying binary search.",
-                "difficulty": "Medium"
-            },
-            {
-                "topic": "Dynamic Programming",
-                "concept": "Break down complex problems into simpler subproblems. Store results of subproblems to avoid redundant calculations (memoization).",
-                "difficulty": "Hard"
-            },
-            {
-                "topic": "Array Manipulation",
-                "concept": "Two-pointer technique is efficient for problems involving pairs or subarrays. Move pointers based on problem constraints.",
-                "difficulty": "Easy"
-            },
-            {
-                "topic": "Time Complexity",
-                "concept": "O(log n) is better than O(n). Always analyze worst-case scenarios when choosing algorithms.",
-                "difficulty": "Easy"
-            }
-        ]
-        print(f"📚 Fetched {len(flashcards)} flashcards for user {user_id}")
-        return {"flashcards": flashcards}
+        authorize_user(request, user_id)
+        limit = max(1, min(limit, 100))
+        return await response_cache.serve(request, f"flashcards:{limit}", user_id, lambda: build_flashcards(user_id, limit))
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error fetching flashcards: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def build_flashcards(user_id: str, limit: int):
+    flashcards = flashcard_scheduler.next_cards(user_id, limit)
+    print(f"📚 Fetched {len(flashcards)} flashcards for user {user_id}")
+    return {"flashcards": flashcards}
+
+@app.post("/api/user/{user_id}/flashcards/reviews")
+async def review_flashcards(user_id: str, batch: FlashcardReviewBatch, request: Request):
+    try:
+        authorize_user(request, user_id)
+        results = await run_in_threadpool(
+            flashcard_scheduler.review_many, user_id, [review.dict() for review in batch.reviews]
+        )
+        response_cache.invalidate(user_id)
+        print(f"📚 Recorded {len(results)} flashcard reviews for user {user_id}")
+        return {"results": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error recording flashcard reviews: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/api/video/search")
 async def search_video(request: dict):
     try:
         query = request.get("query", "")
         print(f"🎥 Video search request: {query}")
         
-        # In production, this would call YouTube API or your video database
-        # For now, return sample video URLs based on topic
-        video_mapping = {
-            "binary search": {
-                "video_url": "https://www.youtube.com/embed/P3YID7liBug",
-                "title": "Binary Search Algorithm - Complete Tutorial"
-            },
-            "recursion": {
-                "video_url": "https://www.youtube.com/embed/IJDJ0kBx2LM",
-                "title": "Recursion Explained - Step by Step"
-            },
-            "dynamic programming": {
-                "video_url": "https://www.youtube.com/embed/oBt53YbR9Kk",
-                "title": "Dynamic Programming Tutorial"
-            },
-            "arrays": {
-                "video_url": "https://www.youtube.com/embed/1FbI1gIREoE",
-                "title": "Arrays in Programming - Complete Guide"
-            },
-            "linked list": {
-                "video_url": "https://www.youtube.com/embed/njTh_OwMljA",
-                "title": "Linked Lists Explained"
-            },
-            "sorting": {
-                "video_url": "https://www.youtube.com/embed/kPRA0W1kECg",
-                "title": "Sorting Algorithms Visualized"
-            },
-            "graph": {
-                "video_url": "https://www.youtube.com/embed/tWVWeAqZ0WU",
-                "title": "Graph Algorithms Tutorial"
-            },
-            "tree": {
-                "video_url": "https://www.youtube.com/embed/oSWTXtMglKE",
-                "title": "Binary Trees - Complete Tutorial"
+        match = video_search_engine.best_match(query)
+        if match:
+            print(f"✅ Found matching video: {match['title']}")
+            return {
+                "video_url": match["video_url"],
+                "title": match["title"]
             }
-        }
-        
-        # Find matching video
-        query_lower = query.lower()
-        for keyword, video_data in video_mapping.items():
-            if keyword in query_lower or query_lower in keyword:
-                print(f"✅ Found matching video: {video_data['title']}")
-                return video_data
         
         # Default video if no match
         print(f"ℹ️ No exact match, returning default video")
-        return {
-            "video_url": "https://www.youtube.com/embed/8hly31xKli0",
-            "title": f"Programming Tutorial: {query}"
-        }
+        return video_search_engine.default_video(query)
         
     except Exception as e:
         print(f"❌ Error searching video: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/video/autocomplete")
+async def autocomplete_video(q: str = "", limit: int = 8):
+    try:
+        return {"suggestions": video_search_engine.autocomplete(q, max(1, min(limit, 20)))}
+    except Exception as e:
+        print(f"❌ Error autocompleting video search: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.on_event("shutdown")
 async def shutdown_event():
     print("\n🔒 Shutting down server...")
+    initialization = getattr(app.state, "initialization", None)
+    if initialization is not None and not initialization.done():
+        initialization.cancel()
+    login_write_behind.stop()
+    upload_outbox.stop()
+    account_feed.stop()
+    key_rotator.stop()
+    template_migrator.stop()
+    face_partitions.stop()
+    event_ingest.stop()
+    await tutor_service.stop()
+    diagnostics.stop()
+    session_tokens.stop()
     db_connection.close()
     print("👋 Server shutdown complete")
 
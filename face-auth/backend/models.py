@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 class User(BaseModel):
@@ -12,16 +12,29 @@ class User(BaseModel):
     
 class FaceData(BaseModel):
     user_id: str
-    cloudinary_url: str
-    cloudinary_public_id: str
+    cloudinary_url: Optional[str] = None
+    cloudinary_public_id: Optional[str] = None
     encryption_format: str = "encrypted"
+    encryption_key_id: Optional[str] = None
+    upload_status: str = "uploaded"
     face_embeddings: Optional[list] = None
+    face_block: Optional[str] = None
+    face_dhash: Optional[str] = None
+    face_bands: Optional[List[str]] = None
+    template_version: Optional[int] = None
+    image_format: Optional[str] = None
+    original_bytes: Optional[int] = None
+    compression_ratio: Optional[float] = None
+    duplicate_of: Optional[str] = None
+    duplicate_score: Optional[float] = None
     created_at: datetime = datetime.utcnow()
     
 class AuthResponse(BaseModel):
     success: bool
     user_id: Optional[str] = None
     token: Optional[str] = None
+    expires_at: Optional[int] = None
+    reason: Optional[str] = None
     message: str
 
 class LiveDoubtRequest(BaseModel):
@@ -34,3 +47,12 @@ class LiveDoubtRequest(BaseModel):
 class LiveDoubtResponse(BaseModel):
     mode: str
     explanation: Dict[str, str]
+    intents: List[Dict[str, Any]] = []
+    cached: bool = False
+
+class FlashcardReview(BaseModel):
+    card_id: str
+    quality: int = Field(ge=0, le=5)
+
+class FlashcardReviewBatch(BaseModel):
+    reviews: List[FlashcardReview] = Field(min_length=1, max_length=1000)
@@ -0,0 +1,252 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from database import db_connection
+from cloudinary_config import cloudinary_manager
+
+BASE_DIR = Path(__file__).resolve().parent
+OUTBOX_DIR = BASE_DIR / "storage" / "outbox"
+
+class UploadOutbox:
+    """Defers encrypted face uploads to Cloudinary until after registration returns.
+
+    Registration stages the already-encrypted blob on local disk and records an
+    `upload_outbox` entry before any user document is written. A small worker
+    pool then uploads the blob, marks the matching `face_data` record as
+    uploaded and removes the local copy. Uploads are idempotent: the Cloudinary
+    public id is derived from the user id (with overwrite) and every write is
+    a `$set` keyed by user_id, so a retried or duplicated job is harmless.
+    `reconcile()` repairs whatever a crash left half-written.
+    """
+
+    def __init__(self, workers=4, max_attempts=6, base_delay=2.0, max_delay=300.0, grace_period=300):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Entries younger than this may belong to a registration still in progress
+        # on another worker, so reconcile leaves them alone.
+        self.grace_period = grace_period
+        self._executor = None
+        self._in_flight = set()
+        self._timers = set()
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    @property
+    def outbox_collection(self):
+        return db_connection.get_collection("upload_outbox")
+
+    def _blob_path(self, user_id):
+        return OUTBOX_DIR / f"{user_id}.enc"
+
+    def start(self):
+        OUTBOX_DIR.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._stopping = False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="upload-outbox")
+        print(f"📮 Upload outbox started with {self.workers} workers")
+
+    def stage(self, user_id, encrypted_data):
+        """Durably write the blob and its outbox record. Must happen before the user insert."""
+        OUTBOX_DIR.mkdir(parents=True, exist_ok=True)
+        path = self._blob_path(user_id)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(encrypted_data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        self.outbox_collection.update_one(
+            {"user_id": user_id},
+            {"$set": {
+                "user_id": user_id,
+                "blob_path": path.name,
+                "status": "pending",
+                "attempts": 0,
+                "last_error": None,
+                "created_at": datetime.utcnow(),
+            }},
+            upsert=True
+        )
+
+    def discard(self, user_id):
+        """Drop a staged upload whose registration did not complete."""
+        try:
+            self.outbox_collection.delete_one({"user_id": user_id})
+        except Exception as e:
+            print(f"⚠️ Could not delete outbox record for {user_id}: {e}")
+        self._blob_path(user_id).unlink(missing_ok=True)
+
+    def load_blob(self, user_id):
+        """Return the locally staged encrypted blob, or None once it has been uploaded."""
+        try:
+            return self._blob_path(user_id).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def submit(self, user_id, attempt=0):
+        with self._lock:
+            if self._stopping or self._executor is None or user_id in self._in_flight:
+                return False
+            self._in_flight.add(user_id)
+            self._executor.submit(self._process, user_id, attempt)
+            return True
+
+    def _schedule_retry(self, user_id, attempt):
+        delay = min(self.base_delay * (2 ** (attempt - 1)), self.max_delay)
+
+        def fire():
+            with self._lock:
+                self._timers.discard(timer)
+            self.submit(user_id, attempt)
+
+        timer = threading.Timer(delay, fire)
+        timer.daemon = True
+        with self._lock:
+            if self._stopping:
+                return
+            self._timers.add(timer)
+        timer.start()
+        print(f"🔁 Retrying upload for {user_id} in {delay:.0f}s (attempt {attempt + 1}/{self.max_attempts})")
+
+    def _process(self, user_id, attempt):
+        retry = False
+        try:
+            record = self.outbox_collection.find_one({"user_id": user_id})
+            if not record or record.get("status") == "done":
+                return
+
+            encrypted_data = self.load_blob(user_id)
+            if encrypted_data is None:
+                self.outbox_collection.update_one(
+                    {"user_id": user_id},
+                    {"$set": {"status": "failed", "last_error": "staged blob missing"}}
+                )
+                print(f"❌ Staged blob missing for {user_id}, upload abandoned")
+                return
+
+            upload_result = cloudinary_manager.upload_encrypted_blob(user_id, encrypted_data)
+            if not upload_result:
+                attempt += 1
+                status = "pending" if attempt < self.max_attempts else "failed"
+                self.outbox_collection.update_one(
+                    {"user_id": user_id},
+                    {"$set": {"status": status, "attempts": attempt, "last_error": "upload failed"}}
+                )
+                retry = status == "pending"
+                return
+
+            db_connection.get_collection("face_data").update_one(
+                {"user_id": user_id},
+                {"$set": {
+                    "cloudinary_url": upload_result["secure_url"],
+                    "cloudinary_public_id": upload_result["public_id"],
+                    "encryption_format": upload_result["format"],
+                    "encryption_key_id": upload_result["key_id"],
+                    "upload_status": "uploaded",
+                }}
+            )
+            self.outbox_collection.update_one(
+                {"user_id": user_id},
+                {"$set": {"status": "done", "completed_at": datetime.utcnow()}}
+            )
+            self._blob_path(user_id).unlink(missing_ok=True)
+            self.outbox_collection.delete_one({"user_id": user_id, "status": "done"})
+            print(f"📮 Deferred upload completed for {user_id}")
+        except Exception as e:
+            print(f"❌ Outbox processing failed for {user_id}: {e}")
+            attempt += 1
+            retry = attempt < self.max_attempts
+        finally:
+            with self._lock:
+                self._in_flight.discard(user_id)
+            if retry:
+                self._schedule_retry(user_id, attempt)
+
+    def reconcile(self):
+        """Repair partial registrations left by a crash and re-queue pending uploads."""
+        users = db_connection.get_collection("users")
+        faces = db_connection.get_collection("face_data")
+        requeued = removed = 0
+        cutoff = datetime.utcnow() - timedelta(seconds=self.grace_period)
+
+        for record in list(self.outbox_collection.find({"status": {"$ne": "done"}})):
+            user_id = record["user_id"]
+            if not users.find_one({"user_id": user_id}, {"_id": 1}):
+                if record.get("created_at") and record["created_at"] > cutoff:
+                    continue
+                # Crashed before the user was written: the registration never happened.
+                self.discard(user_id)
+                removed += 1
+                continue
+            if not faces.find_one({"user_id": user_id}, {"_id": 1}):
+                faces.update_one(
+                    {"user_id": user_id},
+                    {"$setOnInsert": {
+                        "user_id": user_id,
+                        "cloudinary_url": None,
+                        "cloudinary_public_id": None,
+                        "encryption_format": "encrypted",
+                        "upload_status": "pending",
+                        "created_at": datetime.utcnow(),
+                    }},
+                    upsert=True
+                )
+            if record.get("status") == "failed":
+                self.outbox_collection.update_one(
+                    {"user_id": user_id},
+                    {"$set": {"status": "pending", "attempts": 0}}
+                )
+            if self.submit(user_id):
+                requeued += 1
+
+        # Users without a face record or an outbox entry may be legacy accounts, accounts
+        # created by other paths or registrations in flight, so they are never deleted
+        # here; they are flagged for an operator to look at instead.
+        known = set(self.outbox_collection.distinct("user_id"))
+        flagged = 0
+        for user_id in users.distinct("user_id", {"needs_review": {"$exists": False}}):
+            if user_id not in known and not faces.find_one({"user_id": user_id}, {"_id": 1}):
+                users.update_one(
+                    {"user_id": user_id, "needs_review": {"$exists": False}},
+                    {"$set": {"needs_review": "no_face_data"}}
+                )
+                flagged += 1
+
+        if OUTBOX_DIR.exists():
+            for path in OUTBOX_DIR.iterdir():
+                if path.stem in known or time.time() - path.stat().st_mtime < self.grace_period:
+                    continue
+                if path.suffix in (".enc", ".tmp"):
+                    path.unlink(missing_ok=True)
+                    removed += 1
+
+        print(f"📮 Outbox reconciled: {requeued} uploads re-queued, {removed} abandoned uploads removed, {flagged} users without face data flagged")
+        return {"requeued": requeued, "removed": removed, "flagged": flagged}
+
+    def stop(self):
+        """Stop taking work without waiting for uploads in flight.
+
+        An interrupted upload keeps its pending outbox record and staged blob,
+        and uploads are idempotent, so `reconcile()` re-queues it on next start.
+        """
+        with self._lock:
+            self._stopping = True
+            executor, self._executor = self._executor, None
+            timers, self._timers = self._timers, set()
+        for timer in timers:
+            timer.cancel()
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+        print("📮 Upload outbox stopped")
+
+upload_outbox = UploadOutbox(
+    workers=int(os.getenv("UPLOAD_OUTBOX_WORKERS", 4)),
+    max_attempts=int(os.getenv("UPLOAD_OUTBOX_MAX_ATTEMPTS", 6)),
+)
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from pymongo import ReturnDocument
+from database import db_connection
+from metrics import metrics
+
+ENROLMENT_COUNTER_ID = "face_enrolment_version"
+
+class ProbeCache:
+    """Short-lived memory of recent login decisions, keyed by the probe itself.
+
+    Only a byte-identical probe (sha256) replays the earlier decision, match
+    or no match; a merely similar frame always gets a real scan. Every entry
+    carries the enrolment version read before its scan, and any change to
+    enrolled faces (`bump`) moves that shared counter, so a retry after an
+    enrolment rescans. The counter is read from Mongo at most once every
+    `version_ttl` seconds per process, so an enrolment on another worker is
+    seen here within that window.
+    """
+
+    def __init__(self, ttl=30.0, version_ttl=1.0, max_entries=2048):
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        metrics.describe("probe_cache_lookups_total", "Login probe cache lookups, by outcome")
+
+    @property
+    def counters_collection(self):
+        return db_connection.get_collection("counters")
+
+    @staticmethod
+    def digest(face_image_data):
+        return hashlib.sha256(face_image_data).hexdigest()
+
+    def version(self):
+        cached = self._version
+        if cached is not None and time.monotonic() - cached[0] < self.version_ttl:
+            return cached[1]
+        counter = self.counters_collection.find_one({"_id": ENROLMENT_COUNTER_ID})
+        value = counter["value"] if counter else 0
+        self._version = (time.monotonic(), value)
+        return value
+
+    def bump(self):
+        """Call after any change to the set of matchable faces, from any process."""
+        counter = self.counters_collection.find_one_and_update(
+            {"_id": ENROLMENT_COUNTER_ID},
+            {"$inc": {"value": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        with self._lock:
+            self._version = (time.monotonic(), counter["value"])
+            self._entries.clear()
+
+    def _get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, entry_version, user_id = entry
+            if expires_at <= time.monotonic() or entry_version != version:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key, version, user_id, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, version, user_id)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup_exact(self, digest, version):
+        """(True, user_id or None) for a replayable decision, else (False, None)."""
+        entry = self._get(("sha", digest), version)
+        if entry is None:
+            metrics.inc("probe_cache_lookups_total", result="miss")
+            return False, None
+        metrics.inc("probe_cache_lookups_total", result="match" if entry[2] else "no_match")
+        return True, entry[2]
+
+    def remember_match(self, digest, version, user_id):
+        self._put(("sha", digest), version, user_id, self.ttl)
+
+    def remember_no_match(self, digest, version):
+        self._put(("sha", digest), version, None, self.ttl)
+
+probe_cache = ProbeCache(
+    ttl=float(os.getenv("PROBE_CACHE_TTL", 30.0)),
+    version_ttl=float(os.getenv("PROBE_CACHE_VERSION_TTL", 1.0)),
+    max_entries=int(os.getenv("PROBE_CACHE_ENTRIES", 2048)),
+)
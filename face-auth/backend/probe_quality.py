@@ -0,0 +1,119 @@
+import json
+import os
+import time
+import numpy as np
+from metrics import metrics
+
+REASON_MESSAGES = {
+    "too_small": "Image resolution is too low, move closer to the camera",
+    "too_blurry": "Image is blurred, hold the camera still",
+    "too_dark": "Image is too dark, add more light",
+    "too_bright": "Image is overexposed, reduce glare or backlight",
+    "no_face": "No face detected in the frame",
+    "multiple_faces": "More than one face detected, only one person should be in frame",
+    "face_too_small": "Face is too small in the frame, move closer to the camera",
+    "unreadable": "Image could not be read, send a JPEG or PNG frame",
+}
+
+class ProbeRejected(Exception):
+    def __init__(self, reason):
+        super().__init__(REASON_MESSAGES[reason])
+        self.reason = reason
+
+def parse_face_boxes(raw):
+    """Client face boxes as [[x, y, width, height], ...] JSON; None when not sent."""
+    if not raw:
+        return None
+    try:
+        boxes = json.loads(raw)
+        return [tuple(float(v) for v in box[:4]) for box in boxes]
+    except (ValueError, TypeError, IndexError):
+        return None
+
+class ProbeQualityGate:
+    """Cheap checks that turn away frames which cannot match, before any comparison.
+
+    Blur is the variance of a 4-neighbour Laplacian and exposure comes from
+    the grayscale mean and clipped-pixel fraction, both on a downscaled copy
+    so a check costs about a millisecond. Face count and size use the boxes
+    the client's detector already found; without them those checks are skipped.
+    """
+
+    def __init__(self, enabled=True, min_side=48, min_sharpness=20.0, min_brightness=40.0,
+                 max_brightness=220.0, max_clipped=0.5, min_face_fraction=0.2, analysis_side=256):
+        self.enabled = enabled
+        self.min_side = min_side
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_clipped = max_clipped
+        self.min_face_fraction = min_face_fraction
+        self.analysis_side = analysis_side
+        metrics.describe("probe_rejections_total", "Login probes rejected by the quality gate, by reason")
+
+    def measure(self, image):
+        factor = max(image.size) // self.analysis_side
+        # reduce() only handles a few modes (not P or 1), so go to grayscale first.
+        gray = image if image.mode == "L" else image.convert("L")
+        small = gray.reduce(factor) if factor > 1 else gray
+        pixels = np.asarray(small, dtype=np.float32)
+        laplacian = (
+            pixels[1:-1, :-2] + pixels[1:-1, 2:] + pixels[:-2, 1:-1] + pixels[2:, 1:-1]
+            - 4.0 * pixels[1:-1, 1:-1]
+        )
+        return {
+            "sharpness": float(laplacian.var()) if laplacian.size else 0.0,
+            "brightness": float(pixels.mean()),
+            "dark_fraction": float((pixels <= 8).mean()),
+            "bright_fraction": float((pixels >= 247).mean()),
+        }
+
+    def reason(self, image, face_boxes=None):
+        """Reason code for an unusable probe, or None if it is worth matching."""
+        width, height = image.size
+        if min(width, height) < self.min_side:
+            return "too_small"
+
+        if face_boxes is not None:
+            if not face_boxes:
+                return "no_face"
+            if len(face_boxes) > 1:
+                return "multiple_faces"
+            _, _, box_width, box_height = face_boxes[0]
+            if min(box_width, box_height) < self.min_face_fraction * min(width, height):
+                return "face_too_small"
+
+        stats = self.measure(image)
+        if stats["brightness"] < self.min_brightness or stats["dark_fraction"] > self.max_clipped:
+            return "too_dark"
+        if stats["brightness"] > self.max_brightness or stats["bright_fraction"] > self.max_clipped:
+            return "too_bright"
+        if stats["sharpness"] < self.min_sharpness:
+            return "too_blurry"
+        return None
+
+    def check(self, image, face_boxes=None):
+        """Raise ProbeRejected for a bad probe; counts every outcome."""
+        if not self.enabled:
+            return
+        started = time.perf_counter()
+        try:
+            reason = self.reason(image, face_boxes)
+        except Exception as e:
+            # A frame the gate cannot even measure will not match either.
+            print(f"⚠️ Probe could not be measured: {e}")
+            reason = "unreadable"
+        metrics.observe("probe_quality_seconds", time.perf_counter() - started)
+        if reason:
+            metrics.inc("probe_rejections_total", reason=reason)
+            raise ProbeRejected(reason)
+        metrics.inc("probe_quality_passed_total")
+
+probe_quality_gate = ProbeQualityGate(
+    enabled=os.getenv("PROBE_QUALITY_GATE", "true").lower() == "true",
+    min_side=int(os.getenv("PROBE_MIN_SIDE", 48)),
+    min_sharpness=float(os.getenv("PROBE_MIN_SHARPNESS", 20.0)),
+    min_brightness=float(os.getenv("PROBE_MIN_BRIGHTNESS", 40.0)),
+    max_brightness=float(os.getenv("PROBE_MAX_BRIGHTNESS", 220.0)),
+    min_face_fraction=float(os.getenv("PROBE_MIN_FACE_FRACTION", 0.2)),
+)
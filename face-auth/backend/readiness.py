@@ -0,0 +1,80 @@
+import asyncio
+import time
+from metrics import metrics
+
+class Readiness:
+    """Startup state of each dependency, reported by /readyz and /health.
+
+    Components are initialized off the event loop with `run`, concurrently,
+    and each records whether it succeeded, its last error and how long it
+    took. The server reports ready once every required component is up, and
+    `probe` re-checks live dependencies at most once per `probe_interval`
+    so a flood of readiness probes cannot hammer the database.
+    """
+
+    def __init__(self, probe_interval=2.0):
+        self.started_at = time.monotonic()
+        self.probe_interval = probe_interval
+        self.components = {}
+        self._probes = {}
+        self._probe_results = {}
+
+    def register(self, name, required=True, probe=None):
+        self.components.setdefault(name, {"ready": False, "required": required, "error": None, "seconds": None})
+        if probe is not None:
+            self._probes[name] = probe
+
+    def mark(self, name, ready, error=None, seconds=None):
+        component = self.components.setdefault(name, {"required": True})
+        component.update({"ready": ready, "error": error, "seconds": seconds})
+        metrics.set_gauge("component_ready", 1 if ready else 0, component=name)
+
+    async def run(self, name, fn, *args):
+        """Run a blocking initializer in a thread; returns False on an exception or a False result."""
+        started = time.monotonic()
+        try:
+            result = await asyncio.to_thread(fn, *args)
+        except Exception as e:
+            self.mark(name, False, error=str(e), seconds=round(time.monotonic() - started, 3))
+            print(f"❌ {name} failed to initialize: {e}")
+            return False
+        ok = result is not False
+        self.mark(name, ok, error=None if ok else "initializer reported failure", seconds=round(time.monotonic() - started, 3))
+        print(f"{'✅' if ok else '❌'} {name} {'ready' if ok else 'failed'} in {time.monotonic() - started:.2f}s")
+        return ok
+
+    def is_ready(self, name):
+        return self.components.get(name, {}).get("ready", False)
+
+    async def probe(self):
+        """Re-check live dependencies (cached) and return (ready, snapshot)."""
+        now = time.monotonic()
+        for name, check in self._probes.items():
+            if not self.is_ready(name):
+                continue
+            checked_at, ok = self._probe_results.get(name, (0.0, True))
+            if now - checked_at >= self.probe_interval:
+                try:
+                    ok = bool(await asyncio.wait_for(asyncio.to_thread(check), self.probe_interval))
+                except Exception:
+                    ok = False
+                self._probe_results[name] = (now, ok)
+            self.components[name]["live"] = ok
+
+        ready = all(
+            component["ready"] and component.get("live", True)
+            for component in self.components.values()
+            if component["required"]
+        )
+        return ready, self.snapshot(ready)
+
+    def snapshot(self, ready=None):
+        if ready is None:
+            ready = all(c["ready"] for c in self.components.values() if c["required"])
+        return {
+            "status": "ready" if ready else "not_ready",
+            "uptime_seconds": round(time.monotonic() - self.started_at, 1),
+            "components": self.components,
+        }
+
+readiness = Readiness()
@@ -0,0 +1,123 @@
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import orjson
+from fastapi import Response
+from starlette.concurrency import run_in_threadpool
+from metrics import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_BYTES = 512
+
+class CachedBody:
+    __slots__ = ("identity", "gzip", "br", "etag", "created_at")
+
+    def __init__(self, payload):
+        self.identity = orjson.dumps(payload)
+        self.etag = '"' + hashlib.blake2b(self.identity, digest_size=12).hexdigest() + '"'
+        self.gzip = None
+        self.br = None
+        if len(self.identity) >= MIN_COMPRESS_BYTES:
+            self.gzip = gzip.compress(self.identity, compresslevel=6)
+            if brotli is not None:
+                self.br = brotli.compress(self.identity, quality=5)
+        self.created_at = time.monotonic()
+
+class ResponseCache:
+    """Caches JSON responses as pre-serialized (and pre-compressed) bytes.
+
+    Entries are keyed by route, scope (a user id, or "global") and the scope's
+    version. `invalidate(scope)` bumps the version when the underlying data
+    changes, so stale entries are never served again and simply age out of
+    the LRU. The TTL bounds staleness for changes made by other worker
+    processes, which do not see this process's invalidations.
+    """
+
+    def __init__(self, max_entries=2048, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def version(self, scope):
+        return self._versions.get(scope, 0)
+
+    def invalidate(self, scope):
+        with self._lock:
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+        metrics.inc("response_cache_invalidations_total")
+
+    def get_or_build(self, route, scope, builder):
+        key = (route, scope, self.version(scope))
+        now = time.monotonic()
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None and now - body.created_at < self.ttl:
+                self._entries.move_to_end(key)
+                metrics.inc("response_cache_requests_total", route=route, result="hit")
+                return body
+
+        body = CachedBody(builder())
+        metrics.inc("response_cache_requests_total", route=route, result="miss")
+        with self._lock:
+            # Only store if nothing invalidated the scope while we were building.
+            if key[2] == self.version(scope):
+                self._entries[key] = body
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return body
+
+    def lookup(self, route, scope):
+        """The cached body if it is fresh, without building anything."""
+        key = (route, scope, self.version(scope))
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None or time.monotonic() - body.created_at >= self.ttl:
+                return None
+            self._entries.move_to_end(key)
+        metrics.inc("response_cache_requests_total", route=route, result="hit")
+        return body
+
+    def respond(self, request, body):
+        accepted = request.headers.get("accept-encoding", "")
+        if body.br is not None and "br" in accepted:
+            encoding, content = "br", body.br
+        elif body.gzip is not None and "gzip" in accepted:
+            encoding, content = "gzip", body.gzip
+        else:
+            encoding, content = None, body.identity
+
+        # Each encoding is a different byte sequence, so it gets its own strong ETag.
+        etag = body.etag if encoding is None else f'{body.etag[:-1]}-{encoding}"'
+        headers = {
+            "ETag": etag,
+            "Vary": "Accept-Encoding",
+            "Cache-Control": "private, no-cache",
+        }
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in (tag.strip() for tag in if_none_match.split(",")):
+            return Response(status_code=304, headers=headers)
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        return Response(content=content, media_type="application/json", headers=headers)
+
+    async def serve(self, request, route, scope, builder):
+        """Answer from the cache; on a miss the builder (usually a Mongo read) runs in the threadpool."""
+        body = self.lookup(route, scope)
+        if body is None:
+            body = await run_in_threadpool(self.get_or_build, route, scope, builder)
+        return self.respond(request, body)
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_ENTRIES", 2048)),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", 30.0)),
+)
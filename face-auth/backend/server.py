@@ -4,11 +4,12 @@ from pathlib import Path
 from typing import Dict, List, Literal, Optional
 from uuid import uuid4
 
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import FastAPI, File, Form, Header, HTTPException, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
 from pydantic import BaseModel
 
+from image_store import ImageStore, StoredImageResponse, not_modified
+
 # ---------------------------------------------------------------------------
 # Paths / storage
 # ---------------------------------------------------------------------------
@@ -23,6 +24,9 @@ def ensure_storage() -> None:
     TEMP_ACCOUNTS_DIR.mkdir(parents=True, exist_ok=True)
 
 
+image_store = ImageStore(STORAGE_DIR, legacy_dir=TEMP_ACCOUNTS_DIR)
+
+
 # ---------------------------------------------------------------------------
 # Models
 # ---------------------------------------------------------------------------
@@ -108,6 +112,12 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def startup_event() -> None:
+    ensure_storage()
+    await image_store.start()
+
+
 @app.get("/api/accounts", response_model=List[Account])
 async def list_accounts() -> List[Account]:
     """Return all accounts (dummy + custom created in this session)."""
@@ -121,23 +131,17 @@ async def create_custom_account(
 ) -> Account:
     """Create a new custom account with an uploaded image."""
 
-    ensure_storage()
-
     content_type = (image.content_type or "").lower()
     if content_type not in {"image/png", "image/jpeg", "image/jpg"}:
         raise HTTPException(status_code=400, detail="Only PNG and JPEG images are supported.")
 
     account_id = str(uuid4())
-    account_dir = TEMP_ACCOUNTS_DIR / account_id
-    account_dir.mkdir(parents=True, exist_ok=True)
-
     suffix = ".png" if "png" in content_type else ".jpg"
-    image_path = account_dir / f"1{suffix}"
 
     data = await image.read()
-    image_path.write_bytes(data)
+    await image_store.put_async(account_id, data, content_type)
 
-    picture_rel = f"{account_id}/{image_path.name}"
+    picture_rel = f"{account_id}/1{suffix}"
 
     account = Account(
         id=account_id,
@@ -152,19 +156,18 @@ async def create_custom_account(
 
 
 @app.get("/api/accounts/custom/{account_id}/image")
-async def get_custom_account_image(account_id: str):
+async def get_custom_account_image(account_id: str, if_none_match: Optional[str] = Header(None)):
     """Serve the stored image for a custom account."""
 
-    ensure_storage()
-    account_dir = TEMP_ACCOUNTS_DIR / account_id
-    if not account_dir.exists() or not account_dir.is_dir():
-        raise HTTPException(status_code=404, detail="Account not found")
+    entry = image_store.get(account_id)
+    if entry is not None and not_modified(entry, if_none_match):
+        return Response(status_code=304, headers={"etag": f'"{entry["sha256"]}"'})
 
-    files = sorted(account_dir.glob("1.*"))
-    if not files:
+    opened = await image_store.open_image_async(account_id)
+    if opened is None:
         raise HTTPException(status_code=404, detail="Image not found")
 
-    return FileResponse(files[0])
+    return StoredImageResponse(*opened)
 
 
 @app.post("/api/auth/face-login", response_model=FaceLoginResponse)
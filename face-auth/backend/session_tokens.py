@@ -0,0 +1,203 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+import orjson
+from pymongo.errors import PyMongoError
+from database import db_connection
+from metrics import metrics
+
+TOKEN_PREFIX = "v1"
+MIN_SECRET_BYTES = 32
+REVOCATIONS_COLLECTION = "revoked_sessions"
+
+class InvalidSessionToken(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+class RevocationFilter:
+    """Bloom filter over revoked token ids, backed by an exact set.
+
+    Nearly every token checked has not been revoked, and the filter answers
+    that with a few bit lookups. Only a positive falls through to the exact
+    set, so false positives cost a set lookup and never reject a valid token.
+    """
+
+    def __init__(self, capacity=100000, hashes=4):
+        self.bits = max(1024, capacity * 10)
+        self.hashes = hashes
+        self._array = bytearray(self.bits // 8 + 1)
+        self._revoked = set()
+
+    def _positions(self, jti):
+        digest = hashlib.blake2b(jti.encode("utf-8"), digest_size=4 * self.hashes).digest()
+        for i in range(self.hashes):
+            yield int.from_bytes(digest[4 * i:4 * i + 4], "little") % self.bits
+
+    def add(self, jti):
+        for position in self._positions(jti):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self._revoked.add(jti)
+
+    def __contains__(self, jti):
+        for position in self._positions(jti):
+            if not self._array[position >> 3] & (1 << (position & 7)):
+                return False
+        return jti in self._revoked
+
+class SessionTokens:
+    """Stateless HMAC-SHA256 session tokens, minted only after a server-side face match.
+
+    A token is `v1.<payload>.<signature>`, where the payload is base64url
+    JSON claims (sub, email, iat, exp, jti). Verification needs no database
+    read: recently verified tokens are kept in a small LRU until they expire
+    or `cache_ttl` passes, and every check, cached or not, consults the
+    revocation filter. Revocations are written to Mongo (TTL'd at the token's
+    expiry) and a background refresh pulls in ones made by other workers.
+    """
+
+    def __init__(self, secret=None, ttl=3600, cache_ttl=60.0, cache_size=10000, refresh_interval=15.0):
+        if isinstance(secret, str):
+            secret = secret.encode("utf-8")
+        self._secret = secret or None
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.refresh_interval = refresh_interval
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._revocations = RevocationFilter()
+        self._revoked_since_refresh = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def revocations_collection(self):
+        return db_connection.get_collection(REVOCATIONS_COLLECTION)
+
+    def ensure_indexes(self):
+        self.revocations_collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def require_secret(self):
+        """Refuse to run without a shared secret; a per-process one would split sessions across workers."""
+        if self._secret is None:
+            raise RuntimeError("SESSION_SECRET is not set; configure the same secret on every worker")
+        if len(self._secret) < MIN_SECRET_BYTES:
+            raise RuntimeError(f"SESSION_SECRET must be at least {MIN_SECRET_BYTES} bytes")
+
+    def _sign(self, signing_input):
+        self.require_secret()
+        return hmac.new(self._secret, signing_input, hashlib.sha256).digest()
+
+    def issue(self, user_id, email, now=None):
+        now = int(now or time.time())
+        claims = {"sub": user_id, "email": email, "iat": now, "exp": now + self.ttl, "jti": secrets.token_hex(8)}
+        signing_input = f"{TOKEN_PREFIX}.{_b64encode(orjson.dumps(claims))}".encode("ascii")
+        metrics.inc("session_tokens_issued_total")
+        return f"{signing_input.decode('ascii')}.{_b64encode(self._sign(signing_input))}", claims
+
+    def verify(self, token, now=None):
+        """Return the token's claims or raise InvalidSessionToken."""
+        now = now or time.time()
+        with self._lock:
+            entry = self._cache.get(token)
+        if entry is not None and now < entry[0]:
+            claims = entry[1]
+            if claims["jti"] in self._revocations:
+                raise InvalidSessionToken("revoked")
+            metrics.inc("session_token_verifications_total", result="cached")
+            return claims
+
+        try:
+            prefix, payload, signature = token.split(".")
+            if prefix != TOKEN_PREFIX:
+                raise InvalidSessionToken("unsupported token version")
+            expected = self._sign(f"{prefix}.{payload}".encode("ascii"))
+            if not hmac.compare_digest(expected, _b64decode(signature)):
+                raise InvalidSessionToken("bad signature")
+            claims = orjson.loads(_b64decode(payload))
+        except InvalidSessionToken:
+            metrics.inc("session_token_verifications_total", result="rejected")
+            raise
+        except (ValueError, UnicodeError, orjson.JSONDecodeError):
+            metrics.inc("session_token_verifications_total", result="rejected")
+            raise InvalidSessionToken("malformed token")
+
+        if now >= claims["exp"]:
+            metrics.inc("session_token_verifications_total", result="expired")
+            raise InvalidSessionToken("expired")
+        if claims["jti"] in self._revocations:
+            metrics.inc("session_token_verifications_total", result="rejected")
+            raise InvalidSessionToken("revoked")
+
+        with self._lock:
+            self._cache[token] = (min(claims["exp"], now + self.cache_ttl), claims)
+            self._cache.move_to_end(token)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        metrics.inc("session_token_verifications_total", result="verified")
+        return claims
+
+    def revoke(self, claims):
+        with self._lock:
+            self._revocations.add(claims["jti"])
+            self._revoked_since_refresh.add(claims["jti"])
+        self.revocations_collection.update_one(
+            {"_id": claims["jti"]},
+            {"$set": {"expires_at": datetime.utcfromtimestamp(claims["exp"])}},
+            upsert=True
+        )
+        metrics.inc("session_tokens_revoked_total")
+
+    def refresh_revocations(self):
+        """Rebuild the filter from Mongo; expired revocations drop out with their TTL."""
+        with self._lock:
+            self._revoked_since_refresh = set()
+        revocations = RevocationFilter()
+        for doc in self.revocations_collection.find({}, {"_id": 1}):
+            revocations.add(doc["_id"])
+        with self._lock:
+            # Keep local revocations that landed while the snapshot was being read.
+            for jti in self._revoked_since_refresh:
+                revocations.add(jti)
+            self._revocations = revocations
+        return len(revocations._revoked)
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh_revocations()
+            except PyMongoError as e:
+                print(f"⚠️ Session revocation refresh failed, keeping previous list: {e}")
+
+    def start(self):
+        self.require_secret()
+        self.refresh_revocations()
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="session-revocations", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+session_tokens = SessionTokens(
+    secret=os.getenv("SESSION_SECRET"),
+    ttl=int(os.getenv("SESSION_TOKEN_TTL", 3600)),
+    cache_ttl=float(os.getenv("SESSION_CACHE_TTL", 60.0)),
+)
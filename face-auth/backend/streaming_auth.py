@@ -0,0 +1,55 @@
+import os
+from face_service import face_auth_service, LoginScanCache
+
+STREAM_MAX_FRAMES = int(os.getenv("STREAM_AUTH_MAX_FRAMES", 30))
+
+class StreamingAuthSession:
+    """Per-WebSocket state for authenticating from a stream of frames.
+
+    Every frame goes through the same path as a one-shot /authenticate
+    (quality gate, probe cache, partitioned search, fallback scan), so the
+    two login routes always agree. The session keeps a LoginScanCache: the
+    candidate shortlist is read once per face block and faces outside the
+    search partitions are decrypted and decoded once, so extra frames cost
+    only their comparisons. The session ends as soon as
+    one frame matches, or when the frame budget or deadline runs out. A frame
+    that cannot be used gets a per-frame progress message, never a closed
+    socket.
+    """
+
+    def __init__(self, deadline, max_frames=STREAM_MAX_FRAMES, service=face_auth_service):
+        self.service = service
+        self.deadline = deadline
+        self.max_frames = max_frames
+        self.frames = 0
+        self.finished = False
+        self.scan_cache = LoginScanCache()
+
+    def _finish(self, result):
+        self.finished = True
+        return {"type": "result", "frames": self.frames, **result}
+
+    def process_frame(self, image_data: bytes):
+        if self.finished:
+            return self._finish({"success": False, "message": "Session already finished"})
+        self.frames += 1
+        if self.deadline.expired():
+            return self._finish({"success": False, "message": "Authentication timed out"})
+
+        result = self.service.authenticate_user_with_face(
+            image_data, deadline=self.deadline, scan_cache=self.scan_cache
+        )
+        if result["success"]:
+            return self._finish(result)
+        if self.deadline.expired():
+            return self._finish({"success": False, "message": "Authentication timed out"})
+        if result["message"] == "No registered faces found":
+            return self._finish(result)
+        if self.frames >= self.max_frames:
+            return self._finish({"success": False, "message": "Face not recognized"})
+
+        progress = {"type": "progress", "frames": self.frames, "message": result["message"]}
+        if result.get("reason"):
+            # The client can fix framing or lighting on the next frame.
+            progress["reason"] = result["reason"]
+        return progress
@@ -0,0 +1,201 @@
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import db_connection
+from face_index import fingerprint, TEMPLATE_VERSION
+from face_service import face_auth_service
+from metrics import metrics
+
+LEASE_SECONDS = 60
+
+class TemplateMigrator:
+    """Resumable background job that re-derives face templates at the current version.
+
+    Stored originals are decrypted and fingerprinted again in parallel
+    batches of `batch_size`, at most `rate` records per second. Progress
+    (a cursor over face_data._id) is saved in the `jobs` collection after
+    every batch, so a restart picks up where the last run stopped. A lease
+    on the job document keeps other workers from running the same job.
+    Records that fail are kept in `failed_ids` and retried in up to
+    `max_retries` further rounds once the cursor reaches the end.
+    Logins keep matching old and new templates side by side throughout
+    (see `probe_fingerprint`), so nothing waits for the migration.
+    """
+
+    def __init__(self, service, version=TEMPLATE_VERSION, batch_size=32, workers=4, rate=20.0, max_retries=3, retry_delay=60.0):
+        self.service = service
+        self.version = version
+        self.batch_size = batch_size
+        self.workers = workers
+        self.rate = rate
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.job_id = f"reembed-v{version}"
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._thread = None
+        metrics.describe("template_reembed_total", "Face templates re-derived by the migration job, by result")
+
+    @property
+    def jobs_collection(self):
+        return db_connection.get_collection("jobs")
+
+    @property
+    def faces_collection(self):
+        return self.service.faces_collection
+
+    def stale_query(self):
+        # Records at a newer version are left alone; None also matches records that predate versioning.
+        return {"$or": [{"template_version": {"$lt": self.version}}, {"template_version": None}]}
+
+    def pending(self):
+        return self.faces_collection.count_documents(self.stale_query())
+
+    def _acquire(self):
+        """Take or renew the job lease; returns the job document or None if another worker holds it."""
+        now = datetime.utcnow()
+        try:
+            return self.jobs_collection.find_one_and_update(
+                {
+                    "_id": self.job_id,
+                    "status": {"$ne": "done"},
+                    "$or": [{"lease_owner": self.owner}, {"lease_until": {"$lt": now}}, {"lease_until": None}],
+                },
+                {
+                    "$set": {"lease_owner": self.owner, "lease_until": now + timedelta(seconds=LEASE_SECONDS), "updated_at": now},
+                    "$setOnInsert": {"status": "running", "cursor": None, "processed": 0, "failed": 0, "failed_ids": [], "round": 0, "started_at": now},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # The job exists and is done or leased elsewhere, so the upsert tried to insert.
+            return None
+
+    def _reembed(self, record):
+        stored_face = self.service.load_face_image(record)
+        if not stored_face:
+            raise RuntimeError("stored face could not be loaded")
+        face_print = fingerprint(self.service.decode_image(stored_face), self.version)
+        self.faces_collection.update_one(
+            {"_id": record["_id"], "template_version": record.get("template_version")},
+            {"$set": face_print}
+        )
+        self.service.forget_template(record["user_id"])
+
+    def _reembed_safely(self, record):
+        try:
+            self._reembed(record)
+            metrics.inc("template_reembed_total", result="migrated")
+            return True
+        except Exception as e:
+            metrics.inc("template_reembed_total", result="failed")
+            print(f"⚠️ Template re-embedding failed for {record.get('user_id', 'unknown')}, it keeps matching at v{record.get('template_version') or 1}: {e}")
+            return False
+
+    def run(self):
+        """Process batches until the job is done, stopped, or leased by another worker."""
+        if self.pending() == 0:
+            return 0
+        print(f"🧬 Re-embedding face templates to v{self.version}")
+        migrated = 0
+        interval = self.batch_size / self.rate if self.rate > 0 else 0.0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="reembed") as pool:
+            while not self._stop.is_set():
+                job = self._acquire()
+                if job is None:
+                    print(f"🧬 Template job {self.job_id} is done or running on another worker")
+                    break
+                started = time.monotonic()
+                query = self.stale_query()
+                id_filter = {}
+                if job.get("cursor") is not None:
+                    id_filter["$gt"] = job["cursor"]
+                if job.get("round"):
+                    id_filter["$in"] = job.get("retrying", [])
+                if id_filter:
+                    query["_id"] = id_filter
+                batch = list(self.faces_collection.find(query).sort("_id", ASCENDING).limit(self.batch_size))
+                if not batch:
+                    failed_ids = job.get("failed_ids", [])
+                    if failed_ids and job.get("round", 0) < self.max_retries:
+                        # Start another round over just the records that failed, after a pause.
+                        self.jobs_collection.update_one(
+                            {"_id": self.job_id},
+                            {"$set": {"cursor": None, "retrying": failed_ids, "failed_ids": []}, "$inc": {"round": 1}}
+                        )
+                        print(f"🧬 Template job {self.job_id} retrying {len(failed_ids)} failed records in {self.retry_delay:.0f}s")
+                        self._stop.wait(self.retry_delay)
+                        continue
+                    self.jobs_collection.update_one(
+                        {"_id": self.job_id},
+                        {"$set": {"status": "done", "finished_at": datetime.utcnow(), "lease_until": None}}
+                    )
+                    print(f"🧬 Template job {self.job_id} finished: {job['processed']} migrated, {len(failed_ids)} still failing")
+                    break
+
+                results = list(pool.map(self._reembed_safely, batch))
+                ok = sum(results)
+                migrated += ok
+                failed_ids = [record["_id"] for record, result in zip(batch, results) if not result]
+                self.jobs_collection.update_one(
+                    {"_id": self.job_id},
+                    {
+                        "$set": {"cursor": batch[-1]["_id"]},
+                        "$inc": {"processed": ok, "failed": len(failed_ids)},
+                        "$addToSet": {"failed_ids": {"$each": failed_ids}},
+                    }
+                )
+                metrics.set_gauge("template_reembed_pending", self.pending())
+                self._stop.wait(max(0.0, interval - (time.monotonic() - started)))
+        return migrated
+
+    def restart(self):
+        """Forget progress so the next run retries every record not yet at this version."""
+        self.jobs_collection.delete_one({"_id": self.job_id})
+
+    def _run_safely(self):
+        try:
+            self.run()
+        except Exception as e:
+            print(f"⚠️ Template job {self.job_id} stopped, it resumes on next start: {e}")
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run_safely, name="template-migrator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        try:
+            self.jobs_collection.update_one(
+                {"_id": self.job_id, "lease_owner": self.owner},
+                {"$set": {"lease_until": None}}
+            )
+        except Exception:
+            pass
+
+template_migrator = TemplateMigrator(
+    face_auth_service,
+    batch_size=int(os.getenv("TEMPLATE_JOB_BATCH", 32)),
+    workers=int(os.getenv("TEMPLATE_JOB_WORKERS", 4)),
+    rate=float(os.getenv("TEMPLATE_JOB_RATE", 20.0)),
+    max_retries=int(os.getenv("TEMPLATE_JOB_RETRIES", 3)),
+    retry_delay=float(os.getenv("TEMPLATE_JOB_RETRY_DELAY", 60.0)),
+)
+
+if __name__ == "__main__":
+    db_connection.connect()
+    if "--restart" in sys.argv:
+        template_migrator.restart()
+    template_migrator.run()
+    db_connection.close()
@@ -0,0 +1,16 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Backend modules import each other by bare name, as they do when run from this directory.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """In-memory Mongo behind db_connection, fresh for each test."""
+    mongomock = pytest.importorskip("mongomock")
+    import database
+    db = mongomock.MongoClient().db
+    monkeypatch.setattr(database.db_connection, "get_collection", lambda name: db[name])
+    return db
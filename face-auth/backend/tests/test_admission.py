@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+def make_controller(capacity=2, login_reserved=1, register_queue=1, max_wait=1.0):
+    return AdmissionController(
+        classes={
+            "login": {"priority": 0, "reserved": login_reserved, "max_queue": 8, "initial_limit": 8},
+            "register": {"priority": 1, "max_queue": register_queue, "initial_limit": 8},
+        },
+        capacity=capacity,
+        max_wait=max_wait,
+    )
+
+async def hold(controller, endpoint_class, release, admitted=None):
+    async with controller.admit(endpoint_class):
+        if admitted is not None:
+            admitted.append(endpoint_class)
+        await release.wait()
+
+def test_login_uses_reserved_slot_while_registrations_are_shed():
+    async def scenario():
+        controller = make_controller()
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(controller, "register", release))
+        await asyncio.sleep(0)
+        # The only unreserved slot is taken: the next registration queues, the one after is shed.
+        queued = asyncio.create_task(hold(controller, "register", release))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as shed:
+            async with controller.admit("register"):
+                pass
+        assert shed.value.reason == "queue_full"
+        assert shed.value.retry_after >= 1
+
+        async with controller.admit("login"):
+            assert controller.in_flight == 2
+
+        release.set()
+        await asyncio.gather(running, queued)
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+def test_queued_logins_are_admitted_before_queued_registrations():
+    async def scenario():
+        controller = make_controller(capacity=1, login_reserved=0, register_queue=4)
+        first = asyncio.Event()
+        blocker = asyncio.create_task(hold(controller, "register", first))
+        await asyncio.sleep(0)
+
+        rest = asyncio.Event()
+        rest.set()
+        admitted = []
+        waiting = [
+            asyncio.create_task(hold(controller, "register", rest, admitted)),
+            asyncio.create_task(hold(controller, "login", rest, admitted)),
+            asyncio.create_task(hold(controller, "register", rest, admitted)),
+            asyncio.create_task(hold(controller, "login", rest, admitted)),
+        ]
+        await asyncio.sleep(0)
+        assert admitted == []
+
+        first.set()
+        await asyncio.gather(blocker, *waiting)
+        assert admitted == ["login", "login", "register", "register"]
+
+    asyncio.run(scenario())
+
+def test_waiter_past_max_wait_is_shed_and_leaves_no_slot_behind():
+    async def scenario():
+        controller = make_controller(capacity=1, login_reserved=0, max_wait=0.05)
+        release = asyncio.Event()
+        blocker = asyncio.create_task(hold(controller, "register", release))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected) as shed:
+            async with controller.admit("login"):
+                pass
+        assert shed.value.reason == "queue_timeout"
+
+        release.set()
+        await blocker
+        assert controller.in_flight == 0
+        assert not controller.limiters["login"].waiters
+        async with controller.admit("login"):
+            pass
+
+    asyncio.run(scenario())
@@ -0,0 +1,139 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from blob_fetch import BlobStoreUnavailable, CircuitBreaker, Deadline, HedgedBlobFetcher
+
+class FaultyStore:
+    """Local stand-in for the blob store whose latency and status can be changed per test."""
+
+    def __init__(self):
+        self.delay = 0.0
+        self.status = 200
+        self.body = b"sealed-blob"
+        self.requests = 0
+        store = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                store.requests += 1
+                time.sleep(store.delay)
+                try:
+                    self.send_response(store.status)
+                    self.send_header("Content-Length", str(len(store.body)))
+                    self.end_headers()
+                    self.wfile.write(store.body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, key):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/{key}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def store():
+    store = FaultyStore()
+    yield store
+    store.close()
+
+def make_fetcher(failure_threshold=3, reset_timeout=0.2, read_timeout=1.0):
+    return HedgedBlobFetcher(
+        connect_timeout=0.5,
+        read_timeout=read_timeout,
+        breaker=CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout),
+    )
+
+def test_fetch_caches_blob(store):
+    fetcher = make_fetcher()
+    assert fetcher.fetch("a", store.url("a")) == b"sealed-blob"
+    assert fetcher.fetch("a", store.url("a")) == b"sealed-blob"
+    assert store.requests == 1
+
+def test_caller_deadline_does_not_open_breaker(store):
+    store.delay = 0.3
+    fetcher = make_fetcher(failure_threshold=3)
+    for i in range(5):
+        with pytest.raises(BlobStoreUnavailable):
+            fetcher.fetch(f"k{i}", store.url(f"k{i}"), Deadline(0.1))
+    assert fetcher.breaker.state == CircuitBreaker.CLOSED
+    assert fetcher.fetch("ok", store.url("ok"), Deadline(2.0)) == b"sealed-blob"
+
+def test_server_errors_open_breaker_and_serve_cache_only(store):
+    fetcher = make_fetcher(failure_threshold=3)
+    fetcher.fetch("cached", store.url("cached"))
+    store.status = 503
+    for i in range(3):
+        with pytest.raises(BlobStoreUnavailable):
+            fetcher.fetch(f"k{i}", store.url(f"k{i}"))
+    assert fetcher.breaker.state == CircuitBreaker.OPEN
+
+    requests_before = store.requests
+    with pytest.raises(BlobStoreUnavailable, match="circuit open"):
+        fetcher.fetch("other", store.url("other"))
+    assert store.requests == requests_before
+    assert fetcher.fetch("cached", store.url("cached")) == b"sealed-blob"
+
+def test_missing_blob_does_not_count_against_store(store):
+    store.status = 404
+    fetcher = make_fetcher(failure_threshold=2)
+    for i in range(4):
+        with pytest.raises(BlobStoreUnavailable):
+            fetcher.fetch(f"k{i}", store.url(f"k{i}"))
+    assert fetcher.breaker.state == CircuitBreaker.CLOSED
+
+def test_half_open_trial_released_when_deadline_runs_out(store):
+    fetcher = make_fetcher(failure_threshold=1, reset_timeout=0.1)
+    store.status = 500
+    with pytest.raises(BlobStoreUnavailable):
+        fetcher.fetch("a", store.url("a"))
+    assert fetcher.breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.15)
+    store.status = 200
+    store.delay = 0.3
+    # The trial call runs out of its own budget: no verdict, but the slot is given back.
+    with pytest.raises(BlobStoreUnavailable):
+        fetcher.fetch("b", store.url("b"), Deadline(0.1))
+    assert fetcher.breaker.state == CircuitBreaker.HALF_OPEN
+
+    store.delay = 0.0
+    assert fetcher.fetch("c", store.url("c")) == b"sealed-blob"
+    assert fetcher.breaker.state == CircuitBreaker.CLOSED
+
+def test_half_open_trial_released_when_url_lookup_gives_up(store):
+    fetcher = make_fetcher(failure_threshold=1, reset_timeout=0.1)
+    store.status = 500
+    with pytest.raises(BlobStoreUnavailable):
+        fetcher.fetch("a", store.url("a"))
+    time.sleep(0.15)
+    store.status = 200
+
+    def slow_lookup(deadline):
+        time.sleep(deadline.remaining())
+        raise TimeoutError("lookup timed out")
+
+    with pytest.raises(BlobStoreUnavailable):
+        fetcher.fetch("b", None, Deadline(0.05), resolve_url=slow_lookup)
+    assert fetcher.fetch("b", None, resolve_url=lambda deadline: store.url("b")) == b"sealed-blob"
+    assert fetcher.breaker.state == CircuitBreaker.CLOSED
+
+def test_slow_store_is_hedged(store):
+    fetcher = make_fetcher()
+    for i in range(25):
+        fetcher.fetch(f"warm{i}", store.url(f"warm{i}"))
+    store.delay = 0.2
+    assert fetcher.fetch("slow", store.url("slow"), Deadline(2.0)) == b"sealed-blob"
+    assert fetcher.hedged_requests >= 1
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+import dashboard_stats
+from dashboard_stats import DashboardStats, EVENTS_COLLECTION, STATE_ID
+
+def event(user_id, event_type, question_id="q1", topic="Arrays"):
+    return {
+        "_id": ObjectId(),
+        "user_id": user_id,
+        "question_id": question_id,
+        "event_type": event_type,
+        "topic": topic,
+        "received_at": datetime(2026, 10, 19, 12, 0),
+    }
+
+@pytest.fixture
+def stats(mongo):
+    stats = DashboardStats(state_ttl=0.0, rebuild_grace=0.0)
+    stats.ensure_indexes(0)
+    return stats
+
+def log(mongo, *events):
+    mongo[EVENTS_COLLECTION].insert_many([dict(e) for e in events])
+    return list(events)
+
+def test_event_seen_by_replay_and_live_listener_counts_once(mongo, stats):
+    events = [event("u1", "ATTEMPT"), event("u1", "SOLVED")]
+    mongo.jobs.insert_one({"_id": STATE_ID, "generation": 0, "target": 1})
+
+    stats.apply_events(events)
+    assert stats._replay(events, 1) == 0
+    stats.apply_events(events[:1])
+
+    target, _ = stats.collections(1)
+    document = target.find_one({"user_id": "u1"})
+    assert document["eventsTotal"] == 2
+    assert document["attempts"] == 1
+    assert document["problemsSolved"] == 1
+
+def test_rebuild_flips_generation_and_keeps_live_events(mongo, stats, monkeypatch):
+    old = log(mongo, event("u1", "ATTEMPT"), event("u1", "SOLVED"))
+    stats.apply_events(old)
+    live = event("u1", "SOLVED", question_id="q2")
+    sleeps = []
+
+    def grace(seconds):
+        # A listener flushes a new event while the rebuild is waiting out its grace period.
+        if not sleeps:
+            log(mongo, live)
+            stats.apply_events([live])
+        sleeps.append(seconds)
+    monkeypatch.setattr(dashboard_stats.time, "sleep", grace)
+
+    assert stats.rebuild(batch_size=1) == 2
+
+    assert stats.state(fresh=True) == {"generation": 1, "target": None}
+    document = stats.get("u1")
+    assert document["eventsTotal"] == 3
+    assert document["problemsSolved"] == 2
+    collections = mongo.list_collection_names()
+    assert "user_stats" not in collections
+    assert "user_stats_claims_1" not in collections
+    assert mongo.user_stats_1.count_documents({}) == 1
+
+def test_second_rebuild_while_one_is_running_is_refused(mongo, stats):
+    mongo.jobs.insert_one({"_id": STATE_ID, "generation": 0, "target": 1})
+    with pytest.raises(RuntimeError):
+        stats.rebuild()
@@ -0,0 +1,83 @@
+import base64
+import io
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import face_service
+import outbox
+from face_index import EnrolmentBusy, face_index, fingerprint
+
+def face_png(seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 255, (96, 96, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "PNG")
+    return buffer.getvalue()
+
+def face_print(seed=0):
+    return fingerprint(Image.open(io.BytesIO(face_png(seed))))
+
+def test_overlapping_claims_run_one_after_the_other(mongo):
+    inside, order = threading.Lock(), []
+
+    def enrol(name):
+        with face_index.enrolment_claim(face_print(), wait=5.0):
+            assert inside.acquire(blocking=False), "two enrolments of one face overlapped"
+            order.append(name)
+            time.sleep(0.1)
+            inside.release()
+
+    threads = [threading.Thread(target=enrol, args=(name,)) for name in ("a", "b", "c")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(order) == ["a", "b", "c"]
+    assert mongo.face_enrolment_claims.count_documents({}) == 0
+
+def test_claim_gives_up_after_wait_and_takes_over_expired_claims(mongo):
+    with face_index.enrolment_claim(face_print(), ttl=0.2):
+        with pytest.raises(EnrolmentBusy):
+            with face_index.enrolment_claim(face_print(), wait=0.0):
+                pass
+        time.sleep(0.3)
+        # The first claim's ttl has run out, as if its holder had crashed.
+        with face_index.enrolment_claim(face_print(), wait=0.0):
+            pass
+
+def test_concurrent_registrations_of_one_face_enrol_it_once(mongo, monkeypatch, tmp_path):
+    keyring = {"active": "k1", "keys": {"k1": base64.b64encode(os.urandom(32)).decode("ascii")}}
+    monkeypatch.setenv("FACE_KEYRING", json.dumps(keyring))
+    monkeypatch.setattr(outbox, "OUTBOX_DIR", tmp_path)
+    monkeypatch.setattr(face_service, "DUPLICATE_FACE_POLICY", "reject")
+    service = face_service.face_auth_service
+    check = service.find_duplicate_face
+
+    def slow_check(probe_image):
+        # Widen the window between the duplicate check and the insert.
+        result = check(probe_image)
+        time.sleep(0.2)
+        return result
+    monkeypatch.setattr(service, "find_duplicate_face", slow_check)
+
+    image, results = face_png(), []
+    threads = [
+        threading.Thread(target=lambda email=email: results.append(
+            service.register_user_with_face(email, "password", image)
+        ))
+        for email in ("a@example.com", "b@example.com")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(result["success"] for result in results) == [False, True]
+    assert mongo.face_data.count_documents({}) == 1
+    assert mongo.users.count_documents({}) == 1
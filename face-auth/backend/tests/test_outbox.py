@@ -0,0 +1,109 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import outbox
+from cloudinary_config import cloudinary_manager
+from outbox import UploadOutbox
+
+class FlakyUploader:
+    """Fails the first `failures` uploads, then succeeds."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = []
+
+    def __call__(self, user_id, encrypted_data, public_id=None):
+        self.calls.append(user_id)
+        if len(self.calls) <= self.failures:
+            return None
+        return {
+            "secure_url": f"https://blobs.test/{user_id}",
+            "public_id": f"encrypted_faces/{user_id}_face.enc",
+            "format": "envelope",
+            "key_id": "k1",
+        }
+
+@pytest.fixture
+def uploader(monkeypatch, tmp_path):
+    monkeypatch.setattr(outbox, "OUTBOX_DIR", tmp_path)
+    uploader = FlakyUploader()
+    monkeypatch.setattr(cloudinary_manager, "upload_encrypted_blob", uploader)
+    return uploader
+
+@pytest.fixture
+def box():
+    box = UploadOutbox(workers=1, max_attempts=4, base_delay=0.01, max_delay=0.05, grace_period=60)
+    yield box
+    box.stop()
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+def register(mongo, box, user_id, blob=b"sealed"):
+    box.stage(user_id, blob)
+    mongo.users.insert_one({"user_id": user_id})
+    mongo.face_data.insert_one({"user_id": user_id, "upload_status": "pending"})
+
+def test_failed_upload_is_retried_until_it_lands(mongo, uploader, box, tmp_path):
+    uploader.failures = 2
+    register(mongo, box, "u1")
+    box.start()
+    assert box.submit("u1")
+
+    assert wait_for(lambda: mongo.upload_outbox.count_documents({}) == 0)
+    assert uploader.calls == ["u1", "u1", "u1"]
+    face = mongo.face_data.find_one({"user_id": "u1"})
+    assert face["upload_status"] == "uploaded"
+    assert face["encryption_key_id"] == "k1"
+    assert not (tmp_path / "u1.enc").exists()
+
+def test_upload_gives_up_after_max_attempts(mongo, uploader, box, tmp_path):
+    uploader.failures = 100
+    register(mongo, box, "u1")
+    box.start()
+    box.submit("u1")
+
+    assert wait_for(lambda: mongo.upload_outbox.find_one({"user_id": "u1"})["status"] == "failed")
+    assert len(uploader.calls) == box.max_attempts
+    # The blob stays staged so a later reconcile can try again.
+    assert box.load_blob("u1") == b"sealed"
+
+def test_reconcile_requeues_failed_and_repairs_missing_face_record(mongo, uploader, box):
+    register(mongo, box, "u1")
+    mongo.upload_outbox.update_one({"user_id": "u1"}, {"$set": {"status": "failed", "attempts": 4}})
+    box.stage("u2", b"sealed")
+    mongo.users.insert_one({"user_id": "u2"})
+    box.start()
+
+    result = box.reconcile()
+
+    assert result["requeued"] == 2
+    assert wait_for(lambda: mongo.upload_outbox.count_documents({}) == 0)
+    for user_id in ("u1", "u2"):
+        assert mongo.face_data.find_one({"user_id": user_id})["upload_status"] == "uploaded"
+
+def test_reconcile_drops_stale_orphans_and_flags_users_without_faces(mongo, uploader, box, tmp_path):
+    box.stage("ghost", b"sealed")
+    mongo.upload_outbox.update_one(
+        {"user_id": "ghost"},
+        {"$set": {"created_at": datetime.utcnow() - timedelta(seconds=box.grace_period + 1)}}
+    )
+    box.stage("fresh", b"sealed")
+    mongo.users.insert_one({"user_id": "legacy"})
+
+    result = box.reconcile()
+
+    assert result == {"requeued": 0, "removed": 1, "flagged": 1}
+    assert mongo.upload_outbox.find_one({"user_id": "ghost"}) is None
+    assert not (tmp_path / "ghost.enc").exists()
+    # Still inside the grace period: may be a registration in progress elsewhere.
+    assert mongo.upload_outbox.find_one({"user_id": "fresh"}) is not None
+    assert mongo.users.find_one({"user_id": "legacy"})["needs_review"] == "no_face_data"
+    assert mongo.users.count_documents({}) == 1
@@ -0,0 +1,41 @@
+import time
+
+from probe_cache import ProbeCache
+
+PROBE = ProbeCache.digest(b"frame")
+
+def test_decision_replays_only_for_the_same_probe_and_version(mongo):
+    cache = ProbeCache(version_ttl=60.0)
+    version = cache.version()
+    cache.remember_match(PROBE, version, "u1")
+
+    assert cache.lookup_exact(PROBE, version) == (True, "u1")
+    assert cache.lookup_exact(ProbeCache.digest(b"other frame"), version) == (False, None)
+    assert cache.lookup_exact(PROBE, version + 1) == (False, None)
+
+def test_bump_invalidates_remembered_decisions(mongo):
+    cache = ProbeCache(version_ttl=60.0)
+    before = cache.version()
+    cache.remember_no_match(PROBE, before)
+
+    cache.bump()
+
+    after = cache.version()
+    assert after == before + 1
+    assert cache.lookup_exact(PROBE, after) == (False, None)
+    # Entries are dropped, not just outdated: even the old version no longer replays.
+    assert cache.lookup_exact(PROBE, before) == (False, None)
+
+def test_bump_on_another_worker_is_seen_within_version_ttl(mongo):
+    worker, other_worker = ProbeCache(version_ttl=0.1), ProbeCache(version_ttl=0.1)
+    version = worker.version()
+    worker.remember_no_match(PROBE, version)
+
+    other_worker.bump()
+    # Still inside the window: this worker keeps the version it read.
+    assert worker.version() == version
+
+    time.sleep(0.15)
+    fresh = worker.version()
+    assert fresh == version + 1
+    assert worker.lookup_exact(PROBE, fresh) == (False, None)
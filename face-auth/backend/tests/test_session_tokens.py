@@ -0,0 +1,77 @@
+import pytest
+
+from session_tokens import InvalidSessionToken, SessionTokens
+
+SECRET = "s" * 32
+
+@pytest.fixture
+def tokens(mongo):
+    return SessionTokens(secret=SECRET, ttl=60, cache_ttl=10.0)
+
+def test_issued_token_verifies_and_is_cached(tokens):
+    token, claims = tokens.issue("u1", "u1@example.com", now=1000)
+    verified = tokens.verify(token, now=1001)
+    assert verified == claims
+    assert tokens.verify(token, now=1002) is verified
+    assert claims["sub"] == "u1" and claims["exp"] == 1060
+
+def test_tampered_expired_and_foreign_tokens_are_rejected(tokens):
+    token, _ = tokens.issue("u1", "u1@example.com", now=1000)
+    prefix, payload, signature = token.split(".")
+    other, _ = SessionTokens(secret="o" * 32).issue("u1", "u1@example.com", now=1000)
+
+    cases = {
+        "bad signature": f"{prefix}.{payload}.{other.split('.')[2]}",
+        "unsupported token version": f"v0.{payload}.{signature}",
+        "malformed token": "not-a-token",
+        "expired": token,
+    }
+    for reason, candidate in cases.items():
+        with pytest.raises(InvalidSessionToken) as rejected:
+            tokens.verify(candidate, now=1060)
+        assert rejected.value.reason == reason
+
+def test_revoked_token_is_rejected_even_when_cached(tokens, mongo):
+    token, claims = tokens.issue("u1", "u1@example.com", now=1000)
+    tokens.verify(token, now=1001)
+
+    tokens.revoke(claims)
+
+    with pytest.raises(InvalidSessionToken) as rejected:
+        tokens.verify(token, now=1002)
+    assert rejected.value.reason == "revoked"
+    assert mongo.revoked_sessions.find_one({"_id": claims["jti"]}) is not None
+
+def test_refresh_picks_up_revocations_from_other_workers(tokens, mongo):
+    other_worker = SessionTokens(secret=SECRET, ttl=60)
+    token, claims = tokens.issue("u1", "u1@example.com", now=1000)
+    tokens.verify(token, now=1001)
+
+    other_worker.revoke(claims)
+    assert tokens.verify(token, now=1002) == claims
+
+    assert tokens.refresh_revocations() == 1
+    with pytest.raises(InvalidSessionToken):
+        tokens.verify(token, now=1003)
+
+def test_refresh_keeps_local_revocations_not_yet_read_back(tokens, mongo, monkeypatch):
+    _, claims = tokens.issue("u1", "u1@example.com", now=1000)
+    token, _ = tokens.issue("u2", "u2@example.com", now=1000)
+    original_find = mongo.revoked_sessions.find
+
+    def find_then_revoke(*args, **kwargs):
+        # A revoke lands on this worker after the snapshot was read.
+        snapshot = list(original_find(*args, **kwargs))
+        tokens.revoke(claims)
+        return snapshot
+
+    monkeypatch.setattr(mongo.revoked_sessions, "find", find_then_revoke)
+    tokens.refresh_revocations()
+
+    assert claims["jti"] in tokens._revocations
+    assert tokens.verify(token, now=1001)["sub"] == "u2"
+
+def test_short_or_missing_secret_is_refused():
+    for secret in (None, "short"):
+        with pytest.raises(RuntimeError):
+            SessionTokens(secret=secret).require_secret()
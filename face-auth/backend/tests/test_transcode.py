@@ -0,0 +1,21 @@
+import io
+
+from PIL import Image
+
+from transcode import media_type, transcode_enrolment
+
+def encoded(fmt, **options):
+    buffer = io.BytesIO()
+    Image.new("RGB", (16, 16), (200, 30, 30)).save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+def test_stored_face_is_served_with_its_recorded_format():
+    data, info = transcode_enrolment(encoded("BMP"))
+    assert info["image_format"] in ("png", "webp")
+    assert media_type(data, info["image_format"]) == f"image/{info['image_format']}"
+
+def test_records_without_a_format_are_sniffed():
+    assert media_type(encoded("JPEG")) == "image/jpeg"
+    assert media_type(encoded("PNG")) == "image/png"
+    assert media_type(encoded("WEBP", lossless=True)) == "image/webp"
+    assert media_type(b"not an image") == "application/octet-stream"
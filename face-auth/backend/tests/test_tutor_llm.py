@@ -0,0 +1,68 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from tutor_llm import LocalTutorProvider, SemanticCache, TutorProvider, TutorService, normalize_doubt
+
+def doubt(answer, question_id="q1", step_number=1):
+    return SimpleNamespace(question_id=question_id, step_number=step_number, student_answer=answer)
+
+class CountingProvider(LocalTutorProvider):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    async def generate_batch(self, prompts, emit):
+        self.batches.append(len(prompts))
+        return await super().generate_batch(prompts, emit)
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_provider_interface_is_abstract():
+    with pytest.raises(TypeError):
+        TutorProvider()
+
+def test_cache_key_keeps_word_order():
+    assert normalize_doubt("Q1", 1, "Is the loop before the check?") == normalize_doubt("q1", 1, "loop before check")
+    assert normalize_doubt("q1", 1, "loop before check") != normalize_doubt("q1", 1, "check before loop")
+
+def test_cached_answer_never_quotes_another_student():
+    async def scenario():
+        service = TutorService(CountingProvider(), cache=SemanticCache())
+        first, cached_first = await service.answer(doubt("zzqx wibble"))
+        second, cached_second = await service.answer(doubt("ZZQX, wibble!"))
+        await service.stop()
+        return service, first, cached_first, second, cached_second
+
+    service, first, cached_first, second, cached_second = run(scenario())
+    assert not cached_first and cached_second
+    assert "zzqx wibble" in first
+    assert "ZZQX, wibble!" in second and "zzqx wibble" not in second
+    assert service.provider.batches == [1]
+
+def test_concurrent_doubts_share_one_batch():
+    async def scenario():
+        service = TutorService(CountingProvider(), max_batch=8, max_wait=0.05, cache=SemanticCache())
+        answers = await asyncio.gather(*(service.answer(doubt(f"question number {i}")) for i in range(5)))
+        await service.stop()
+        return service, answers
+
+    service, answers = run(scenario())
+    assert service.provider.batches == [5]
+    assert all(f"question number {i}" in text for i, (text, _) in enumerate(answers))
+
+def test_joined_stream_is_addressed_to_its_own_student():
+    async def collect(service, item):
+        return [value async for kind, value in service.stream(item) if kind == "chunk"]
+
+    async def scenario():
+        service = TutorService(LocalTutorProvider(chunk_delay=0.01), max_wait=0.01, cache=SemanticCache())
+        owner, joiner = await asyncio.gather(collect(service, doubt("zzqx wibble")), collect(service, doubt("Zzqx wibble?")))
+        await service.stop()
+        return "".join(owner), "".join(joiner)
+
+    owner, joiner = run(scenario())
+    assert "zzqx wibble" in owner
+    assert "Zzqx wibble?" in joiner and "'zzqx wibble'" not in joiner
@@ -0,0 +1,167 @@
+import io
+import os
+import struct
+import sys
+from PIL import Image
+from metrics import metrics
+
+WEBP_METHOD = int(os.getenv("ENROLMENT_WEBP_METHOD", 4))
+# APP1-APP13 and APP15 (EXIF, XMP, ICC, IPTC, ...) and comments. APP0 (JFIF)
+# and APP14 (Adobe colour transform) change how the scan decodes, so they stay.
+JPEG_METADATA_MARKERS = set(range(0xE1, 0xEE)) | {0xEF, 0xFE}
+
+MEDIA_TYPES = {
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "gif": "image/gif",
+    "bmp": "image/bmp",
+}
+SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF8", "gif"),
+    (b"BM", "bmp"),
+)
+
+def media_type(data, image_format=None):
+    """Content type for stored face bytes: the recorded format, else sniffed for records from before transcoding."""
+    if image_format in MEDIA_TYPES:
+        return MEDIA_TYPES[image_format]
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return MEDIA_TYPES["webp"]
+    for signature, name in SIGNATURES:
+        if data.startswith(signature):
+            return MEDIA_TYPES[name]
+    return "application/octet-stream"
+
+def strip_jpeg_metadata(data):
+    """Drop metadata segments from a JPEG without touching the compressed scan."""
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("not a JPEG")
+    out = bytearray(data[:2])
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            raise ValueError("corrupt JPEG segment")
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker.
+            offset += 1
+            continue
+        if marker == 0xDA:
+            # Start of scan: entropy-coded data runs to the end of the file.
+            out += data[offset:]
+            return bytes(out)
+        length = struct.unpack(">H", data[offset + 2:offset + 4])[0]
+        if marker not in JPEG_METADATA_MARKERS:
+            out += data[offset:offset + 2 + length]
+        offset += 2 + length
+    raise ValueError("JPEG has no scan")
+
+def _pixels(image):
+    return image.mode, image.size, image.tobytes()
+
+def _candidates(data, image):
+    if image.format == "JPEG":
+        # Lossless WebP of decoded JPEG pixels is practically never smaller, so don't try.
+        yield "jpeg", strip_jpeg_metadata(data)
+        return
+    clean = image.copy()
+    clean.info = {key: value for key, value in image.info.items() if key == "transparency"}
+    buffer = io.BytesIO()
+    clean.save(buffer, "PNG")
+    yield "png", buffer.getvalue()
+    if image.mode in ("RGB", "RGBA"):
+        buffer = io.BytesIO()
+        image.save(buffer, "WEBP", lossless=True, exact=True, method=WEBP_METHOD)
+        yield "webp", buffer.getvalue()
+
+def transcode_enrolment(data):
+    """Smallest metadata-free encoding of an enrolment image that decodes to the same pixels.
+
+    Matching compares stored and probe pixels exactly, so only lossless
+    candidates are considered and each one is decoded and checked before it
+    is used: the original with metadata stripped, an optimized PNG, and
+    lossless WebP. Returns (stored_bytes, info for the face_data record).
+    """
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    reference = _pixels(image)
+    source_format = (image.format or "unknown").lower()
+
+    best_format, best = source_format, data
+    for name, candidate in _candidates(data, image):
+        if len(candidate) >= len(best):
+            continue
+        try:
+            decoded = Image.open(io.BytesIO(candidate))
+            decoded.load()
+        except Exception:
+            continue
+        if _pixels(decoded) == reference:
+            best_format, best = name, candidate
+
+    ratio = round(len(data) / len(best), 3) if best else 1.0
+    metrics.inc("enrolment_transcode_total", source=source_format, stored=best_format)
+    metrics.observe("enrolment_compression_ratio", ratio, buckets=(1.0, 1.1, 1.25, 1.5, 2.0, 3.0, 5.0, 10.0))
+    return best, {
+        "image_format": best_format,
+        "original_bytes": len(data),
+        "compression_ratio": ratio,
+    }
+
+def backfill(service, limit=None):
+    """Re-store uploaded faces that predate transcoding, overwriting each blob in place."""
+    from blob_fetch import blob_fetcher
+    from cloudinary_config import cloudinary_manager
+
+    query = {"upload_status": "uploaded", "image_format": None}
+    records = service.faces_collection.find(query, {"_id": 0, "user_id": 1, "cloudinary_public_id": 1, "cloudinary_url": 1})
+    if limit:
+        records = records.limit(limit)
+
+    done = skipped = failed = 0
+    saved = 0
+    for record in records:
+        public_id = record["cloudinary_public_id"]
+        try:
+            original = cloudinary_manager.download_and_decrypt_face(public_id, url=record.get("cloudinary_url"))
+            if original is None:
+                raise RuntimeError("download or decryption failed")
+            stored, info = transcode_enrolment(original)
+            if len(stored) >= len(original):
+                service.faces_collection.update_one({"cloudinary_public_id": public_id}, {"$set": info})
+                skipped += 1
+                continue
+
+            encrypted_data = cloudinary_manager.encrypt_image(stored)
+            upload_result = cloudinary_manager.upload_encrypted_blob(None, encrypted_data, public_id=public_id)
+            if not upload_result:
+                raise RuntimeError("upload failed")
+            service.faces_collection.update_one(
+                {"cloudinary_public_id": public_id},
+                {"$set": {
+                    **info,
+                    "cloudinary_url": upload_result["secure_url"],
+                    "encryption_format": upload_result["format"],
+                    "encryption_key_id": upload_result["key_id"],
+                }}
+            )
+            blob_fetcher.cache.put(public_id, upload_result["secure_url"], encrypted_data)
+            saved += len(original) - len(stored)
+            done += 1
+        except Exception as e:
+            failed += 1
+            print(f"⚠️ Transcode backfill failed for {record.get('user_id', 'unknown')}: {e}")
+
+    print(f"🗜️ Transcode backfill finished: {done} re-stored, {skipped} already minimal, {failed} failed, {saved / 1024:.0f} KiB saved")
+    return {"transcoded": done, "skipped": skipped, "failed": failed, "bytes_saved": saved}
+
+if __name__ == "__main__":
+    from database import db_connection
+    from face_service import face_auth_service
+
+    db_connection.connect()
+    backfill(face_auth_service, limit=int(sys.argv[1]) if len(sys.argv) > 1 else None)
+    db_connection.close()
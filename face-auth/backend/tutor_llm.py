@@ -0,0 +1,253 @@
+import abc
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from intent_engine import intent_engine
+from metrics import metrics
+
+STOPWORDS = {"a", "an", "the", "is", "i", "it", "to", "of", "and", "do", "how", "this", "that", "my", "me", "please", "what"}
+_DONE = object()
+# Stands in for the student's own words in shared and cached explanations.
+ANSWER_SLOT = "\x00answer\x00"
+
+class TutorProvider(abc.ABC):
+    """Interface for tutor model backends.
+
+    `generate_batch` receives every prompt collected in one micro-batch and
+    must call `emit(index, text_chunk)` for partial output as it becomes
+    available, then return the full text for each prompt in order.
+    """
+
+    name = "base"
+
+    @abc.abstractmethod
+    async def generate_batch(self, prompts, emit):
+        ...
+
+class LocalTutorProvider(TutorProvider):
+    """Deterministic stand-in: templated intent explanations streamed word by word."""
+
+    name = "local"
+
+    def __init__(self, chunk_delay=0.0):
+        self.chunk_delay = chunk_delay
+
+    async def generate_batch(self, prompts, emit):
+        texts = [intent_engine.explain(prompt["student_answer"])[0] for prompt in prompts]
+        words = [text.split(" ") for text in texts]
+        longest = max((len(w) for w in words), default=0)
+        for position in range(longest):
+            for index, prompt_words in enumerate(words):
+                if position < len(prompt_words):
+                    emit(index, ("" if position == 0 else " ") + prompt_words[position])
+            if self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+        return texts
+
+PROVIDERS = {
+    LocalTutorProvider.name: LocalTutorProvider,
+}
+
+def normalize_doubt(question_id, step_number, student_answer):
+    """Cache key that ignores case, punctuation and filler words, but keeps word order."""
+    tokens = re.findall(r"[a-z0-9]+", student_answer.lower())
+    content = [token for token in tokens if token not in STOPWORDS]
+    return (question_id.strip().lower(), int(step_number), " ".join(content))
+
+def to_template(text, student_answer):
+    """Replace the student's own words with ANSWER_SLOT so the text can be shared."""
+    answer = student_answer.strip()
+    return text.replace(answer, ANSWER_SLOT) if answer else text
+
+def render(template, student_answer):
+    return template.replace(ANSWER_SLOT, student_answer.strip())
+
+class SemanticCache:
+    def __init__(self, max_entries=10000, ttl=3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        metrics.inc("tutor_cache_requests_total", result="hit" if hit else "miss")
+        metrics.set_gauge("tutor_cache_hit_rate", round(self.hits / (self.hits + self.misses), 4))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self._record(True)
+                return entry[1]
+        self._record(False)
+        return None
+
+    def put(self, key, text):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class _PendingDoubt:
+    __slots__ = ("prompt", "chunks", "result", "enqueued_at")
+
+    def __init__(self, prompt, loop):
+        self.prompt = prompt
+        self.chunks = asyncio.Queue()
+        self.result = loop.create_future()
+        self.enqueued_at = time.monotonic()
+
+class TutorService:
+    """Answers live doubts through a provider with micro-batching, streaming and a semantic cache.
+
+    Concurrent cache misses are queued and sent to the provider together once
+    `max_batch` doubts are waiting or `max_wait` seconds have passed. Partial
+    output is fanned back to each request's chunk queue, which the SSE
+    endpoint drains. Doubts that normalize to the same question on the same
+    step are answered from the cache without a model call. Cached and shared
+    text never carries another student's words: wherever the generated text
+    quotes the answer it was generated for, the cache holds a slot that is
+    filled with the current student's own answer.
+    """
+
+    def __init__(self, provider, max_batch=16, max_wait=0.02, cache=None):
+        self.provider = provider
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.cache = cache or SemanticCache()
+        self._queue = None
+        self._worker = None
+        self._in_flight = {}
+        metrics.describe("tutor_model_seconds", "Provider time attributed to each answered doubt")
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        print(f"🤖 Tutor service started with '{self.provider.name}' provider")
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._generate(batch)
+
+    async def _generate(self, batch):
+        started = time.monotonic()
+        metrics.observe("tutor_batch_size", len(batch), buckets=(1, 2, 4, 8, 16, 32, 64))
+
+        def emit(index, chunk):
+            batch[index].chunks.put_nowait(chunk)
+
+        try:
+            texts = await self.provider.generate_batch([pending.prompt for pending in batch], emit)
+        except Exception as e:
+            print(f"❌ Tutor provider failed for a batch of {len(batch)}: {e}")
+            for pending in batch:
+                pending.chunks.put_nowait(_DONE)
+                if not pending.result.done():
+                    pending.result.set_exception(e)
+            return
+
+        elapsed = time.monotonic() - started
+        for pending, text in zip(batch, texts):
+            metrics.observe("tutor_model_seconds", elapsed)
+            metrics.observe("tutor_queue_seconds", started - pending.enqueued_at)
+            pending.chunks.put_nowait(_DONE)
+            if not pending.result.done():
+                pending.result.set_result(text)
+
+    def _submit(self, key, prompt):
+        """Queue a doubt, or join an identical one that is already being generated."""
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            return pending, False
+        if self._worker is None:
+            self.start()
+        pending = _PendingDoubt(prompt, asyncio.get_running_loop())
+        self._in_flight[key] = pending
+
+        def finished(future):
+            self._in_flight.pop(key, None)
+            if not future.cancelled() and future.exception() is None:
+                self.cache.put(key, to_template(future.result(), prompt["student_answer"]))
+
+        pending.result.add_done_callback(finished)
+        self._queue.put_nowait(pending)
+        return pending, True
+
+    async def answer(self, doubt):
+        """Return (explanation, cached) for a LiveDoubtRequest-shaped object."""
+        key = normalize_doubt(doubt.question_id, doubt.step_number, doubt.student_answer)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return render(cached, doubt.student_answer), True
+        pending, _ = self._submit(key, {"question_id": doubt.question_id, "step_number": doubt.step_number, "student_answer": doubt.student_answer})
+        return await self._shared_result(pending, doubt), False
+
+    async def _shared_result(self, pending, doubt):
+        """The text generated for `pending`, re-addressed to this doubt's student."""
+        text = await asyncio.shield(pending.result)
+        return render(to_template(text, pending.prompt["student_answer"]), doubt.student_answer)
+
+    async def stream(self, doubt):
+        """Yield ("chunk", text) pieces and finally ("done", cached)."""
+        key = normalize_doubt(doubt.question_id, doubt.step_number, doubt.student_answer)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield "chunk", render(cached, doubt.student_answer)
+            yield "done", True
+            return
+
+        pending, owner = self._submit(key, {"question_id": doubt.question_id, "step_number": doubt.step_number, "student_answer": doubt.student_answer})
+        if not owner:
+            # Someone else is streaming this doubt; wait for the full text instead.
+            yield "chunk", await self._shared_result(pending, doubt)
+            yield "done", False
+            return
+
+        while True:
+            chunk = await pending.chunks.get()
+            if chunk is _DONE:
+                break
+            yield "chunk", chunk
+        await asyncio.shield(pending.result)
+        yield "done", False
+
+tutor_service = TutorService(
+    PROVIDERS[os.getenv("TUTOR_PROVIDER", "local")](),
+    max_batch=int(os.getenv("TUTOR_MAX_BATCH", 16)),
+    max_wait=float(os.getenv("TUTOR_MAX_WAIT_MS", 20)) / 1000,
+    cache=SemanticCache(
+        max_entries=int(os.getenv("TUTOR_CACHE_ENTRIES", 10000)),
+        ttl=float(os.getenv("TUTOR_CACHE_TTL", 3600)),
+    ),
+)
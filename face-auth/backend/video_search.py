@@ -0,0 +1,188 @@
+import bisect
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+VIDEO_CATALOGUE_FILE = Path(os.getenv("VIDEO_CATALOGUE_FILE", BASE_DIR / "data" / "videos.json"))
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_POSTINGS_PER_TERM = 2000
+PREFIX_WEIGHT = 0.7
+MAX_PREFIX_EXPANSIONS = 16
+FUZZY_MIN_DICE = 0.5
+MAX_FUZZY_EXPANSIONS = 3
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+def trigrams(term):
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class VideoIndex:
+    """Immutable search index over one catalogue snapshot.
+
+    Postings are impact-ordered: each entry already holds the document's BM25
+    contribution for that term, sorted best first, so a query only sums a
+    bounded prefix of every list. Unknown query terms are expanded through a
+    trigram index over the vocabulary (typo tolerance), and the last query
+    term is also expanded by prefix over the sorted vocabulary (autocomplete).
+    """
+
+    def __init__(self, videos, default):
+        self.videos = videos
+        self.default = default
+        postings = {}
+        doc_lengths = []
+        for doc_id, video in enumerate(videos):
+            tokens = tokenize(video.get("title", ""))
+            for keyword in video.get("keywords", []):
+                tokens.extend(tokenize(keyword))
+            doc_lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append((doc_id, tf))
+
+        n_docs = max(1, len(videos))
+        avg_len = (sum(doc_lengths) / n_docs) or 1.0
+        self.postings = {}
+        for term, entries in postings.items():
+            idf = math.log(1 + (n_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+            impacts = []
+            for doc_id, tf in entries:
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[doc_id] / avg_len)
+                impacts.append((idf * tf * (BM25_K1 + 1) / norm, doc_id))
+            impacts.sort(reverse=True)
+            self.postings[term] = impacts
+
+        self.vocabulary = sorted(self.postings)
+        self.trigram_index = {}
+        for term in self.vocabulary:
+            for gram in trigrams(term):
+                self.trigram_index.setdefault(gram, []).append(term)
+
+    def _prefix_terms(self, prefix):
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        expansions = []
+        for term in self.vocabulary[start:start + MAX_PREFIX_EXPANSIONS + 1]:
+            if not term.startswith(prefix):
+                break
+            if term != prefix:
+                expansions.append(term)
+        return expansions[:MAX_PREFIX_EXPANSIONS]
+
+    def _fuzzy_terms(self, token):
+        grams = trigrams(token)
+        shared = {}
+        for gram in grams:
+            for term in self.trigram_index.get(gram, ()):
+                shared[term] = shared.get(term, 0) + 1
+        scored = []
+        for term, count in shared.items():
+            dice = 2 * count / (len(grams) + len(term) + 1)
+            if dice >= FUZZY_MIN_DICE:
+                scored.append((dice, term))
+        return heapq.nlargest(MAX_FUZZY_EXPANSIONS, scored)
+
+    def expand(self, query):
+        tokens = tokenize(query)
+        weighted = []
+        for position, token in enumerate(tokens):
+            if token in self.postings:
+                weighted.append((token, 1.0))
+            is_last = position == len(tokens) - 1
+            prefixes = self._prefix_terms(token) if is_last and len(token) >= 2 else []
+            weighted.extend((term, PREFIX_WEIGHT) for term in prefixes)
+            if token not in self.postings and not prefixes and len(token) >= 3:
+                weighted.extend((term, dice) for dice, term in self._fuzzy_terms(token))
+        return weighted
+
+    def search(self, query, k=5):
+        scores = {}
+        for term, weight in self.expand(query):
+            for impact, doc_id in self.postings[term][:MAX_POSTINGS_PER_TERM]:
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * impact
+        best = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [{**self.videos[doc_id], "score": round(score, 4)} for doc_id, score in best]
+
+class VideoSearchEngine:
+    """Hot-reloadable wrapper around VideoIndex with an LRU of recent query results."""
+
+    def __init__(self, catalogue_file=VIDEO_CATALOGUE_FILE, cache_size=4096, reload_check_interval=5.0):
+        self.catalogue_file = Path(catalogue_file)
+        self.cache_size = cache_size
+        self.reload_check_interval = reload_check_interval
+        self._index = None
+        self._mtime = None
+        self._last_check = 0.0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self):
+        data = json.loads(self.catalogue_file.read_text(encoding="utf-8"))
+        mtime = self.catalogue_file.stat().st_mtime
+        index = VideoIndex(data.get("videos", []), data.get("default", {}))
+        with self._lock:
+            self._index = index
+            self._mtime = mtime
+            self._cache.clear()
+        print(f"🎥 Video search index loaded with {len(index.videos)} videos and {len(index.vocabulary)} terms")
+        return index
+
+    def _current_index(self):
+        now = time.monotonic()
+        if self._index is None:
+            return self.load()
+        if now - self._last_check >= self.reload_check_interval:
+            self._last_check = now
+            try:
+                if self.catalogue_file.stat().st_mtime != self._mtime:
+                    return self.load()
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Video catalogue reload failed, keeping previous index: {e}")
+        return self._index
+
+    def search(self, query, k=5):
+        index = self._current_index()
+        key = (" ".join(tokenize(query)), k)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and index is self._index:
+                self._cache.move_to_end(key)
+                return cached
+        results = index.search(query, k)
+        with self._lock:
+            if index is self._index:
+                self._cache[key] = results
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return results
+
+    def best_match(self, query):
+        results = self.search(query, 1)
+        if results:
+            return results[0]
+        return None
+
+    def default_video(self, query):
+        default = self._current_index().default
+        return {
+            "video_url": default.get("video_url"),
+            "title": f"{default.get('title', 'Programming Tutorial')}: {query}",
+        }
+
+    def autocomplete(self, prefix, k=8):
+        return [video["title"] for video in self.search(prefix, k)]
+
+video_search_engine = VideoSearchEngine()
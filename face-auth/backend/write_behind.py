@@ -0,0 +1,231 @@
+import os
+import threading
+import time
+from datetime import datetime
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from database import db_connection
+from metrics import metrics
+
+class LoginWriteBehind:
+    """Buffers last_login updates and login audit events off the request path.
+
+    Updates are coalesced per user (only the latest last_login is written) and
+    flushed with a single bulk_write per collection whenever the buffer reaches
+    `max_batch` entries or `flush_interval` seconds have passed. The buffer is
+    bounded: once `max_pending` entries are waiting, producers block for up to
+    `enqueue_timeout` seconds and then write synchronously instead of dropping.
+    A batch whose flush fails goes back into the buffer for the next flush,
+    as far as `max_pending` allows; anything beyond that is counted as dropped.
+    On stop() the final flush is retried up to `final_flush_attempts` times;
+    whatever is still buffered after that is reported as unflushed.
+    """
+
+    def __init__(self, max_batch=500, flush_interval=1.0, max_pending=5000, enqueue_timeout=0.5,
+                 final_flush_attempts=3, final_flush_backoff=0.5):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.enqueue_timeout = enqueue_timeout
+        self.final_flush_attempts = max(1, final_flush_attempts)
+        self.final_flush_backoff = final_flush_backoff
+        self._last_logins = {}
+        self._events = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        metrics.describe("login_write_behind_failures_total", "Failed login write-behind flushes, by collection")
+        metrics.describe("login_write_behind_dropped_total", "Login writes dropped after a failed flush, by collection")
+        metrics.describe("login_write_behind_unflushed_total", "Login writes still buffered when the buffer was stopped")
+
+    def _pending(self):
+        return len(self._last_logins) + len(self._events)
+
+    def start(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="login-write-behind", daemon=True)
+            self._thread.start()
+        print("🧾 Login write-behind buffer started")
+
+    def record_login(self, user_id, email=None, method="face", when=None):
+        when = when or datetime.utcnow()
+        event = {
+            # Fixed up front so a retried flush can't insert the same event twice.
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "email": email,
+            "event": "login",
+            "method": method,
+            "created_at": when,
+        }
+        with self._cond:
+            buffered = self._enqueue(user_id, event)
+        if not buffered:
+            # Outside the lock: a Mongo round trip here must not stall other producers or the flusher.
+            self._write_sync(user_id, event)
+
+    def _enqueue(self, user_id, event):
+        """Buffer one login; False if the caller should write it synchronously. Holds self._cond."""
+        if self._thread is None or self._stopping:
+            return False
+        deadline = time.monotonic() + self.enqueue_timeout
+        while self._pending() >= self.max_pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print("⚠️ Login write-behind buffer full, writing synchronously")
+                return False
+            self._cond.wait(remaining)
+
+        self._merge_last_login(user_id, event["created_at"])
+        self._events.append(event)
+
+        if self._pending() >= self.max_batch:
+            self._cond.notify_all()
+        return True
+
+    def _merge_last_login(self, user_id, when):
+        previous = self._last_logins.get(user_id)
+        if previous is None or previous < when:
+            self._last_logins[user_id] = when
+
+    def _write_sync(self, user_id, event):
+        try:
+            db_connection.get_collection("users").update_one(
+                {"user_id": user_id},
+                {"$set": {"last_login": event["created_at"]}}
+            )
+            db_connection.get_collection("auth_events").insert_one(event)
+        except Exception as e:
+            print(f"❌ Synchronous login write failed for {user_id}: {e}")
+
+    def _drain(self):
+        last_logins, events = self._last_logins, self._events
+        self._last_logins, self._events = {}, []
+        self._cond.notify_all()
+        return last_logins, events
+
+    def _write_batch(self, last_logins, events):
+        if last_logins:
+            try:
+                db_connection.get_collection("users").bulk_write(
+                    [
+                        UpdateOne(
+                            {"user_id": user_id, "$or": [
+                                {"last_login": None},
+                                {"last_login": {"$lt": when}},
+                            ]},
+                            {"$set": {"last_login": when}}
+                        )
+                        for user_id, when in last_logins.items()
+                    ],
+                    ordered=False
+                )
+            except Exception as e:
+                print(f"❌ last_login flush failed ({len(last_logins)} users), re-queued: {e}")
+                metrics.inc("login_write_behind_failures_total", collection="users")
+                self._requeue(last_logins=last_logins)
+        if events:
+            try:
+                db_connection.get_collection("auth_events").bulk_write(
+                    [InsertOne(event) for event in events],
+                    ordered=False
+                )
+            except BulkWriteError as e:
+                # ordered=False: everything not listed in writeErrors is in. Duplicate
+                # keys are events a previous, partly failed flush already inserted.
+                failed = [
+                    events[error["index"]] for error in e.details.get("writeErrors", [])
+                    if error.get("code") != 11000
+                ]
+                if failed:
+                    print(f"❌ Auth event flush failed ({len(failed)} of {len(events)} events), re-queued")
+                    metrics.inc("login_write_behind_failures_total", collection="auth_events")
+                    self._requeue(events=failed)
+            except Exception as e:
+                print(f"❌ Auth event flush failed ({len(events)} events), re-queued: {e}")
+                metrics.inc("login_write_behind_failures_total", collection="auth_events")
+                self._requeue(events=events)
+
+    def _requeue(self, last_logins=None, events=None):
+        with self._cond:
+            room = max(0, self.max_pending - self._pending())
+            dropped_users = dropped_events = 0
+            for user_id, when in (last_logins or {}).items():
+                if user_id in self._last_logins:
+                    self._merge_last_login(user_id, when)
+                elif room > 0:
+                    self._last_logins[user_id] = when
+                    room -= 1
+                else:
+                    dropped_users += 1
+            events = events or []
+            kept = events[:room]
+            dropped_events = len(events) - len(kept)
+            self._events[:0] = kept
+        if dropped_users:
+            metrics.inc("login_write_behind_dropped_total", dropped_users, collection="users")
+        if dropped_events:
+            metrics.inc("login_write_behind_dropped_total", dropped_events, collection="auth_events")
+        if dropped_users or dropped_events:
+            print(f"⚠️ Login write-behind buffer full, dropped {dropped_users} last_login and {dropped_events} audit writes")
+
+    def flush(self):
+        with self._cond:
+            last_logins, events = self._drain()
+        self._write_batch(last_logins, events)
+        return len(last_logins) + len(events)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping and self._pending() < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                stopping = self._stopping
+                last_logins, events = self._drain()
+            self._write_batch(last_logins, events)
+            if stopping:
+                return
+
+    def stop(self, timeout=10.0):
+        with self._cond:
+            thread = self._thread
+            self._stopping = True
+            self._cond.notify_all()
+        if thread:
+            thread.join(timeout)
+        with self._cond:
+            self._thread = None
+
+        flushed = 0
+        for attempt in range(self.final_flush_attempts):
+            if attempt:
+                time.sleep(self.final_flush_backoff * attempt)
+            drained = self.flush()
+            with self._cond:
+                left = self._pending()
+            # A failed write re-queues itself, so what was drained minus what came back got written.
+            flushed += max(0, drained - left)
+            if not left:
+                break
+
+        if left:
+            metrics.inc("login_write_behind_unflushed_total", left)
+            print(f"❌ Login write-behind buffer stopped with {left} writes unflushed after "
+                  f"{self.final_flush_attempts} attempts")
+        else:
+            print(f"🧾 Login write-behind buffer stopped (flushed {flushed} pending writes)")
+
+login_write_behind = LoginWriteBehind(
+    max_batch=int(os.getenv("LOGIN_WRITE_BATCH", 500)),
+    flush_interval=float(os.getenv("LOGIN_WRITE_INTERVAL", 1.0)),
+    max_pending=int(os.getenv("LOGIN_WRITE_MAX_PENDING", 5000)),
+    final_flush_attempts=int(os.getenv("LOGIN_WRITE_FINAL_FLUSH_ATTEMPTS", 3)),
+)
@@ -1,4 +1,10 @@
 export const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || "http://localhost:8000";
+const SESSION_TOKEN_KEY = "faceAuthToken";
+
+function sessionHeaders() {
+  const token = localStorage.getItem(SESSION_TOKEN_KEY);
+  return token ? { Authorization: `Bearer ${token}` } : {};
+}
 
 export async function getAccounts() {
   const res = await fetch(`${API_BASE_URL}/api/accounts`);
@@ -8,6 +14,41 @@ export async function getAccounts() {
   return res.json();
 }
 
+export async function getAccountChanges(since) {
+  const res = await fetch(`${API_BASE_URL}/api/accounts?since=${since}`);
+  if (!res.ok) {
+    throw new Error("Failed to fetch account changes");
+  }
+  return res.json();
+}
+
+export function applyAccountChanges(accounts, changes) {
+  const byId = new Map(accounts.map((account) => [account.id, account]));
+  for (const change of changes) {
+    if (change.op === "add") {
+      byId.set(change.id, change.account);
+    } else {
+      byId.delete(change.id);
+    }
+  }
+  return Array.from(byId.values());
+}
+
+export function openAccountFeed({ onSnapshot, onChanges, onError } = {}) {
+  // EventSource resends the last event id on reconnect, so the server resumes the delta stream.
+  const source = new EventSource(`${API_BASE_URL}/api/accounts/stream`);
+  source.addEventListener("snapshot", (event) => {
+    const { accounts, version } = JSON.parse(event.data);
+    onSnapshot?.(accounts, version);
+  });
+  source.addEventListener("changes", (event) => {
+    const { changes, version } = JSON.parse(event.data);
+    onChanges?.(changes, version);
+  });
+  source.onerror = () => onError?.(new Error("Account feed disconnected"));
+  return () => source.close();
+}
+
 export async function createCustomAccount(fullName, file) {
   const formData = new FormData();
   formData.append("full_name", fullName);
@@ -41,6 +82,41 @@ export async function faceLogin(accountId, success) {
   return res.json();
 }
 
+export async function verifyFace(accountId, faceImage, faceBoxes) {
+  const formData = new FormData();
+  formData.append("accountId", accountId);
+  formData.append("face_image", faceImage);
+  if (faceBoxes) {
+    // [[x, y, width, height], ...] from face-api detections; lets the server reject bad frames early.
+    formData.append("face_boxes", JSON.stringify(faceBoxes));
+  }
+
+  const res = await fetch(`${API_BASE_URL}/api/auth/verify`, {
+    method: "POST",
+    body: formData,
+  });
+  if (!res.ok) {
+    throw new Error("Failed to verify face");
+  }
+
+  const data = await res.json();
+  if (data.token) {
+    localStorage.setItem(SESSION_TOKEN_KEY, data.token);
+  }
+  return data;
+}
+
+export async function logout() {
+  const headers = sessionHeaders();
+  localStorage.removeItem(SESSION_TOKEN_KEY);
+  if (!headers.Authorization) return;
+  try {
+    await fetch(`${API_BASE_URL}/api/auth/logout`, { method: "POST", headers });
+  } catch (err) {
+    console.error("Failed to end session on backend", err);
+  }
+}
+
 export async function submitGuidedSolvingEvent(eventData) {
   const res = await fetch(`${API_BASE_URL}/api/guided-solving`, {
     method: "POST",
@@ -73,8 +149,48 @@ export async function submitLiveDoubtEvent(eventData) {
   return res.json();
 }
 
+export async function streamLiveDoubt(eventData, { onChunk, onDone } = {}) {
+  const res = await fetch(`${API_BASE_URL}/api/live-doubt/stream`, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify(eventData),
+  });
+  if (!res.ok || !res.body) {
+    throw new Error("Failed to stream doubt from backend");
+  }
+
+  const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = "";
+  let text = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += value;
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const type = frame.match(/^event: (.*)$/m)?.[1];
+      const data = JSON.parse(frame.match(/^data: (.*)$/m)?.[1] || "{}");
+      if (type === "chunk") {
+        text += data.text;
+        onChunk?.(data.text, text);
+      } else if (type === "done") {
+        onDone?.({ ...data, text });
+      } else if (type === "error") {
+        throw new Error(data.detail || "Doubt stream failed");
+      }
+    }
+  }
+  return text;
+}
+
 export async function getUserDashboard(userId) {
-  const res = await fetch(`${API_BASE_URL}/api/user/${userId}/dashboard`);
+  const res = await fetch(`${API_BASE_URL}/api/user/${userId}/dashboard`, {
+    headers: sessionHeaders(),
+  });
   if (!res.ok) {
     throw new Error("Failed to fetch dashboard data");
   }
@@ -82,13 +198,30 @@ export async function getUserDashboard(userId) {
 }
 
 export async function getFlashcards(userId) {
-  const res = await fetch(`${API_BASE_URL}/api/user/${userId}/flashcards`);
+  const res = await fetch(`${API_BASE_URL}/api/user/${userId}/flashcards`, {
+    headers: sessionHeaders(),
+  });
   if (!res.ok) {
     throw new Error("Failed to fetch flashcards");
   }
   return res.json();
 }
 
+export async function submitFlashcardReviews(userId, reviews) {
+  const res = await fetch(`${API_BASE_URL}/api/user/${userId}/flashcards/reviews`, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+      ...sessionHeaders(),
+    },
+    body: JSON.stringify({ reviews }),
+  });
+  if (!res.ok) {
+    throw new Error("Failed to submit flashcard reviews");
+  }
+  return res.json();
+}
+
 export async function searchVideo(query) {
   const res = await fetch(`${API_BASE_URL}/api/video/search`, {
     method: "POST",
@@ -102,3 +235,25 @@ export async function searchVideo(query) {
   }
   return res.json();
 }
+
+export function openFaceAuthStream({ onProgress, onResult, onError } = {}) {
+  const socket = new WebSocket(`${API_BASE_URL.replace(/^http/, "ws")}/ws/authenticate`);
+  socket.binaryType = "arraybuffer";
+
+  socket.onmessage = (event) => {
+    const message = JSON.parse(event.data);
+    if (message.type === "result") {
+      onResult?.(message);
+    } else if (message.type === "error") {
+      onError?.(new Error(message.message));
+    } else {
+      onProgress?.(message);
+    }
+  };
+  socket.onerror = () => onError?.(new Error("Face authentication stream failed"));
+
+  return {
+    sendFrame: (blob) => socket.readyState === WebSocket.OPEN && socket.send(blob),
+    close: () => socket.close(),
+  };
+}
@@ -3,7 +3,7 @@ import * as faceapi from "face-api.js";
 import AuthIdle from "../assets/images/auth-idle.svg";
 import AuthFace from "../assets/images/auth-face.svg";
 import { Navigate, useLocation, useNavigate } from "react-router-dom";
-import { faceLogin } from "../api/client";
+import { faceLogin, verifyFace } from "../api/client";
 
 function Login() {
   const [tempAccount, setTempAccount] = useState("");
@@ -17,6 +17,7 @@ function Login() {
   const videoRef = useRef();
   const canvasRef = useRef();
   const faceApiIntervalRef = useRef();
+  const sessionRequestedRef = useRef(false);
   const videoWidth = 640;
   const videoHeight = 360;
 
@@ -118,10 +119,21 @@ function Login() {
 
       if (results.length > 0 && tempAccount.id === results[0].label) {
         setLoginResult("SUCCESS");
-        try {
-          await faceLogin(tempAccount.id, true);
-        } catch (err) {
-          console.error("Failed to notify backend about face login", err);
+        if (!sessionRequestedRef.current) {
+          sessionRequestedRef.current = true;
+          try {
+            await faceLogin(tempAccount.id, true);
+          } catch (err) {
+            console.error("Failed to notify backend about face login", err);
+          }
+          // Only a server-side match issues a session token; without one the
+          // backend serves this user only while SESSION_TOKENS_REQUIRED is off.
+          try {
+            const frame = await captureFrame(videoRef.current);
+            await verifyFace(tempAccount.id, frame);
+          } catch (err) {
+            console.error("Failed to verify face with backend", err);
+          }
         }
       } else {
         setLoginResult("FAILED");
@@ -134,6 +146,14 @@ function Login() {
     faceApiIntervalRef.current = faceApiInterval;
   };
 
+  function captureFrame(video) {
+    const canvas = document.createElement("canvas");
+    canvas.width = video.videoWidth;
+    canvas.height = video.videoHeight;
+    canvas.getContext("2d").drawImage(video, 0, 0, canvas.width, canvas.height);
+    return new Promise((resolve) => canvas.toBlob(resolve, "image/jpeg", 0.92));
+  }
+
   async function loadLabeledImages() {
     if (!tempAccount) {
       return null;
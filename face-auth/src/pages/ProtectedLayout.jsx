@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
+import { logout } from '../api/client';
 
 const ProtectedLayout = ({ children, account }) => {
   const [showDropdown, setShowDropdown] = useState(false);
@@ -108,6 +109,7 @@ const ProtectedLayout = ({ children, account }) => {
              <div 
               onClick={() => {
                 localStorage.removeItem("faceAuth");
+                logout();
                 navigate("/");
               }}
               className="flex items-center gap-4 p-4 rounded-2xl bg-red-500/10 border border-transparent hover:border-red-500/30 hover:bg-red-500/20 transition-all duration-300 cursor-pointer text-red-600 font-bold"
@@ -146,6 +148,7 @@ const ProtectedLayout = ({ children, account }) => {
               <button
                 onClick={() => {
                   localStorage.removeItem("faceAuth");
+                  logout();
                   navigate("/");
                 }}
                 className="w-full flex items-center gap-3 px-4 py-3 text-red-600 hover:bg-red-50 transition-colors text-sm font-bold"
@@ -2,7 +2,13 @@ import React, { useEffect, useState } from "react";
 import User from "../components/User";
 import { RadioGroup } from "@headlessui/react";
 import { Link } from "react-router-dom";
-import { API_BASE_URL, createCustomAccount, getAccounts } from "../api/client";
+import {
+  API_BASE_URL,
+  applyAccountChanges,
+  createCustomAccount,
+  getAccounts,
+  openAccountFeed,
+} from "../api/client";
 
 function UserSelect() {
   const [accounts, setAccounts] = useState([]);
@@ -12,16 +18,34 @@ function UserSelect() {
   const [loading, setLoading] = useState(false);
 
   useEffect(() => {
-    getAccounts()
-      .then((data) => {
+    let fed = false;
+    const close = openAccountFeed({
+      onSnapshot: (data) => {
+        fed = true;
+        setErrorMessage(null);
         setAccounts(data);
-        if (data.length > 0) {
-          setSelected(data[0]);
-        }
-      })
-      .catch(() => {
-        setErrorMessage("Failed to load accounts from server.");
-      });
+        setSelected((current) => current ?? data[0] ?? null);
+      },
+      onChanges: (changes) => {
+        setAccounts((current) => applyAccountChanges(current, changes));
+      },
+      onError: () => {
+        if (fed) return;
+        // No feed yet (e.g. an older backend): fall back to a one-off fetch.
+        fed = true;
+        getAccounts()
+          .then((data) => {
+            setAccounts(data);
+            if (data.length > 0) {
+              setSelected(data[0]);
+            }
+          })
+          .catch(() => {
+            setErrorMessage("Failed to load accounts from server.");
+          });
+      },
+    });
+    return close;
   }, []);
 
   const convertBase64 = (file) => {